@@ -69,19 +69,31 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+# LANDSNAP_LOG_FORMAT=json writes one JSON object per record, tagged with the
+# trace, span and result ids of the request or job that logged it
+LANDSNAP_LOG_FORMAT = os.getenv('LANDSNAP_LOG_FORMAT', 'text')
+
 LOGGING = {
     'version': 1,
+    'formatters': {
+        'json': {'()': 'landsnap.tracing.JsonFormatter'},
+    },
+    'filters': {
+        'trace_context': {'()': 'landsnap.tracing.TraceContextFilter'},
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
             'class': 'logging.FileHandler',
             'filename': 'debug.log',
+            'filters': ['trace_context'],
+            **({'formatter': 'json'} if LANDSNAP_LOG_FORMAT == 'json' else {}),
         },
     },
     'loggers': {
         'landsnap': {
             'handlers': ['file'],
-            'level': 'DEBUG',
+            'level': os.getenv('LANDSNAP_LOG_LEVEL', 'DEBUG'),
         },
     },
 }
@@ -110,4 +122,110 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #     SECURE_HSTS_SECONDS = 31536000 
 #     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
 #     SECURE_HSTS_PRELOAD = True
-#     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
\ No newline at end of file
+#     SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+
+def retention_days(name, default):
+    value = os.getenv(name, str(default)).strip()
+    return None if value.lower() in ('', 'none') else int(value)
+
+
+# Retention: days to keep an upload and its files, keyed by AnalysisResult
+# status (uploads without a result count as PENDING; queued and running ones are
+# aged from when they were last queued). None keeps forever; set
+# the variable to an empty value or 'none' for that.
+LANDSNAP_RETENTION_DAYS = {
+    'COMPLETE': retention_days('LANDSNAP_RETAIN_COMPLETE_DAYS', 90),
+    'FAILED': retention_days('LANDSNAP_RETAIN_FAILED_DAYS', 7),
+    'PENDING': retention_days('LANDSNAP_RETAIN_PENDING_DAYS', 2),
+    'PROCESSING': retention_days('LANDSNAP_RETAIN_PROCESSING_DAYS', 2),
+    'CANCELLED': retention_days('LANDSNAP_RETAIN_CANCELLED_DAYS', 1),
+}
+# Files younger than this are never treated as orphans, so in-flight uploads are safe
+LANDSNAP_ORPHAN_GRACE_HOURS = int(os.getenv('LANDSNAP_ORPHAN_GRACE_HOURS', 24))
+
+# Heatmap storage encoding: png, webp, webp-lossless, jpeg, or mask (a 1-bit
+# change mask; the composite is rendered when it is viewed or downloaded)
+LANDSNAP_HEATMAP_FORMAT = os.getenv('LANDSNAP_HEATMAP_FORMAT', 'png')
+# PNG zlib level 0-9; unset keeps OpenCV's speed-tuned default (see
+# `manage.py benchmark_heatmap`), higher levels trade encode time for size
+LANDSNAP_HEATMAP_PNG_COMPRESSION = (int(os.environ['LANDSNAP_HEATMAP_PNG_COMPRESSION'])
+                                    if os.getenv('LANDSNAP_HEATMAP_PNG_COMPRESSION') else None)
+LANDSNAP_HEATMAP_WEBP_QUALITY = int(os.getenv('LANDSNAP_HEATMAP_WEBP_QUALITY', 90))
+LANDSNAP_HEATMAP_JPEG_QUALITY = int(os.getenv('LANDSNAP_HEATMAP_JPEG_QUALITY', 90))
+
+# Addresses (IPs or CIDR ranges) of reverse proxies whose X-Forwarded-For is
+# believed. Clients are otherwise identified by the connection's address, so
+# set this when running behind a load balancer.
+LANDSNAP_TRUSTED_PROXIES = [p.strip() for p in os.getenv('LANDSNAP_TRUSTED_PROXIES', '').split(',') if p.strip()]
+
+# JSON API limits. Submissions are rate limited per client IP over a sliding
+# window. With inline analysis a request analyses all its pairs before
+# responding, so it takes at most MAX_INLINE_PAIRS.
+LANDSNAP_API_MAX_PAIRS = int(os.getenv('LANDSNAP_API_MAX_PAIRS', 50))
+LANDSNAP_API_MAX_INLINE_PAIRS = int(os.getenv('LANDSNAP_API_MAX_INLINE_PAIRS', 4))
+LANDSNAP_API_MAX_STATUS_IDS = int(os.getenv('LANDSNAP_API_MAX_STATUS_IDS', 500))
+LANDSNAP_API_RATE_LIMIT = int(os.getenv('LANDSNAP_API_RATE_LIMIT', 500))
+LANDSNAP_API_RATE_WINDOW = int(os.getenv('LANDSNAP_API_RATE_WINDOW', 3600))
+
+# Run analysis inside the web request. Defaults to DEBUG: handy in development,
+# since nothing else needs to run, but each upload then holds a web worker for
+# the whole analysis, loads OpenCV/NumPy into it and is refused (429) rather
+# than queued when the budget is full. Otherwise uploads are queued, and
+# `python manage.py runworker` must run alongside the web process to analyse them.
+LANDSNAP_INLINE_ANALYSIS = os.getenv('LANDSNAP_INLINE_ANALYSIS', str(DEBUG)).lower() == 'true'
+LANDSNAP_WORKER_POLL_INTERVAL = float(os.getenv('LANDSNAP_WORKER_POLL_INTERVAL', 2))
+
+# Admission control: analyses are sized from image dimensions, and no more
+# than this much estimated peak memory / this many jobs run at once. Queued
+# uploads are refused (429) once the estimated backlog of their priority class
+# and more urgent ones exceeds the limit.
+LANDSNAP_ANALYSIS_MEMORY_BUDGET_MB = int(os.getenv('LANDSNAP_ANALYSIS_MEMORY_BUDGET_MB', 4096))
+LANDSNAP_ANALYSIS_MAX_CONCURRENT = int(os.getenv('LANDSNAP_ANALYSIS_MAX_CONCURRENT', os.cpu_count() or 1))
+LANDSNAP_QUEUE_MAX_BACKLOG = int(os.getenv('LANDSNAP_QUEUE_MAX_BACKLOG', 1800))
+
+# Scheduling of queued analyses: interactive uploads before API batches,
+# clients that used the least estimated CPU time in the window first,
+# shortest jobs first within a client. Anything waiting longer than
+# MAX_WAIT seconds goes ahead of everything else.
+LANDSNAP_FAIR_SHARE_WINDOW = int(os.getenv('LANDSNAP_FAIR_SHARE_WINDOW', 3600))
+LANDSNAP_SCHEDULER_MAX_WAIT = int(os.getenv('LANDSNAP_SCHEDULER_MAX_WAIT', 900))
+# Workers only rank the first DEPTH jobs of each client's queue when claiming,
+# so a claim costs the same however long the queue grows
+LANDSNAP_SCHEDULER_DEPTH = int(os.getenv('LANDSNAP_SCHEDULER_DEPTH', 20))
+# Queue positions shown to waiting clients come from a ranking of the whole
+# queue, cached (in the default cache, per process unless CACHES is shared)
+# for this many seconds
+LANDSNAP_QUEUE_POSITION_TTL = int(os.getenv('LANDSNAP_QUEUE_POSITION_TTL', 5))
+
+# Workers hold a lease on each running analysis and renew it every
+# HEARTBEAT_INTERVAL seconds; leases that lapse are reaped (requeued up to
+# MAX_ATTEMPTS times, then failed). Each pipeline stage is killed once it runs
+# past its limit, or STAGE_TIME_FACTOR times the job's estimated time if longer.
+LANDSNAP_LEASE_SECONDS = int(os.getenv('LANDSNAP_LEASE_SECONDS', 60))
+LANDSNAP_HEARTBEAT_INTERVAL = float(os.getenv('LANDSNAP_HEARTBEAT_INTERVAL', 10))
+LANDSNAP_MAX_ATTEMPTS = int(os.getenv('LANDSNAP_MAX_ATTEMPTS', 2))
+LANDSNAP_STAGE_TIME_LIMITS = {
+    'start': int(os.getenv('LANDSNAP_STAGE_LIMIT_START', 60)),
+    'heatmap': int(os.getenv('LANDSNAP_STAGE_LIMIT_HEATMAP', 300)),
+    'changes': int(os.getenv('LANDSNAP_STAGE_LIMIT_CHANGES', 300)),
+    'tiles': int(os.getenv('LANDSNAP_STAGE_LIMIT_TILES', 3600)),
+    'hash': int(os.getenv('LANDSNAP_STAGE_LIMIT_HASH', 120)),
+}
+LANDSNAP_STAGE_TIME_FACTOR = float(os.getenv('LANDSNAP_STAGE_TIME_FACTOR', 10))
+
+# Resumable (tus-style) uploads: largest accepted PATCH body, and how long an
+# idle unfinished upload is kept before `purge_media` removes it
+LANDSNAP_UPLOAD_CHUNK_MAX = int(os.getenv('LANDSNAP_UPLOAD_CHUNK_MAX', 8 * 1024 * 1024))
+LANDSNAP_UPLOAD_SESSION_HOURS = int(os.getenv('LANDSNAP_UPLOAD_SESSION_HOURS', 24))
+# Per client: resumable uploads open at once (unfinished or not yet submitted),
+# and their combined declared size. Enough for two 4GB rasters by default.
+LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS = int(os.getenv('LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS', 8))
+LANDSNAP_UPLOAD_MAX_OPEN_MB = int(os.getenv('LANDSNAP_UPLOAD_MAX_OPEN_MB', 8192))
+
+# Tracing of uploads, queued jobs and pipeline stages as OpenTelemetry spans.
+# LANDSNAP_TRACE_EXPORTER is '' (off), 'file' (OTLP/JSON lines appended to
+# LANDSNAP_TRACE_FILE) or 'otlp' (posted to an OTLP/HTTP collector).
+LANDSNAP_TRACE_EXPORTER = os.getenv('LANDSNAP_TRACE_EXPORTER', '')
+LANDSNAP_TRACE_FILE = os.getenv('LANDSNAP_TRACE_FILE', os.path.join(BASE_DIR, 'traces.jsonl'))
+LANDSNAP_OTLP_ENDPOINT = os.getenv('LANDSNAP_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+LANDSNAP_TRACE_SAMPLE_RATE = float(os.getenv('LANDSNAP_TRACE_SAMPLE_RATE', 1))
@@ -1,8 +1,87 @@
-from django.contrib import admin
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import ImageUpload, AnalysisResult
+from .jobs import request_cancel
+from .models import ImageUpload, AnalysisResult, DailyRollup
+from .utils.reanalysis import queue_reanalysis
+from .utils.rollups import describe, summarize
+
+
+def _results_for(queryset):
+    if queryset.model is ImageUpload:
+        return AnalysisResult.objects.filter(upload__in=queryset)
+    return queryset
+
+
+def _queue_reanalysis(modeladmin, request, results, force):
+    # Workers run the analyses; the admin only puts them back on the queue
+    stats = queue_reanalysis(results, force=force)
+    message = stats.summary()
+    if settings.LANDSNAP_INLINE_ANALYSIS:
+        message += "; run `manage.py runworker` or `manage.py reanalyze --run` to process them"
+    modeladmin.message_user(request, message, messages.WARNING if stats.busy else messages.SUCCESS)
+
+
+@admin.action(description='Reanalyze selected (skip unchanged)')
+def reanalyze_changed(modeladmin, request, queryset):
+    _queue_reanalysis(modeladmin, request, _results_for(queryset), force=False)
+
+
+@admin.action(description='Reanalyze selected (force)')
+def reanalyze_force(modeladmin, request, queryset):
+    _queue_reanalysis(modeladmin, request, _results_for(queryset), force=True)
+
+
+@admin.action(description='Cancel selected analyses')
+def cancel_analyses(modeladmin, request, queryset):
+    cancelled = sum(request_cancel(result) for result in queryset.filter(status__in=('PENDING', 'PROCESSING')))
+    modeladmin.message_user(request, f"Cancelled or stopping {cancelled} analyses", messages.SUCCESS)
+
+
+class IntensityFilter(admin.SimpleListFilter):
+    """
+    Filters on the indexed intensity column. The counts come from the daily
+    rollups, so they are all-time totals that ignore the other active filters.
+    """
+    title = 'change intensity'
+    parameter_name = 'intensity'
+
+    def lookups(self, request, model_admin):
+        totals = summarize(DailyRollup.objects.all())
+        return [(item['code'], f"{item['label']} ({item['count']} all time)") for item in totals['intensities']]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(change_intensity=self.value())
+        return queryset
+
+
+class RollupDayFilter(admin.SimpleListFilter):
+    """Recent days with finished analyses, listed from the rollups instead of a scan for distinct dates"""
+    title = 'day'
+    parameter_name = 'day'
+    DAYS_LISTED = 14
+
+    def lookups(self, request, model_admin):
+        return [
+            (rollup.day.isoformat(), f"{rollup.day.isoformat()} ({rollup.finished + rollup.cancelled} finished)")
+            for rollup in DailyRollup.objects.all()[:self.DAYS_LISTED]
+        ]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            start = timezone.make_aware(datetime.combine(date.fromisoformat(self.value()), time.min))
+        except ValueError as e:
+            raise IncorrectLookupParameters(e)
+        return queryset.filter(created_at__gte=start, created_at__lt=start + timedelta(days=1))
+
 
 @admin.register(ImageUpload)
 class ImageUploadAdmin(admin.ModelAdmin):
@@ -11,6 +90,7 @@ class ImageUploadAdmin(admin.ModelAdmin):
     list_filter = ('uploaded_at',)
     search_fields = ('ip_address',)
     date_hierarchy = 'uploaded_at'
+    actions = [reanalyze_changed, reanalyze_force]
     fieldsets = (
         (None, {
             'fields': ('image1', 'image1_preview', 'image2', 'image2_preview')
@@ -43,14 +123,23 @@ class ImageUploadAdmin(admin.ModelAdmin):
 
 @admin.register(AnalysisResult)
 class AnalysisResultAdmin(admin.ModelAdmin):
-    list_display = ('id', 'upload_link', 'change_percentage', 'processing_time', 'created_at', 'heatmap_preview')
-    readonly_fields = ('created_at', 'heatmap_preview', 'change_percentage', 'processing_time', 'upload_link')
-    list_filter = ('created_at', 'change_percentage')
+    list_display = ('id', 'upload_link', 'status', 'priority', 'change_percentage', 'change_intensity',
+                    'processing_time', 'queue_wait', 'created_at', 'heatmap_preview')
+    readonly_fields = ('created_at', 'heatmap_preview', 'change_percentage', 'change_intensity', 'processing_time',
+                       'upload_link', 'queued_at', 'started_at', 'queue_wait', 'estimated_memory',
+                       'estimated_seconds', 'worker_id', 'lease_expires_at', 'attempts')
+    # Filtering by the continuous change_percentage or a date_hierarchy would scan the whole table
+    list_filter = ('status', 'priority', IntensityFilter, RollupDayFilter)
     search_fields = ('upload__id',)
-    date_hierarchy = 'created_at'
+    actions = [reanalyze_changed, reanalyze_force, cancel_analyses]
     fieldsets = (
         ('Results', {
-            'fields': ('upload_link', 'heatmap_preview', 'change_percentage', 'processing_time')
+            'fields': ('upload_link', 'heatmap_preview', 'change_percentage', 'change_intensity', 'processing_time')
+        }),
+        ('Scheduling', {
+            'fields': ('priority', 'queued_at', 'started_at', 'queue_wait', 'estimated_memory', 'estimated_seconds',
+                       'worker_id', 'lease_expires_at', 'attempts', 'cancel_requested', 'error_message'),
+            'classes': ('collapse',)
         }),
         ('Metadata', {
             'fields': ('created_at',),
@@ -59,9 +148,14 @@ class AnalysisResultAdmin(admin.ModelAdmin):
     )
 
     def heatmap_preview(self, obj):
-        if obj.heatmap:
-            return format_html('<img src="{}" style="max-height: 200px; max-width: 200px;" />', obj.heatmap.url)
-        return "-"
+        if not obj.heatmap:
+            return "-"
+        # A stored change mask is rendered into the composite on request, as on the result page
+        if obj.heatmap_is_mask:
+            url = reverse('landsnap:heatmap_image', kwargs={'result_id': obj.upload.result_id})
+        else:
+            url = obj.heatmap.url
+        return format_html('<img src="{}" style="max-height: 200px; max-width: 200px;" />', url)
     heatmap_preview.short_description = 'Heatmap Preview'
 
     def upload_link(self, obj):
@@ -71,4 +165,29 @@ class AnalysisResultAdmin(admin.ModelAdmin):
     upload_link.allow_tags = True
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('upload')
\ No newline at end of file
+        return super().get_queryset(request).select_related('upload')
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'completed', 'failed', 'cancelled', 'failure_rate_display', 'mean_time_display',
+                    'p95_time_display')
+    readonly_fields = ('day', 'completed', 'failed', 'cancelled', 'intensity_counts', 'processing_time_total',
+                       'processing_time_histogram', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def failure_rate_display(self, obj):
+        percentage = describe(obj)['failure_percentage']
+        return f"{percentage:.1f}%" if percentage is not None else "-"
+    failure_rate_display.short_description = 'Failure Rate'
+
+    def mean_time_display(self, obj):
+        return f"{obj.mean_processing_time:.2f}s" if obj.mean_processing_time is not None else "-"
+    mean_time_display.short_description = 'Mean Time'
+
+    def p95_time_display(self, obj):
+        seconds = describe(obj)['p95_processing_time']
+        return f"{seconds:.2f}s" if seconds is not None else "-"
+    p95_time_display.short_description = 'p95 Time'
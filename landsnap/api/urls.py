@@ -0,0 +1,15 @@
+from django.urls import path
+from .views import (
+    PairSubmitView, ResultCancelView, ResultDetailView, ResultStatusView, UploadCreateView, UploadDetailView,
+)
+
+app_name = 'api_v1'
+
+urlpatterns = [
+    path('pairs/', PairSubmitView.as_view(), name='pair_submit'),
+    path('uploads/', UploadCreateView.as_view(), name='upload_create'),
+    path('uploads/<uuid:upload_id>/', UploadDetailView.as_view(), name='upload_detail'),
+    path('results/', ResultStatusView.as_view(), name='result_status'),
+    path('results/<uuid:result_id>/', ResultDetailView.as_view(), name='result_detail'),
+    path('results/<uuid:result_id>/cancel/', ResultCancelView.as_view(), name='result_cancel'),
+]
@@ -0,0 +1,393 @@
+import hashlib
+import json
+import logging
+import math
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from ..forms import UploadForm
+from ..jobs import request_cancel
+from ..models import ImageUpload, AnalysisResult, UploadSession
+from ..tracing import current_span, span, traced_view
+from ..utils.admission import AdmissionRejected, current_load
+from ..utils.chunked import (
+    CHECKSUM_ALGORITHMS, SESSION_FIELDS, TUS_VERSION, ChunkError, append_chunk, close_files, create_session,
+    discard_session, parse_checksum, parse_metadata, session_files,
+)
+from ..utils.scheduler import queue_position, queue_positions
+from ..views import AnalysisProgressView, UploadView
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_result(result, queue=None):
+    """
+    JSON-ready status for one analysis result. `queue` holds precomputed
+    'positions' (by pk) and 'length' when serializing many results.
+    """
+    result_id = str(result.upload.result_id)
+    data = {
+        'result_id': result_id,
+        'status': result.status,
+        'progress': AnalysisProgressView().calculate_progress(result.status),
+        'status_url': reverse('landsnap:api_v1:result_detail', kwargs={'result_id': result_id}),
+    }
+    if result.status == 'PENDING':
+        if queue is None:
+            queue = {'positions': {result.pk: queue_position(result)}, 'length': current_load().queued}
+        data.update({
+            'queue_position': queue['positions'].get(result.pk),
+            'queue_length': queue['length'],
+        })
+    elif result.status == 'PROCESSING':
+        data['cancel_requested'] = result.cancel_requested
+    elif result.status in ('FAILED', 'CANCELLED'):
+        data['error'] = result.error_message
+    elif result.status == 'COMPLETE':
+        data.update({
+            'change_percentage': result.change_percentage,
+            'processing_time': result.processing_time,
+            'roi': result.roi,
+            'result_url': reverse('landsnap:analysis_result', kwargs={'result_id': result_id}),
+            'heatmap_url': reverse('landsnap:download_heatmap', kwargs={'result_id': result_id, 'format': 'png'}),
+        })
+    return data
+
+
+def etag_for(payload):
+    return quote_etag(hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest())
+
+
+def conditional_json(request, payload, status=200):
+    """JsonResponse with an ETag, or 304 when the client already has this payload"""
+    etag = etag_for(payload)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or '*' in parse_etags(if_none_match)):
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(payload, status=status)
+    response['ETag'] = etag
+    return response
+
+
+def rate_limit_retry_after(ip_address, pairs):
+    """
+    Seconds the client must wait before submitting `pairs` more uploads, or
+    None if it is within LANDSNAP_API_RATE_LIMIT for the current window.
+    Counts the client's recent ImageUpload rows via the (ip_address, uploaded_at) index.
+    """
+    limit = settings.LANDSNAP_API_RATE_LIMIT
+    window = timedelta(seconds=settings.LANDSNAP_API_RATE_WINDOW)
+    now = timezone.now()
+    recent = ImageUpload.objects.filter(ip_address=ip_address, uploaded_at__gte=now - window)
+    used = recent.count()
+    excess = used + pairs - limit
+    if excess <= 0:
+        return None
+    if excess > used:
+        # Even an empty window would not fit this many pairs
+        return settings.LANDSNAP_API_RATE_WINDOW
+    freed_at = recent.order_by('uploaded_at').values_list('uploaded_at', flat=True)[excess - 1] + window
+    return max(math.ceil((freed_at - now).total_seconds()), 1)
+
+
+def busy_response(retry_after, error='Analysis capacity exhausted'):
+    response = JsonResponse({'error': error, 'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def parse_result_ids(values):
+    ids = []
+    for value in values:
+        try:
+            ids.append(uuid.UUID(str(value)))
+        except ValueError:
+            raise ValueError(f"Invalid result id: {value}")
+    return ids
+
+
+def collect_pairs(files, data=None):
+    """
+    Group uploaded files into (files, data) pairs for UploadForm. A single
+    pair uses `image1`/`image2`; several pairs use `image1_<n>`/`image2_<n>`
+    with n counting from 0. Instead of a file, `image1_upload`/`image1_upload_<n>`
+    (and likewise for image2) can name a finished resumable upload. An
+    optional `roi`/`roi_<n>` restricts the pair's analysis to a region.
+    """
+    data = data or {}
+
+    def present(suffix):
+        return any(f'{field}{suffix}' in files or f'{field}_upload{suffix}' in data for field in SESSION_FIELDS)
+
+    def pair(suffix):
+        pair_files = {field: files.get(f'{field}{suffix}') for field in SESSION_FIELDS}
+        return {**pair_files, **session_files(data, suffix)}, {'roi': data.get(f'roi{suffix}', '')}
+
+    if present(''):
+        return [pair('')]
+    pairs = []
+    while present(f'_{len(pairs)}'):
+        pairs.append(pair(f'_{len(pairs)}'))
+    return pairs
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PairSubmitView(UploadView):
+    """
+    POST /api/v1/pairs/
+    Submit one or more before/after pairs as multipart form data.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    @traced_view('PairSubmitView.post')
+    def post(self, request, *args, **kwargs):
+        try:
+            pairs = collect_pairs(request.FILES, request.POST)
+        except ValidationError as e:
+            errors = {field: error[0] for field, error in e.message_dict.items()}
+            return JsonResponse({'error': 'Invalid upload reference', 'errors': errors}, status=400)
+        if not pairs:
+            return JsonResponse({'error': 'No image pairs submitted'}, status=400)
+        inline = settings.LANDSNAP_INLINE_ANALYSIS
+        # Inline analysis runs every pair inside this request, so keep batches short
+        max_pairs = settings.LANDSNAP_API_MAX_INLINE_PAIRS if inline else settings.LANDSNAP_API_MAX_PAIRS
+        if len(pairs) > max_pairs:
+            return JsonResponse({
+                'error': f'At most {max_pairs} pairs per request'
+            }, status=400)
+
+        try:
+            return self.submit_pairs(request, pairs)
+        finally:
+            for pair_files, _pair_data in pairs:
+                close_files(pair_files)
+
+    def submit_pairs(self, request, pairs):
+        ip_address = self.get_client_ip(request)
+        retry_after = rate_limit_retry_after(ip_address, len(pairs))
+        if retry_after is not None:
+            return busy_response(retry_after, 'Rate limit exceeded')
+
+        current_span().set('landsnap.pairs', len(pairs))
+        # Validate everything up front so a bad pair rejects the whole batch
+        forms = [UploadForm(pair_data, pair_files) for pair_files, pair_data in pairs]
+        with span('form.validate'):
+            errors = {
+                index: {field: error[0] for field, error in form.errors.items()}
+                for index, form in enumerate(forms) if not form.is_valid()
+            }
+        if errors:
+            logger.warning("API submission validation failed: %s", errors)
+            return JsonResponse({'error': 'Form validation failed', 'errors': errors}, status=400)
+
+        try:
+            uploads = self.save_uploads(forms, ip_address, priority=AnalysisResult.PRIORITY_BATCH)
+        except AdmissionRejected as e:
+            return busy_response(e.retry_after)
+
+        if settings.LANDSNAP_INLINE_ANALYSIS:
+            for index, upload in enumerate(uploads):
+                try:
+                    self.process_inline(upload)
+                except Exception:
+                    # Recorded as FAILED on the result, which the response reports
+                    logger.exception("API submission failed for pair %s", index)
+
+        saved = {result.upload_id: result
+                 for result in AnalysisResult.objects.filter(upload__in=uploads).select_related('upload')}
+        results = [{'index': index, **serialize_result(saved[upload.pk])} for index, upload in enumerate(uploads)]
+        return JsonResponse({'results': results}, status=202)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ResultStatusView(View):
+    """
+    GET /api/v1/results/?ids=<uuid>,<uuid>
+    POST /api/v1/results/ with {"ids": [...]} for lists too long for a URL
+    Returns the status of many results in a single query.
+    """
+
+    def get(self, request):
+        values = [v for param in request.GET.getlist('ids') for v in param.split(',') if v]
+        return self.bulk_status(request, values)
+
+    def post(self, request):
+        try:
+            values = json.loads(request.body or b'{}').get('ids', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Expected a JSON object with an "ids" list'}, status=400)
+        if not isinstance(values, list):
+            return JsonResponse({'error': 'Expected a JSON object with an "ids" list'}, status=400)
+        return self.bulk_status(request, values)
+
+    def bulk_status(self, request, values):
+        try:
+            ids = parse_result_ids(values)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if not ids:
+            return JsonResponse({'error': 'No result ids given'}, status=400)
+        if len(ids) > settings.LANDSNAP_API_MAX_STATUS_IDS:
+            return JsonResponse({
+                'error': f'At most {settings.LANDSNAP_API_MAX_STATUS_IDS} ids per request'
+            }, status=400)
+
+        results = list(AnalysisResult.objects.filter(upload__result_id__in=ids).select_related('upload'))
+        queue = {'positions': queue_positions(results), 'length': current_load().queued}
+        found = {str(result.upload.result_id): serialize_result(result, queue) for result in results}
+        payload = {
+            'results': found,
+            'missing': sorted({str(i) for i in ids} - found.keys()),
+        }
+        return conditional_json(request, payload)
+
+
+class ResultDetailView(View):
+    """GET /api/v1/results/<uuid>/"""
+
+    def get(self, request, result_id):
+        result = (AnalysisResult.objects.filter(upload__result_id=result_id)
+                  .select_related('upload').first())
+        if result is None:
+            return JsonResponse({'error': 'Result not found'}, status=404)
+        return conditional_json(request, serialize_result(result))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ResultCancelView(View):
+    """
+    POST /api/v1/results/<uuid>/cancel/
+    Cancels a queued analysis, or stops a running one within a heartbeat interval.
+    """
+
+    def post(self, request, result_id):
+        result = (AnalysisResult.objects.filter(upload__result_id=result_id)
+                  .select_related('upload').first())
+        if result is None:
+            return JsonResponse({'error': 'Result not found'}, status=404)
+        if not request_cancel(result):
+            return JsonResponse({**serialize_result(result), 'error': 'This analysis can no longer be cancelled'},
+                                status=409)
+        result.refresh_from_db()
+        return JsonResponse(serialize_result(result), status=200 if result.status == 'CANCELLED' else 202)
+
+
+def tus_response(status=204, **headers):
+    response = HttpResponse(status=status)
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Cache-Control'] = 'no-store'
+    for name, value in headers.items():
+        response[name.replace('_', '-')] = str(value)
+    return response
+
+
+def tus_error(message, status=400, errors=None):
+    response = JsonResponse({'error': message, **({'errors': errors} if errors else {})}, status=status)
+    response['Tus-Resumable'] = TUS_VERSION
+    return response
+
+
+def tus_busy(retry_after):
+    """
+    Refuse resumable upload traffic from a client that has used up
+    LANDSNAP_API_RATE_LIMIT, since it couldn't submit the file anyway
+    """
+    response = busy_response(retry_after, 'Rate limit exceeded')
+    response['Tus-Resumable'] = TUS_VERSION
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UploadCreateView(View):
+    """
+    POST /api/v1/uploads/ with `Upload-Length` and `Upload-Metadata: filename <base64>`
+    Starts a resumable upload (tus 1.0 creation, checksum and termination
+    extensions). Send the file with PATCH requests to the returned Location,
+    then submit the pair with `image1_upload`/`image2_upload` ids.
+    """
+
+    def options(self, request, *args, **kwargs):
+        return tus_response(
+            Tus_Version=TUS_VERSION,
+            Tus_Extension='creation,checksum,termination',
+            Tus_Checksum_Algorithm=','.join(CHECKSUM_ALGORITHMS),
+            Tus_Max_Chunk_Size=settings.LANDSNAP_UPLOAD_CHUNK_MAX,
+        )
+
+    def post(self, request):
+        ip_address = UploadView().get_client_ip(request)
+        retry_after = rate_limit_retry_after(ip_address, 1)
+        if retry_after is not None:
+            return tus_busy(retry_after)
+        try:
+            length = int(request.headers.get('Upload-Length', ''))
+            metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+            session = create_session(metadata.get('filename'), length, ip_address)
+        except ValueError:
+            return tus_error('Upload-Length header is required')
+        except ValidationError as e:
+            status = {'image_too_large': 413, 'upload_quota': 429}.get(e.code, 400)
+            return tus_error(e.messages[0], status=status)
+        url = reverse('landsnap:api_v1:upload_detail', kwargs={'upload_id': session.id})
+        return tus_response(201, Location=request.build_absolute_uri(url), Upload_Offset=0, Upload_Id=session.id)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UploadDetailView(View):
+    """
+    HEAD /api/v1/uploads/<uuid>/: current Upload-Offset, to resume from
+    PATCH /api/v1/uploads/<uuid>/: append a chunk at Upload-Offset
+    DELETE /api/v1/uploads/<uuid>/: abandon the upload
+    """
+
+    def get_session(self, upload_id):
+        return UploadSession.objects.filter(pk=upload_id).first()
+
+    def head(self, request, upload_id):
+        session = self.get_session(upload_id)
+        if session is None:
+            return tus_response(404)
+        return tus_response(200, Upload_Offset=session.offset, Upload_Length=session.length)
+
+    def patch(self, request, upload_id):
+        session = self.get_session(upload_id)
+        if session is None:
+            return tus_error('Upload not found', status=404)
+        retry_after = rate_limit_retry_after(UploadView().get_client_ip(request), 1)
+        if retry_after is not None:
+            return tus_busy(retry_after)
+        if request.content_type != 'application/offset+octet-stream':
+            return tus_error('Content-Type must be application/offset+octet-stream', status=415)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            content_length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return tus_error('Upload-Offset header is required')
+
+        try:
+            checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+            new_offset = append_chunk(session, offset, request, content_length, checksum)
+        except ChunkError as e:
+            return tus_error(str(e), status=e.status)
+        except ValidationError as e:
+            # The header showed the file can't be accepted; the upload is gone
+            return tus_error('Upload rejected', status=422, errors={'file': e.messages[0]})
+        return tus_response(Upload_Offset=new_offset)
+
+    def delete(self, request, upload_id):
+        session = self.get_session(upload_id)
+        if session is None:
+            return tus_response(404)
+        discard_session(session)
+        return tus_response()
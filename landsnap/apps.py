@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class LandSnapConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'landsnap'
\ No newline at end of file
+    name = 'landsnap'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,29 +1,58 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
 from .models import ImageUpload
-from .utils.validators import validate_image_size, validate_image_dimensions
+from .utils.roi import normalize_roi, parse_roi
+from .utils.validators import is_raster_file, validate_image_size, validate_image_dimensions
+
+ACCEPTED_TYPES = 'image/jpeg,image/png,image/tiff,.tif,.tiff'
+
+
+class RasterImageField(forms.ImageField):
+    """
+    ImageField that also accepts (Big)TIFF rasters. Those are too large for
+    Pillow to verify, so they skip that step and are checked from their TIFF
+    header by validate_image_dimensions instead.
+    """
+
+    def to_python(self, data):
+        if data and is_raster_file(data):
+            return forms.FileField.to_python(self, data)
+        return super().to_python(data)
+
 
 class UploadForm(forms.ModelForm):
-    image1 = forms.ImageField(
+    image1 = RasterImageField(
         label=_('Before Image'),
         help_text=_('Upload the earlier image of the location'),
         widget=forms.FileInput(attrs={
-            'accept': 'image/jpeg,image/png',
+            'accept': ACCEPTED_TYPES,
             'class': 'form-control',
             'aria-describedby': 'image1Help'
         })
     )
     
-    image2 = forms.ImageField(
+    image2 = RasterImageField(
         label=_('After Image'),
         help_text=_('Upload the more recent image of the location'),
         widget=forms.FileInput(attrs={
-            'accept': 'image/jpeg,image/png',
+            'accept': ACCEPTED_TYPES,
             'class': 'form-control',
             'aria-describedby': 'image2Help'
         })
     )
 
+    roi = forms.CharField(
+        label=_('Region of Interest'),
+        required=False,
+        help_text=_('Optional. Restrict the analysis to {"bbox": [x, y, width, height]} or '
+                    '{"polygon": [[x, y], ...]}, in pixels of the before image.'),
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': '{"bbox": [0, 0, 1000, 1000]}',
+            'aria-describedby': 'roiHelp'
+        })
+    )
+
     class Meta:
         model = ImageUpload
         fields = ['image1', 'image2']
@@ -37,24 +66,50 @@ class UploadForm(forms.ModelForm):
         cleaned_data = super().clean()
         image1 = cleaned_data.get('image1')
         image2 = cleaned_data.get('image2')
+        dimensions = {}
         
         for field_name, image in [('image1', image1), ('image2', image2)]:
             if image:
                 try:
                     validate_image_size(image)
-                    validate_image_dimensions(image)
+                    dimensions[field_name] = validate_image_dimensions(image)
                 except forms.ValidationError as e:
                     self.add_error(field_name, e)
         
         if image1 and image2:
-            self._validate_image_pair(image1, image2)
+            self._validate_image_pair(image1, image2, dimensions)
+        if len(dimensions) == 2:
+            # Recorded for admission control, which sizes jobs by pixel count
+            self.instance.width = max(width for width, _height in dimensions.values())
+            self.instance.height = max(height for _width, height in dimensions.values())
+        if cleaned_data.get('roi') and 'image1' in dimensions:
+            # Coordinates refer to the before image, which the after image is aligned to
+            try:
+                cleaned_data['roi'] = normalize_roi(cleaned_data['roi'], *dimensions['image1'])
+            except forms.ValidationError as e:
+                self.add_error('roi', e)
         
         return cleaned_data
 
-    def _validate_image_pair(self, image1, image2):
+    def clean_roi(self):
+        return parse_roi(self.cleaned_data.get('roi'))
+
+    def _validate_image_pair(self, image1, image2, dimensions):
         """
         Validate that the two images are suitable for comparison
         """
+        if is_raster_file(image1) != is_raster_file(image2):
+            raise forms.ValidationError(
+                _("Upload either two GeoTIFF rasters or two JPEG/PNG images."),
+                code='image_type_mismatch'
+            )
+        # Rasters are compared tile by tile over the same pixel grid, not resized
+        if is_raster_file(image1) and len(dimensions) == 2 and dimensions['image1'] != dimensions['image2']:
+            raise forms.ValidationError(
+                _("The rasters differ in size (%(size1)s and %(size2)s). Upload two rasters of the same dimensions."),
+                params={'size1': '%sx%s' % dimensions['image1'], 'size2': '%sx%s' % dimensions['image2']},
+                code='raster_dimension_mismatch'
+            )
         size_ratio = image1.size / image2.size
         if size_ratio > 2 or size_ratio < 0.5:
             raise forms.ValidationError(
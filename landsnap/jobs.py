@@ -0,0 +1,324 @@
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from . import tracing
+from .models import AnalysisResult
+from .utils.admission import JobCost, current_load, fits, lock_budget
+from .utils.reanalysis import METADATA_KEY as REANALYSIS_KEY
+from .utils.rollups import Outcome, record_transition, rollup_day
+from .utils.scheduler import job_key, pending_order
+
+logger = logging.getLogger(__name__)
+
+# worker_id of results analysed inside a web request, which can't be interrupted
+INLINE_WORKER = 'inline'
+
+
+class JobAborted(Exception):
+    """A running analysis was stopped before it finished"""
+    status = 'FAILED'
+
+
+class JobCancelled(JobAborted):
+    status = 'CANCELLED'
+
+
+class JobTimedOut(JobAborted):
+    pass
+
+
+class LeaseLost(JobAborted):
+    """The reaper gave this job to another worker; its outcome is no longer ours to record"""
+    status = None
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_deadline(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.LANDSNAP_LEASE_SECONDS)
+
+
+def stage_limit(stage, estimated_seconds=None):
+    """
+    Hard time limit for one pipeline stage: the configured floor, or a
+    multiple of the job's estimated run time for unusually large jobs.
+    """
+    floor = settings.LANDSNAP_STAGE_TIME_LIMITS.get(stage, settings.LANDSNAP_STAGE_TIME_LIMITS['start'])
+    return max(floor, settings.LANDSNAP_STAGE_TIME_FACTOR * (estimated_seconds or 0))
+
+
+def inline_lease(estimated_seconds=None, now=None):
+    """Lease for an analysis running in a web request, which has no heartbeat"""
+    seconds = sum(stage_limit(stage, estimated_seconds) for stage in settings.LANDSNAP_STAGE_TIME_LIMITS)
+    return (now or timezone.now()) + timedelta(seconds=seconds)
+
+
+def claim_next(worker=None):
+    """
+    Atomically move the next scheduled PENDING result to PROCESSING and return it.
+
+    Jobs are taken in `schedule` order, skipping any that would not fit the
+    memory/concurrency budget shared by all workers so smaller ones can run
+    meanwhile. A job that has waited past LANDSNAP_SCHEDULER_MAX_WAIT is not
+    skipped: nothing else starts until there is room for it. Only the first
+    LANDSNAP_SCHEDULER_DEPTH jobs of each client's queue are considered.
+    Returns None when nothing can be claimed.
+    """
+    worker = worker or worker_name()
+    while True:
+        # Other workers and inline admissions wait on the lock until this
+        # claim is committed, so none of them can start a job on the same room
+        with transaction.atomic():
+            lock_budget()
+            now = timezone.now()
+            load = current_load()
+            candidate = None
+            for job in pending_order(now, depth=settings.LANDSNAP_SCHEDULER_DEPTH):
+                cost = JobCost(memory=job['estimated_memory'] or 0, seconds=job['estimated_seconds'] or 0)
+                if fits(cost, load):
+                    candidate = job
+                    break
+                if job_key(job, now)[0] < 0:
+                    break
+            if candidate is None:
+                return None
+            queued_at = candidate['queued_at'] or now
+            # A cancellation may have taken it between the select and the update
+            claimed = AnalysisResult.objects.filter(pk=candidate['pk'], status='PENDING').update(
+                status='PROCESSING',
+                started_at=now,
+                queue_wait=round((now - queued_at).total_seconds(), 3),
+                worker_id=worker,
+                lease_expires_at=lease_deadline(now),
+                attempts=F('attempts') + 1,
+            )
+        if claimed:
+            return AnalysisResult.objects.select_related('upload').get(pk=candidate['pk'])
+
+
+def heartbeat(result, worker):
+    """Renew the lease on a running result; raise if it was cancelled or taken away"""
+    renewed = AnalysisResult.objects.filter(
+        pk=result.pk, status='PROCESSING', worker_id=worker, cancel_requested=False
+    ).update(lease_expires_at=lease_deadline())
+    if renewed:
+        return
+    if AnalysisResult.objects.filter(pk=result.pk, status='PROCESSING', worker_id=worker).exists():
+        raise JobCancelled("Cancelled")
+    raise LeaseLost("Lease expired and was reassigned")
+
+
+def _pipeline_process(conn, img1_path, img2_path, cache_gray, roi, parent_trace, keep_hash):
+    from .utils.analysis import input_hash, run_pipeline
+
+    def on_stage(stage):
+        conn.send(('stage', stage))
+
+    try:
+        with tracing.span('pipeline', {'process.pid': os.getpid()}, parent=parent_trace) as pipeline_span:
+            pair_hash = None
+            if keep_hash:
+                on_stage('hash')
+                pair_hash = input_hash(img1_path, img2_path)
+            if pair_hash and pair_hash == keep_hash:
+                pipeline_span.set('landsnap.unchanged', True)
+                message = ('unchanged', None)
+            else:
+                output = run_pipeline(img1_path, img2_path, cache_gray, on_stage=on_stage, roi=roi,
+                                      pair_hash=pair_hash)
+                message = ('done', output)
+    except Exception as e:
+        message = ('error', str(e))
+    # The parent kills this process as soon as it has the outcome
+    tracing.flush()
+    try:
+        conn.send(message)
+    finally:
+        conn.close()
+
+
+def supervise(result, worker, img1_path, img2_path, cache_gray=(False, False), keep_hash=None):
+    """
+    Run the pipeline in a child process so it can be killed. Meanwhile the
+    lease is renewed every LANDSNAP_HEARTBEAT_INTERVAL seconds, and each stage
+    is held to its `stage_limit`. With `keep_hash`, the child hashes the pair
+    first and skips the analysis if it matches. Returns the pipeline output,
+    None if it was skipped, or raises JobAborted after killing the child.
+    """
+    # The child only gets file paths and never touches the database
+    connections.close_all()
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_pipeline_process,
+        args=(child_conn, img1_path, img2_path, cache_gray, result.roi, tracing.traceparent(), keep_hash),
+        daemon=True
+    )
+    process.start()
+    child_conn.close()
+
+    stage, stage_started = 'start', time.monotonic()
+    next_heartbeat = stage_started + settings.LANDSNAP_HEARTBEAT_INTERVAL
+    try:
+        while True:
+            if parent_conn.poll(min(settings.LANDSNAP_HEARTBEAT_INTERVAL, 1)):
+                try:
+                    kind, payload = parent_conn.recv()
+                except EOFError:
+                    process.join()
+                    raise JobAborted(f"Analysis process died (exit code {process.exitcode})")
+                if kind in ('done', 'unchanged'):
+                    return payload
+                if kind == 'error':
+                    raise RuntimeError(payload)
+                stage, stage_started = payload, time.monotonic()
+
+            limit = stage_limit(stage, result.estimated_seconds)
+            if time.monotonic() - stage_started > limit:
+                raise JobTimedOut(f"Stage '{stage}' exceeded its {limit:.0f}s time limit")
+            if time.monotonic() >= next_heartbeat:
+                heartbeat(result, worker)
+                next_heartbeat = time.monotonic() + settings.LANDSNAP_HEARTBEAT_INTERVAL
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        parent_conn.close()
+
+
+def finish(result, worker, status, error_message=None, outcome=None, **fields):
+    """Record the outcome of a job, unless its lease has been lost"""
+    finished = AnalysisResult.objects.filter(pk=result.pk, status='PROCESSING', worker_id=worker).update(
+        status=status, error_message=error_message, lease_expires_at=None, cancel_requested=False, **fields
+    )
+    if finished:
+        record_transition(rollup_day(result), None, outcome or Outcome(status))
+    return finished
+
+
+def keep_output(result, worker):
+    """Complete a requeued result with the output it already has"""
+    metadata = {key: value for key, value in result.metadata.items() if key != REANALYSIS_KEY}
+    outcome = Outcome('COMPLETE', result.change_intensity, result.processing_time)
+    return finish(result, worker, 'COMPLETE', outcome=outcome, metadata=metadata)
+
+
+def run_job(result, worker=None):
+    """Analyze a claimed result under supervision and record how it ended"""
+    from .utils.analysis import save_pipeline_output, shared_frames
+    from .utils.reanalysis import reusable_hash
+
+    worker = worker or worker_name()
+    upload = result.upload
+    attributes = {
+        'landsnap.worker': worker,
+        'landsnap.attempt': result.attempts,
+        'landsnap.priority': result.priority,
+        'landsnap.queue_wait': result.queue_wait,
+    }
+    # Continues the trace of the request that queued the job
+    parent = (result.metadata or {}).get('traceparent')
+    with tracing.span('job.run', attributes, parent=parent, result_id=upload.result_id) as job_span:
+        try:
+            with tracing.span('job.supervise'):
+                output = supervise(result, worker, upload.image1.path, upload.image2.path, shared_frames(upload),
+                                   keep_hash=reusable_hash(result))
+            # A cancel that arrives after the last heartbeat still wins
+            heartbeat(result, worker)
+            if output is None:
+                job_span.set('landsnap.unchanged', True)
+                keep_output(result, worker)
+                logger.info("Worker kept the unchanged result of upload %s", result.upload_id)
+                return
+            result.refresh_from_db()
+            result.lease_expires_at = None
+            save_pipeline_output(result, output)
+            logger.info("Worker finished upload %s", result.upload_id)
+        except LeaseLost as e:
+            job_span.fail(e)
+            logger.warning("Worker lost the lease on upload %s; dropping its output", result.upload_id)
+        except JobAborted as e:
+            job_span.fail(e)
+            logger.warning("Worker stopped upload %s: %s", result.upload_id, e)
+            finish(result, worker, e.status, str(e))
+        except Exception as e:
+            job_span.fail(e)
+            logger.exception("Worker failed on upload %s", result.upload_id)
+            finish(result, worker, 'FAILED', str(e))
+
+
+def reap_expired(now=None):
+    """
+    Release PROCESSING results whose lease has expired because their worker
+    died or hung. They are requeued while attempts remain and a worker can
+    pick them up, otherwise failed (or cancelled, if that was requested).
+    Returns (requeued, released) counts.
+    """
+    now = now or timezone.now()
+    expired = Q(lease_expires_at__lt=now) | Q(
+        lease_expires_at__isnull=True,
+        created_at__lt=now - timedelta(seconds=settings.LANDSNAP_LEASE_SECONDS),
+    )
+    requeued = released = 0
+    rows = AnalysisResult.objects.filter(expired, status='PROCESSING').values(
+        'pk', 'attempts', 'cancel_requested', 'created_at'
+    )
+    for row in rows:
+        still_expired = AnalysisResult.objects.filter(expired, pk=row['pk'], status='PROCESSING')
+        if row['cancel_requested']:
+            status = 'CANCELLED'
+            updated = still_expired.update(status=status, error_message='Cancelled', lease_expires_at=None)
+        elif row['attempts'] < settings.LANDSNAP_MAX_ATTEMPTS and not settings.LANDSNAP_INLINE_ANALYSIS:
+            requeued += still_expired.update(status='PENDING', worker_id='', lease_expires_at=None, started_at=None)
+            continue
+        else:
+            status = 'FAILED'
+            updated = still_expired.update(
+                status=status, lease_expires_at=None,
+                error_message='Analysis stopped responding and was abandoned',
+            )
+        if updated:
+            record_transition(timezone.localdate(row['created_at']), None, Outcome(status))
+        released += updated
+    if requeued or released:
+        logger.warning("Reaped expired analysis leases: %s requeued, %s failed or cancelled", requeued, released)
+    return requeued, released
+
+
+def request_cancel(result):
+    """
+    Cancel a queued result at once, or ask the worker running it to kill
+    the analysis. Returns False if the result can no longer be cancelled.
+    """
+    if AnalysisResult.objects.filter(pk=result.pk, status='PENDING').update(
+            status='CANCELLED', error_message='Cancelled'):
+        record_transition(rollup_day(result), None, Outcome('CANCELLED'))
+        return True
+    return bool(AnalysisResult.objects.filter(pk=result.pk, status='PROCESSING')
+                .exclude(worker_id=INLINE_WORKER).update(cancel_requested=True))
+
+
+def work(poll_interval=None, once=False):
+    """Process queued results until interrupted; with `once`, stop when nothing can be claimed"""
+    poll_interval = poll_interval if poll_interval is not None else settings.LANDSNAP_WORKER_POLL_INTERVAL
+    worker = worker_name()
+    processed = 0
+    while True:
+        close_old_connections()
+        reap_expired()
+        result = claim_next(worker)
+        if result is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(result, worker)
+        processed += 1
@@ -0,0 +1,60 @@
+import time
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from landsnap.utils.image_utils import (
+    HEATMAP_FORMATS, detect_change_regions, encode_heatmap, process_image, render_heatmap,
+)
+
+
+def synthetic_pair(size, seed=0):
+    """Textured before/after pair with a handful of changed blocks"""
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (size, size, 3), dtype=np.uint8), (0, 0), 3)
+    after = base.copy()
+    for _ in range(12):
+        x, y = rng.integers(0, size - size // 8, 2)
+        after[y:y + size // 10, x:x + size // 10] = rng.integers(0, 255, 3, dtype=np.uint8)
+    return base, after
+
+
+class Command(BaseCommand):
+    help = "Measure heatmap encode time and output size for each supported format"
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='*', help="Before and after image paths (default: synthetic pair)")
+        parser.add_argument('--size', type=int, default=5000, help="Side length of the synthetic pair")
+        parser.add_argument('--repeat', type=int, default=3, help="Encodes per format; the best time is reported")
+        parser.add_argument('--png-levels', default="default,1,3,6",
+                            help="Comma-separated PNG compression levels to compare ('default' is OpenCV's)")
+
+    def handle(self, *args, **options):
+        if options['images']:
+            if len(options['images']) != 2:
+                raise CommandError("Pass exactly two image paths, or none for a synthetic pair")
+            img1, img2 = (process_image(path) for path in options['images'])
+        else:
+            img1, img2 = synthetic_pair(options['size'])
+
+        img2, mask, boxes = detect_change_regions(img1, img2)
+        start = time.perf_counter()
+        composite = render_heatmap(img2, mask, boxes)
+        render_time = time.perf_counter() - start
+        height, width = mask.shape
+        self.stdout.write(f"{width}x{height}, {len(boxes)} regions, composite render {render_time * 1000:.0f}ms")
+
+        cases = [("png (default)", 'png', {'png_compression': None}) if level == 'default'
+                 else (f"png (level {level})", 'png', {'png_compression': int(level)})
+                 for level in options['png_levels'].split(',')]
+        cases += [(fmt, fmt, {}) for fmt in HEATMAP_FORMATS if fmt != 'png']
+
+        self.stdout.write(f"{'format':<18}{'encode ms':>10}{'bytes':>14}")
+        for label, fmt, encode_options in cases:
+            image = mask if fmt == 'mask' else composite
+            best = None
+            for _ in range(max(options['repeat'], 1)):
+                start = time.perf_counter()
+                data, _ext = encode_heatmap(image, fmt, **encode_options)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f"{label:<18}{best * 1000:>10.0f}{len(data):>14,}")
@@ -0,0 +1,51 @@
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from landsnap.utils.image_utils import ANALYSIS_PARAMS
+from landsnap.utils.regression import CORPUS, PATHS, load_golden, record_golden, run_regression
+
+
+class Command(BaseCommand):
+    help = ("Compare the analysis code paths against the golden outputs of the regression corpus, "
+            "reporting accuracy and speed side by side")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', choices=sorted(CORPUS), help="Only run this case (repeatable)")
+        parser.add_argument('--path', action='append', choices=list(PATHS), help="Only run this path (repeatable)")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per path and case; the best time is reported")
+        parser.add_argument('--update', action='store_true',
+                            help="Re-record the goldens from the reference implementation instead of checking")
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp(prefix='landsnap-golden-')
+        try:
+            if options['update']:
+                golden = record_golden(workdir)
+                self.stdout.write(f"Recorded golden outputs for {len(golden['cases'])} cases")
+                return
+            if load_golden().get('params') != ANALYSIS_PARAMS:
+                self.stderr.write("Golden outputs were recorded with different analysis parameters; "
+                                  "check the change and re-record them with --update")
+            comparisons = run_regression(workdir, options['case'], options['path'], options['repeat'])
+        except KeyError as e:
+            raise CommandError(str(e))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        reference = {c.case: c.seconds for c in comparisons if c.path == 'reference'}
+        self.stdout.write(f"{'case':<16}{'path':<19}{'Δchange %':>10}{'Δssim':>10}{'mask diff':>10}"
+                          f"{'ms':>9}{'speedup':>9}  result")
+        for c in comparisons:
+            speedup = f"{reference[c.case] / c.seconds:.2f}x" if c.case in reference and c.seconds else '-'
+            ssim = f"{c.deltas['ssim']:.2g}" if 'ssim' in c.deltas else '-'
+            mask = max((c.deltas[m] for m in ('mask', 'heatmap_mask') if m in c.deltas), default=None)
+            mask = '-' if mask is None else f"{mask:.2%}"
+            self.stdout.write(
+                f"{c.case:<16}{c.path:<19}{c.deltas['change_percentage']:>10.3f}{ssim:>10}{mask:>10}"
+                f"{c.seconds * 1000:>9.1f}{speedup:>9}  {'ok' if c.ok else '; '.join(c.failures)}"
+            )
+
+        failed = [c for c in comparisons if not c.ok]
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(comparisons)} comparisons fell outside their tolerances")
+        self.stdout.write(f"All {len(comparisons)} comparisons within tolerance")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from landsnap.utils.retention import (
+    COMPACT_FORMATS, RetentionReport, compact_media, expire_upload_sessions, expire_uploads, sweep_orphans,
+)
+
+
+class Command(BaseCommand):
+    help = "Apply upload retention: expire old uploads, sweep orphaned media files and recompress old images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-expire', action='store_true',
+                            help="Don't delete uploads past their LANDSNAP_RETENTION_DAYS TTL")
+        parser.add_argument('--skip-orphans', action='store_true',
+                            help="Don't sweep MEDIA_ROOT for files no row references")
+        parser.add_argument('--compact', choices=COMPACT_FORMATS, default=None,
+                            help="Losslessly recompress old PNG heatmaps to this format (originals stay PNG)")
+        parser.add_argument('--compact-after-days', type=int, default=30,
+                            help="Only recompress files older than this many days")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be reclaimed without deleting or rewriting anything")
+
+    def handle(self, *args, **options):
+        if options['compact_after_days'] < 0:
+            raise CommandError("--compact-after-days must not be negative")
+
+        dry_run = options['dry_run']
+        report = RetentionReport()
+
+        if not options['skip_expire']:
+            expire_uploads(report, dry_run=dry_run)
+            expire_upload_sessions(report, dry_run=dry_run)
+            self.stdout.write(f"Expired {report.uploads_deleted} uploads and "
+                              f"{report.sessions_deleted} abandoned resumable uploads")
+        if not options['skip_orphans']:
+            sweep_orphans(report, dry_run=dry_run)
+            self.stdout.write(f"Found {report.orphans_deleted} orphaned files")
+        if options['compact']:
+            compact_media(report, fmt=options['compact'],
+                          older_than_days=options['compact_after_days'], dry_run=dry_run)
+            self.stdout.write(f"Recompressed {report.files_compacted} files")
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}{report.summary()}"))
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from landsnap.models import AnalysisResult
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Report queue wait times of recently started analyses per priority class and client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="Look at analyses started in the last N hours")
+        parser.add_argument('--top-clients', type=int, default=5,
+                            help="Also list the clients with the longest median wait")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        rows = (AnalysisResult.objects.filter(started_at__gte=since, queue_wait__isnull=False)
+                .values_list('priority', 'upload__ip_address', 'queue_wait'))
+        by_priority, by_client = {}, {}
+        for priority, client, wait in rows:
+            by_priority.setdefault(priority, []).append(wait)
+            by_client.setdefault(client or '-', []).append(wait)
+
+        if not by_priority:
+            self.stdout.write(f"No analyses started in the last {options['hours']:g}h")
+            return
+
+        labels = dict(AnalysisResult.PRIORITY_CHOICES)
+        for priority, waits in sorted(by_priority.items()):
+            waits.sort()
+            self.stdout.write(
+                f"{labels.get(priority, priority)}: {len(waits)} jobs, wait p50 {percentile(waits, 0.5):.1f}s, "
+                f"p95 {percentile(waits, 0.95):.1f}s, max {waits[-1]:.1f}s"
+            )
+
+        for waits in by_client.values():
+            waits.sort()
+        slowest = sorted(by_client.items(), key=lambda item: percentile(item[1], 0.5), reverse=True)
+        for client, waits in slowest[:options['top_clients']]:
+            self.stdout.write(f"  {client}: {len(waits)} jobs, wait p50 {percentile(waits, 0.5):.1f}s")
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from landsnap.jobs import work
+from landsnap.models import AnalysisResult
+from landsnap.utils.reanalysis import DEFAULT_CHUNK_SIZE, queue_reanalysis
+
+
+class Command(BaseCommand):
+    help = ("Requeue historical results as batch jobs so workers recompute them with the current algorithm "
+            "parameters. Pairs whose content and parameters are unchanged keep their result.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Only reanalyze these upload ids")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Rows fetched per database round trip")
+        parser.add_argument('--status', action='append', default=[],
+                            help="Only reanalyze results with this status (repeatable)")
+        parser.add_argument('--force', action='store_true',
+                            help="Reanalyze even when content and parameters are unchanged")
+        parser.add_argument('--run', action='store_true',
+                            help="Process the queue in this process until nothing is left to claim, "
+                                 "for deployments without a worker")
+
+    def handle(self, *args, **options):
+        results = AnalysisResult.objects.all()
+        if options['ids']:
+            results = results.filter(upload__in=options['ids'])
+        if options['status']:
+            results = results.filter(status__in=options['status'])
+
+        stats = queue_reanalysis(results, force=options['force'], chunk_size=options['chunk_size'])
+        self.stdout.write(stats.summary())
+        if not options['run']:
+            self.stdout.write("Running workers (`manage.py runworker`) will process them as batch jobs.")
+            return
+
+        # Pay for cv2/numpy once at startup rather than on the first job
+        import landsnap.utils.analysis  # noqa: F401
+
+        try:
+            processed = work(once=True)
+        except KeyboardInterrupt:
+            self.stderr.write("Interrupted; queued results stay queued for the next worker or run.")
+            raise
+        statuses = results.values('status').annotate(count=Count('pk')).order_by('status')
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} queued analyses; results now "
+            + ", ".join(f"{row['count']} {row['status']}" for row in statuses)
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from landsnap.jobs import reap_expired
+
+
+class Command(BaseCommand):
+    help = "Requeue or fail analyses whose worker lease has expired (workers also do this while polling)"
+
+    def handle(self, *args, **options):
+        requeued, released = reap_expired()
+        self.stdout.write(self.style.SUCCESS(f"Requeued {requeued} and failed or cancelled {released} stuck analyses"))
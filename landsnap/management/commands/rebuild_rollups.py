@@ -0,0 +1,19 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from landsnap.utils.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ("Recompute the daily analysis rollups from stored results. Rollups are normally kept up to date "
+            "as analyses finish; use this to repair them. Results already purged drop out of rebuilt days.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild days from this date on (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+        except ValueError:
+            raise CommandError(f"Invalid --since date: {options['since']}")
+        days = rebuild_rollups(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {days} days"))
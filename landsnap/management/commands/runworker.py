@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from landsnap.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Run queued change detection jobs (used when LANDSNAP_INLINE_ANALYSIS is off)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to wait between polls of an empty queue")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        # Pay for cv2/numpy once at startup rather than on the first job
+        import landsnap.utils.analysis  # noqa: F401
+
+        self.stdout.write("Analysis worker started")
+        try:
+            processed = work(poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Analysis worker stopped")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} queued analyses"))
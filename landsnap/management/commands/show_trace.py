@@ -0,0 +1,90 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from .queue_stats import percentile
+
+
+def read_spans(path, since_ns=0):
+    """Spans from an OTLP/JSON lines file, each as a dict with its attributes flattened"""
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                batch = json.loads(line)
+            except ValueError:
+                continue
+            for resource in batch.get('resourceSpans', []):
+                for scope in resource.get('scopeSpans', []):
+                    for span in scope.get('spans', []):
+                        span['start'] = int(span['startTimeUnixNano'])
+                        span['duration'] = (int(span['endTimeUnixNano']) - span['start']) / 1e6
+                        span['attributes'] = {
+                            item['key']: next(iter(item['value'].values())) for item in span.get('attributes', [])
+                        }
+                        if span['start'] >= since_ns:
+                            spans.append(span)
+    return spans
+
+
+class Command(BaseCommand):
+    help = ("Summarise exported trace spans by name, or print the span tree of one result "
+            "(needs LANDSNAP_TRACE_EXPORTER=file)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('result_id', nargs='?', help="Show the traces recorded for this result")
+        parser.add_argument('--file', help="Trace file to read (default: LANDSNAP_TRACE_FILE)")
+        parser.add_argument('--hours', type=float, help="Only look at spans started in the last N hours")
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.LANDSNAP_TRACE_FILE
+        since_ns = int((time.time() - options['hours'] * 3600) * 1e9) if options['hours'] else 0
+        try:
+            spans = read_spans(path, since_ns)
+        except FileNotFoundError:
+            raise CommandError(f"No trace file at {path}")
+
+        if options['result_id']:
+            self.show_result(spans, options['result_id'])
+        else:
+            self.show_summary(spans)
+
+    def show_summary(self, spans):
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span['name'], []).append(span['duration'])
+        if not by_name:
+            self.stdout.write("No spans recorded")
+            return
+        self.stdout.write(f"{'span':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}")
+        for name, durations in sorted(by_name.items(), key=lambda item: sum(item[1]), reverse=True):
+            durations.sort()
+            self.stdout.write(
+                f"{name:<24}{len(durations):>8}{percentile(durations, 0.5):>10.1f}"
+                f"{percentile(durations, 0.95):>10.1f}{durations[-1]:>10.1f}{sum(durations) / 1000:>10.2f}"
+            )
+
+    def show_result(self, spans, result_id):
+        trace_ids = {span['traceId'] for span in spans if span['attributes'].get('landsnap.result_id') == result_id}
+        if not trace_ids:
+            raise CommandError(f"No spans recorded for result {result_id}")
+        trace = sorted((span for span in spans if span['traceId'] in trace_ids), key=lambda span: span['start'])
+        children = {}
+        for span in trace:
+            children.setdefault(span.get('parentSpanId'), []).append(span)
+        known = {span['spanId'] for span in trace}
+        origin = trace[0]['start']
+
+        def show(span, depth):
+            status = f"  ERROR {span['status']['message']}" if span.get('status', {}).get('code') == 2 else ''
+            self.stdout.write(
+                f"{(span['start'] - origin) / 1e6:>10.1f}ms {'  ' * depth}{span['name']} "
+                f"{span['duration']:.1f}ms{status}"
+            )
+            for child in children.get(span['spanId'], []):
+                show(child, depth + 1)
+
+        # Roots, plus spans whose parent was never exported (e.g. a killed analysis process)
+        for span in trace:
+            if span.get('parentSpanId') not in known:
+                show(span, 0)
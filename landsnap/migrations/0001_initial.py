@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-19 13:08
+
+import django.core.validators
+import django.db.models.deletion
+import landsnap.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image1', models.ImageField(help_text='Upload the earlier image of the location', upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])], verbose_name='Before Image')),
+                ('image2', models.ImageField(help_text='Upload the more recent image of the location', upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])], verbose_name='After Image')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True, verbose_name='Uploaded At')),
+                ('ip_address', models.GenericIPAddressField(blank=True, help_text='IP address of the uploader', null=True, verbose_name='IP Address')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=10, verbose_name='Processing Status')),
+                ('error_message', models.TextField(blank=True, null=True, verbose_name='Error Message')),
+                ('result_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='Result ID')),
+            ],
+            options={
+                'verbose_name': 'Image Upload',
+                'verbose_name_plural': 'Image Uploads',
+                'ordering': ['-uploaded_at'],
+                'indexes': [models.Index(fields=['uploaded_at'], name='landsnap_im_uploade_3ad2ab_idx'), models.Index(fields=['status'], name='landsnap_im_status_4b6697_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('heatmap', models.ImageField(help_text='Generated change detection heatmap', upload_to=landsnap.models.upload_to, verbose_name='Heatmap Image')),
+                ('change_percentage', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('processing_time', models.FloatField(blank=True, null=True)),
+                ('quality_rating', models.CharField(choices=[('LOW', 'Low Confidence'), ('MEDIUM', 'Medium Confidence'), ('HIGH', 'High Confidence')], default='MEDIUM', help_text='Confidence level in the analysis results', max_length=10, verbose_name='Quality Rating')),
+                ('metadata', models.JSONField(blank=True, help_text='Extra analysis data in JSON format', null=True, verbose_name='Additional Metadata')),
+                ('upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis_result', to='landsnap.imageupload', verbose_name='Original Upload')),
+            ],
+            options={
+                'verbose_name': 'Analysis Result',
+                'verbose_name_plural': 'Analysis Results',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='landsnap_an_created_fb6a3a_idx'), models.Index(fields=['change_percentage'], name='landsnap_an_change__a713d1_idx'), models.Index(fields=['quality_rating'], name='landsnap_an_quality_db5307_idx')],
+            },
+        ),
+    ]
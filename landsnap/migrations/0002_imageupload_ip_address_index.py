@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['ip_address', 'uploaded_at'], name='landsnap_im_ip_addr_54d549_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-19 13:09
+
+import django.core.validators
+import landsnap.models
+import landsnap.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0002_imageupload_ip_address_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Storage Name')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Size (bytes)')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='References')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Stored Blob',
+                'verbose_name_plural': 'Stored Blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image1',
+            field=models.ImageField(help_text='Upload the earlier image of the location', storage=landsnap.storage.content_addressed_storage, upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])], verbose_name='Before Image'),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image2',
+            field=models.ImageField(help_text='Upload the more recent image of the location', storage=landsnap.storage.content_addressed_storage, upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])], verbose_name='After Image'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 13:12
+
+import django.core.validators
+import landsnap.models
+import landsnap.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0003_content_addressed_originals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image1',
+            field=models.ImageField(help_text='Upload the earlier image of the location', storage=landsnap.storage.content_addressed_storage, upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'tif', 'tiff'])], verbose_name='Before Image'),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image2',
+            field=models.ImageField(help_text='Upload the more recent image of the location', storage=landsnap.storage.content_addressed_storage, upload_to=landsnap.models.upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'tif', 'tiff'])], verbose_name='After Image'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-19 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0004_allow_tiff_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='error_message',
+            field=models.TextField(blank=True, null=True, verbose_name='Error Message'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['status', 'created_at'], name='landsnap_an_status_754464_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0005_analysis_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='estimated_memory',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Peak memory the analysis is expected to need', null=True, verbose_name='Estimated Memory (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='estimated_seconds',
+            field=models.FloatField(blank=True, help_text='CPU time the analysis is expected to take', null=True, verbose_name='Estimated Time (s)'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, help_text='Height in pixels of the larger image of the pair', null=True, verbose_name='Height'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, help_text='Width in pixels of the larger image of the pair', null=True, verbose_name='Width'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-19 13:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_queued_at(apps, schema_editor):
+    AnalysisResult = apps.get_model('landsnap', 'AnalysisResult')
+    AnalysisResult.objects.filter(queued_at__isnull=True).update(queued_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0006_analysis_cost_estimates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (1, 'Batch')], default=0, verbose_name='Priority'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='queue_wait',
+            field=models.FloatField(blank=True, help_text='Seconds between queueing and a worker starting the analysis', null=True, verbose_name='Queue Wait (s)'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Queued At'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Started At'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['started_at'], name='landsnap_an_started_fba173_idx'),
+        ),
+        migrations.RunPython(backfill_queued_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0007_analysis_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Attempts'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, verbose_name='Cancel Requested'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Renewed by the worker heartbeat; expired leases are reaped', null=True, verbose_name='Lease Expires At'),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', help_text='Worker holding the lease on this analysis', max_length=100, verbose_name='Worker'),
+        ),
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='landsnap_an_status_cdea9d_idx'),
+        ),
+    ]
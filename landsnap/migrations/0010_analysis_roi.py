@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0009_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='roi',
+            field=models.JSONField(blank=True, help_text='Polygon and bounding window the analysis was restricted to; change is scored inside it only', null=True, verbose_name='Region of Interest'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 13:37
+
+import landsnap.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0010_analysis_roi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='overlay',
+            field=models.FileField(blank=True, help_text='Run-length encoded change regions, composited over the after image in the browser', null=True, upload_to=landsnap.models.upload_to, verbose_name='Change Overlay'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2 on 2026-10-19 13:47
+
+import bisect
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copy of AnalysisResult.INTENSITY_BOUNDS as of this migration
+INTENSITY_RANGES = (('MINIMAL', None, 5), ('MODERATE', 5, 20), ('SIGNIFICANT', 20, 50), ('DRAMATIC', 50, None))
+# Frozen copy of utils.rollups.PROCESSING_TIME_BOUNDS as of this migration
+PROCESSING_TIME_BOUNDS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+
+def add_outcome(rollup, status, intensity, processing_time):
+    """Frozen copy of utils.rollups.apply_outcome for adding one finished result"""
+    if status == 'FAILED':
+        rollup.failed += 1
+    elif status == 'CANCELLED':
+        rollup.cancelled += 1
+    else:
+        rollup.completed += 1
+        if intensity:
+            rollup.intensity_counts[intensity] = rollup.intensity_counts.get(intensity, 0) + 1
+        if processing_time is not None:
+            rollup.processing_time_total += processing_time
+            histogram = rollup.processing_time_histogram
+            histogram.extend([0] * (len(PROCESSING_TIME_BOUNDS) + 1 - len(histogram)))
+            histogram[bisect.bisect_left(PROCESSING_TIME_BOUNDS, processing_time)] += 1
+
+
+def backfill_intensity_and_rollups(apps, schema_editor):
+    AnalysisResult = apps.get_model('landsnap', 'AnalysisResult')
+    DailyRollup = apps.get_model('landsnap', 'DailyRollup')
+    for intensity, lower, upper in INTENSITY_RANGES:
+        results = AnalysisResult.objects.filter(change_percentage__isnull=False)
+        if lower is not None:
+            results = results.filter(change_percentage__gte=lower)
+        if upper is not None:
+            results = results.filter(change_percentage__lt=upper)
+        results.update(change_intensity=intensity)
+
+    rollups = {}
+    finished = AnalysisResult.objects.filter(status__in=('COMPLETE', 'FAILED', 'CANCELLED'))
+    for created_at, status, intensity, processing_time in finished.values_list(
+            'created_at', 'status', 'change_intensity', 'processing_time').iterator():
+        day = timezone.localdate(created_at)
+        rollup = rollups.setdefault(day, DailyRollup(
+            day=day, completed=0, failed=0, cancelled=0, intensity_counts={},
+            processing_time_total=0, processing_time_histogram=[],
+        ))
+        add_outcome(rollup, status, intensity, processing_time)
+    DailyRollup.objects.bulk_create(rollups.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0011_analysis_overlay'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='Day')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='Completed')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed')),
+                ('cancelled', models.PositiveIntegerField(default=0, verbose_name='Cancelled')),
+                ('intensity_counts', models.JSONField(default=dict, help_text='Completed analyses per change intensity', verbose_name='Completed per Intensity')),
+                ('processing_time_total', models.FloatField(default=0, verbose_name='Total Processing Time (s)')),
+                ('processing_time_histogram', models.JSONField(default=list, help_text='Completed analyses per processing time bucket (see utils.rollups)', verbose_name='Processing Time Histogram')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Daily Rollup',
+                'verbose_name_plural': 'Daily Rollups',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='change_intensity',
+            field=models.CharField(blank=True, choices=[('MINIMAL', 'Minimal'), ('MODERATE', 'Moderate'), ('SIGNIFICANT', 'Significant'), ('DRAMATIC', 'Dramatic')], help_text='Bucket of change_percentage, stored so it can be filtered and counted by index', max_length=12, null=True, verbose_name='Change Intensity'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['change_intensity', 'created_at'], name='landsnap_an_change__3921d3_idx'),
+        ),
+        migrations.RunPython(backfill_intensity_and_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 14:11
+
+from django.db import migrations, models
+
+
+def create_lock_row(apps, schema_editor):
+    apps.get_model('landsnap', 'AdmissionLock').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0012_analysis_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdmissionLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Admission Lock',
+                'verbose_name_plural': 'Admission Locks',
+            },
+        ),
+        migrations.RunPython(create_lock_row, migrations.RunPython.noop),
+    ]
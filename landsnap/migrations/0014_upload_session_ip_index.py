@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('landsnap', '0013_admission_lock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadsession',
+            index=models.Index(fields=['ip_address'], name='landsnap_up_ip_addr_ba8450_idx'),
+        ),
+    ]
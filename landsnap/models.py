@@ -3,6 +3,7 @@ from django.core.validators import FileExtensionValidator, MinValueValidator, Ma
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
+from .storage import content_addressed_storage
 
 def upload_to(instance, filename):
     """Organize uploads by date and model type"""
@@ -19,17 +20,31 @@ class ImageUpload(models.Model):
     
     image1 = models.ImageField(
         upload_to=upload_to,
-        validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])],
+        storage=content_addressed_storage,
+        validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'tif', 'tiff'])],
         verbose_name=_('Before Image'),
         help_text=_('Upload the earlier image of the location')
     )
     image2 = models.ImageField(
         upload_to=upload_to,
-        validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png'])],
+        storage=content_addressed_storage,
+        validators=[FileExtensionValidator(allowed_extensions=['jpg', 'jpeg', 'png', 'tif', 'tiff'])],
         verbose_name=_('After Image'),
         help_text=_('Upload the more recent image of the location')
     )
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Uploaded At'))
+    width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_('Width'),
+        help_text=_('Width in pixels of the larger image of the pair')
+    )
+    height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_('Height'),
+        help_text=_('Height in pixels of the larger image of the pair')
+    )
     ip_address = models.GenericIPAddressField(
         null=True, 
         blank=True,
@@ -61,6 +76,8 @@ class ImageUpload(models.Model):
         indexes = [
             models.Index(fields=['uploaded_at']),
             models.Index(fields=['status']),
+            # Per-client rate limiting counts recent uploads by IP
+            models.Index(fields=['ip_address', 'uploaded_at']),
         ]
 
     def __str__(self):
@@ -76,6 +93,21 @@ class ImageUpload(models.Model):
 
 
 class AnalysisResult(models.Model):
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BATCH = 1
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, _('Interactive')),
+        (PRIORITY_BATCH, _('Batch')),
+    ]
+    INTENSITY_CHOICES = [
+        ('MINIMAL', _('Minimal')),
+        ('MODERATE', _('Moderate')),
+        ('SIGNIFICANT', _('Significant')),
+        ('DRAMATIC', _('Dramatic')),
+    ]
+    # Exclusive upper bound of change_percentage for each intensity but the last
+    INTENSITY_BOUNDS = (('MINIMAL', 5), ('MODERATE', 20), ('SIGNIFICANT', 50))
+    TERMINAL_STATUSES = ('COMPLETE', 'FAILED', 'CANCELLED')
     QUALITY_CHOICES = [
         ('LOW', _('Low Confidence')),
         ('MEDIUM', _('Medium Confidence')),
@@ -88,6 +120,7 @@ class AnalysisResult(models.Model):
             ('PROCESSING', 'Processing'),
             ('COMPLETE', 'Complete'),
             ('FAILED', 'Failed'),
+            ('CANCELLED', 'Cancelled'),
         ],
         default='PENDING',
     )
@@ -103,7 +136,28 @@ class AnalysisResult(models.Model):
         verbose_name=_('Heatmap Image'),
         help_text=_('Generated change detection heatmap')
     )
+    overlay = models.FileField(
+        upload_to=upload_to,
+        null=True,
+        blank=True,
+        verbose_name=_('Change Overlay'),
+        help_text=_('Run-length encoded change regions, composited over the after image in the browser')
+    )
     change_percentage = models.FloatField(null=True, blank=True)  
+    change_intensity = models.CharField(
+        max_length=12,
+        choices=INTENSITY_CHOICES,
+        null=True,
+        blank=True,
+        verbose_name=_('Change Intensity'),
+        help_text=_('Bucket of change_percentage, stored so it can be filtered and counted by index')
+    )
+    roi = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name=_('Region of Interest'),
+        help_text=_('Polygon and bounding window the analysis was restricted to; change is scored inside it only')
+    )
     # change_percentage = models.FloatField(
     #     validators=[MinValueValidator(0), MaxValueValidator(100)],
     #     verbose_name=_('Change Percentage'),
@@ -114,6 +168,51 @@ class AnalysisResult(models.Model):
         verbose_name=_('Created At')
     )
     processing_time = models.FloatField(null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(
+        choices=PRIORITY_CHOICES,
+        default=PRIORITY_INTERACTIVE,
+        verbose_name=_('Priority')
+    )
+    queued_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Queued At'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Started At'))
+    queue_wait = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name=_('Queue Wait (s)'),
+        help_text=_('Seconds between queueing and a worker starting the analysis')
+    )
+    worker_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name=_('Worker'),
+        help_text=_('Worker holding the lease on this analysis')
+    )
+    lease_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Lease Expires At'),
+        help_text=_('Renewed by the worker heartbeat; expired leases are reaped')
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('Attempts'))
+    cancel_requested = models.BooleanField(default=False, verbose_name=_('Cancel Requested'))
+    estimated_memory = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_('Estimated Memory (bytes)'),
+        help_text=_('Peak memory the analysis is expected to need')
+    )
+    estimated_seconds = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name=_('Estimated Time (s)'),
+        help_text=_('CPU time the analysis is expected to take')
+    )
+    error_message = models.TextField(
+        blank=True,
+        null=True,
+        verbose_name=_('Error Message')
+    )
      
     quality_rating = models.CharField(
         max_length=10,
@@ -136,22 +235,142 @@ class AnalysisResult(models.Model):
         indexes = [
             models.Index(fields=['created_at']),
             models.Index(fields=['change_percentage']),
+            models.Index(fields=['change_intensity', 'created_at']),
             models.Index(fields=['quality_rating']),
+            # Workers scan PENDING results; fair share sums recent starts per client
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['started_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
         ]
 
     def __str__(self):
         return f"Analysis for Upload #{self.upload.id} ({self.change_percentage}% change)"
 
+    @classmethod
+    def intensity_for(cls, percentage):
+        """Categorize a change percentage, or None if there isn't one"""
+        if percentage is None:
+            return None
+        for intensity, bound in cls.INTENSITY_BOUNDS:
+            if percentage < bound:
+                return intensity
+        return 'DRAMATIC'
+
     @property
-    def change_intensity(self):
-        """Categorize change percentage for display"""
-        if self.change_percentage < 5:
-            return _('Minimal')
-        elif self.change_percentage < 20:
-            return _('Moderate')
-        elif self.change_percentage < 50:
-            return _('Significant')
-        return _('Dramatic')
+    def heatmap_is_mask(self):
+        """Whether `heatmap` holds only the change mask rather than a rendered composite"""
+        return (self.metadata or {}).get('heatmap_format') == 'mask'
 
     def get_absolute_url(self):
-        return self.upload.get_absolute_url()
\ No newline at end of file
+        return self.upload.get_absolute_url()
+
+
+class StoredBlob(models.Model):
+    """Reference count for a content-addressed original shared between uploads"""
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name=_('SHA-256'))
+    name = models.CharField(max_length=255, unique=True, verbose_name=_('Storage Name'))
+    size = models.PositiveBigIntegerField(verbose_name=_('Size (bytes)'))
+    refcount = models.PositiveIntegerField(default=0, verbose_name=_('References'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+
+    class Meta:
+        verbose_name = _("Stored Blob")
+        verbose_name_plural = _("Stored Blobs")
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class UploadSession(models.Model):
+    """A resumable upload of one image, assembled chunk by chunk under PARTIAL_ROOT"""
+    PARTIAL_ROOT = 'partial'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255, verbose_name=_('File Name'))
+    length = models.PositiveBigIntegerField(verbose_name=_('Total Size (bytes)'))
+    offset = models.PositiveBigIntegerField(default=0, verbose_name=_('Bytes Received'))
+    width = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Width'))
+    height = models.PositiveIntegerField(null=True, blank=True, verbose_name=_('Height'))
+    ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name=_('IP Address'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
+
+    class Meta:
+        verbose_name = _("Upload Session")
+        verbose_name_plural = _("Upload Sessions")
+        indexes = [
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['ip_address']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.length} bytes)"
+
+    @property
+    def partial_name(self):
+        return f"{self.PARTIAL_ROOT}/{self.id.hex}.part"
+
+    @property
+    def is_complete(self):
+        return self.offset == self.length
+
+
+class AdmissionLock(models.Model):
+    """
+    A single row that admission checks and job claims lock (see
+    utils.admission.lock_budget), so each one's view of the running and
+    queued work stays current until its own row change commits.
+    """
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
+
+    class Meta:
+        verbose_name = _("Admission Lock")
+        verbose_name_plural = _("Admission Locks")
+
+    def __str__(self):
+        return f"Admission lock (last taken {self.updated_at})"
+
+
+class DailyRollup(models.Model):
+    """
+    Aggregates of the analyses created on one day that have finished,
+    maintained by utils.rollups as each one ends. They are kept after
+    retention deletes the results.
+    """
+    day = models.DateField(unique=True, verbose_name=_('Day'))
+    completed = models.PositiveIntegerField(default=0, verbose_name=_('Completed'))
+    failed = models.PositiveIntegerField(default=0, verbose_name=_('Failed'))
+    cancelled = models.PositiveIntegerField(default=0, verbose_name=_('Cancelled'))
+    intensity_counts = models.JSONField(
+        default=dict,
+        verbose_name=_('Completed per Intensity'),
+        help_text=_('Completed analyses per change intensity')
+    )
+    processing_time_total = models.FloatField(default=0, verbose_name=_('Total Processing Time (s)'))
+    processing_time_histogram = models.JSONField(
+        default=list,
+        verbose_name=_('Processing Time Histogram'),
+        help_text=_('Completed analyses per processing time bucket (see utils.rollups)')
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
+
+    class Meta:
+        ordering = ['-day']
+        verbose_name = _("Daily Rollup")
+        verbose_name_plural = _("Daily Rollups")
+
+    def __str__(self):
+        return f"{self.day}: {self.completed} complete, {self.failed} failed"
+
+    @property
+    def finished(self):
+        return self.completed + self.failed
+
+    @property
+    def failure_rate(self):
+        """Share of finished analyses that failed, ignoring cancellations"""
+        return self.failed / self.finished if self.finished else None
+
+    @property
+    def mean_processing_time(self):
+        return self.processing_time_total / self.completed if self.completed else None
@@ -0,0 +1,34 @@
+import logging
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ImageUpload, AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+
+def delete_field_files(instance, *field_names):
+    """Remove the files behind `field_names` once the surrounding transaction commits"""
+    for field_name in field_names:
+        field_file = getattr(instance, field_name)
+        if not field_file:
+            continue
+        storage, name = field_file.storage, field_file.name
+
+        def delete(storage=storage, name=name):
+            try:
+                storage.delete(name)
+            except OSError as e:
+                logger.warning("Could not delete %s: %s", name, e)
+
+        transaction.on_commit(delete)
+
+
+@receiver(post_delete, sender=ImageUpload)
+def delete_upload_files(sender, instance, **kwargs):
+    delete_field_files(instance, 'image1', 'image2')
+
+
+@receiver(post_delete, sender=AnalysisResult)
+def delete_result_files(sender, instance, **kwargs):
+    delete_field_files(instance, 'heatmap', 'overlay')
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+CONTENT_ROOT = 'originals'
+GRAY_SIDECAR_SUFFIX = '.gray.npy'
+PREVIEW_SIDECAR_SUFFIX = '.preview.jpg'
+SIDECAR_SUFFIXES = (GRAY_SIDECAR_SUFFIX, PREVIEW_SIDECAR_SUFFIX)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, named by the SHA-256 of its content.
+
+    Saving content that is already stored returns the existing name and bumps
+    its reference count in StoredBlob; `delete` drops a reference and only
+    removes the file (and its grayscale and preview sidecars) when none are left. Names
+    outside CONTENT_ROOT, from before content addressing, are deleted outright.
+    """
+
+    def content_name(self, content, name):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        sha256 = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        return sha256, f"{CONTENT_ROOT}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        sha256, name = self.content_name(content, name)
+        blob_model = apps.get_model('landsnap', 'StoredBlob')
+        # Holds the blob's row lock until the reference is recorded, so a
+        # concurrent `delete` can't unlink the file in between
+        with transaction.atomic():
+            blob = blob_model.objects.select_for_update().filter(sha256=sha256).first()
+            # Same bytes under another extension still share the first stored copy
+            if blob is not None:
+                name = blob.name
+            if not self.exists(name):
+                saved = self._save(name, content)
+                if saved != name:
+                    # Lost a race with an identical upload; keep the canonical copy
+                    super().delete(saved)
+            if blob is not None:
+                blob_model.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+                return name
+        stored_name = self._add_reference(sha256, name, content.size)
+        if stored_name != name:
+            # An identical upload under another extension was recorded first
+            super().delete(name)
+        return stored_name
+
+    def delete(self, name):
+        blob_model = apps.get_model('landsnap', 'StoredBlob')
+        # The decrement and the unlink happen under the row lock `save` takes
+        with transaction.atomic():
+            blob = blob_model.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                blob_model.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+            for suffix in SIDECAR_SUFFIXES:
+                super().delete(name + suffix)
+
+    def refcount(self, name):
+        blob_model = apps.get_model('landsnap', 'StoredBlob')
+        return blob_model.objects.filter(name=name).values_list('refcount', flat=True).first() or 0
+
+    def _add_reference(self, sha256, name, size):
+        """
+        Record the first reference to a newly stored file, or another one if a
+        concurrent save beat us to it. Returns the blob's stored name.
+        """
+        blob_model = apps.get_model('landsnap', 'StoredBlob')
+        try:
+            with transaction.atomic():
+                blob_model.objects.create(sha256=sha256, name=name, size=size, refcount=1)
+            return name
+        except IntegrityError:
+            with transaction.atomic():
+                blob = blob_model.objects.select_for_update().get(sha256=sha256)
+                blob_model.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+            return blob.name
+
+
+def content_addressed_storage():
+    return _content_addressed_storage
+
+
+_content_addressed_storage = ContentAddressedStorage()
@@ -1,3 +1,800 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+import cv2
+import numpy as np
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from . import tracing
+from .admin import AnalysisResultAdmin
+from .forms import UploadForm
+from .jobs import INLINE_WORKER, JobCancelled, claim_next, heartbeat, reap_expired, request_cancel, run_job
+from .models import AnalysisResult, DailyRollup, ImageUpload, StoredBlob, UploadSession
+from .storage import GRAY_SIDECAR_SUFFIX, PREVIEW_SIDECAR_SUFFIX, content_addressed_storage
+from .utils import admission, raster
+from .utils.image_utils import (
+    analyze_heatmap, detect_change_regions, encode_heatmap, process_image, write_sidecar,
+)
+from .utils.admission import AdmissionRejected, JobCost, admit, memory_budget
+from .utils.analysis import analyze_upload, input_hash, params_hash
+from .utils.chunked import ChunkedUploadedFile, close_files, partial_path
+from .utils.raster import RasterReader, analyze_tiled
+from .utils.reanalysis import queue_reanalysis
+from .utils.roi import normalize_roi, parse_roi
+from .utils.retention import RetentionReport, compact_format, expire_uploads, sweep_orphans
+from .utils.scheduler import pending_jobs, queue_positions, schedule
+from .utils.regression import CORPUS, compare, load_golden, path_reference, run_regression, write_pair
+from .utils.rollups import Outcome, apply_outcome, describe, histogram_percentile
+from .views import UploadView
 
-# Create your tests here.
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+class MediaTestCase(TestCase):
+    """TestCase with MEDIA_ROOT in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = self.settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def create_result(self, status='COMPLETE', ip_address=None, before=b'before', after=b'after', **fields):
+        upload = ImageUpload.objects.create(
+            image1=SimpleUploadedFile('before.png', before),
+            image2=SimpleUploadedFile('after.png', after),
+            ip_address=ip_address,
+        )
+        return AnalysisResult.objects.create(upload=upload, status=status, **fields)
+
+
+def textured_raster(height, width, seed=0):
+    """Smooth random texture, so unchanged areas score as unchanged under SSIM"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 255, (height // 32 + 2, width // 32 + 2), dtype=np.uint8)
+    return np.kron(coarse, np.ones((32, 32), dtype=np.uint8))[:height, :width]
+
+
+@skipUnless(tifffile, "tifffile is not installed")
+class RasterReaderTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        rng = np.random.default_rng(1)
+        self.rgb = rng.integers(0, 255, (700, 900, 3), dtype=np.uint8)
+
+    def write(self, name, data, **kwargs):
+        path = os.path.join(self.tmpdir, name)
+        tifffile.imwrite(path, data, **kwargs)
+        return path
+
+    def assert_windows_match(self, path, data):
+        with RasterReader(path) as reader:
+            self.assertEqual(reader.shape, data.shape[:2])
+            for y0, y1, x0, x1 in [(0, 700, 0, 900), (0, 1, 0, 1), (250, 530, 100, 777), (600, 700, 800, 900)]:
+                window = reader.read(y0, y1, x0, x1)
+                np.testing.assert_array_equal(window.reshape(data[y0:y1, x0:x1].shape), data[y0:y1, x0:x1])
+
+    def test_tiled_compressed(self):
+        path = self.write('tiled.tif', self.rgb, tile=(256, 256), compression='zlib', photometric='rgb')
+        self.assert_windows_match(path, self.rgb)
+
+    def test_stripped_compressed(self):
+        path = self.write('strips.tif', self.rgb, rowsperstrip=64, compression='zlib', photometric='rgb')
+        self.assert_windows_match(path, self.rgb)
+
+    def test_uncompressed_bigtiff_is_memory_mapped(self):
+        path = self.write('big.tif', self.rgb, bigtiff=True, photometric='rgb')
+        with RasterReader(path) as reader:
+            self.assertIsNotNone(reader._memmap)
+        self.assert_windows_match(path, self.rgb)
+
+    def test_sixteen_bit_is_scaled_to_eight_bit(self):
+        data = (self.rgb[:, :, 0].astype(np.uint16) << 8)
+        path = self.write('deep.tif', data, tile=(128, 128))
+        with RasterReader(path) as reader:
+            bgr = reader.read_bgr(0, 700, 0, 900)
+        np.testing.assert_array_equal(bgr[:, :, 0], self.rgb[:, :, 0])
+
+
+@skipUnless(tifffile, "tifffile is not installed")
+class TiledAnalysisTests(SimpleTestCase):
+    """Change detection on synthetic scenes larger than the 5000px JPEG/PNG cap"""
+
+    height, width = 6144, 5120
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        before = textured_raster(cls.height, cls.width)
+        after = before.copy()
+        # Replace one tile-aligned 1024px block outright
+        after[2048:3072, 1024:2048] = 255 - after[2048:3072, 1024:2048]
+        cls.before = os.path.join(cls.tmpdir, 'before.tif')
+        cls.after = os.path.join(cls.tmpdir, 'after.tif')
+        tifffile.imwrite(cls.before, before, tile=(512, 512), compression='zlib', bigtiff=True)
+        tifffile.imwrite(cls.after, after, tile=(512, 512), compression='zlib', bigtiff=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+        super().tearDownClass()
+
+    def test_change_is_localised_to_the_changed_tile(self):
+        output = analyze_tiled(self.before, self.after, tile_size=1024, overview_max=1024)
+        tiles = {(tile['y'], tile['x']): tile['change_percentage'] for tile in output['raster']['tiles']}
+
+        self.assertEqual(len(tiles), 6 * 5)
+        self.assertGreater(tiles[(2048, 1024)], 50)
+        unchanged = [pct for key, pct in tiles.items() if key != (2048, 1024)]
+        self.assertLess(max(unchanged), 5)
+        self.assertAlmostEqual(output['change_percentage'], tiles[(2048, 1024)] / 30, delta=1)
+
+    def test_overview_is_downscaled(self):
+        output = analyze_tiled(self.before, self.after, tile_size=2048, overview_max=800)
+        self.assertEqual(output['raster']['overview_scale'], round(800 / self.height, 6))
+        self.assertEqual(output['heatmap'].name, 'heatmap.png')
+
+    def test_mismatched_dimensions_are_rejected(self):
+        small = os.path.join(self.tmpdir, 'small.tif')
+        tifffile.imwrite(small, textured_raster(600, 600))
+        with self.assertRaises(Exception):
+            analyze_tiled(self.before, small)
+
+    def test_upload_form_accepts_rasters_beyond_jpeg_cap(self):
+        with open(self.before, 'rb') as f1, open(self.after, 'rb') as f2:
+            form = UploadForm(files={
+                'image1': SimpleUploadedFile('before.tif', f1.read(), content_type='image/tiff'),
+                'image2': SimpleUploadedFile('after.tif', f2.read(), content_type='image/tiff'),
+            })
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_upload_form_rejects_rasters_of_different_dimensions(self):
+        def upload(name, height, width):
+            path = os.path.join(self.tmpdir, name)
+            tifffile.imwrite(path, textured_raster(height, width))
+            with open(path, 'rb') as f:
+                return SimpleUploadedFile(name, f.read(), content_type='image/tiff')
+
+        form = UploadForm(files={'image1': upload('a.tif', 600, 600), 'image2': upload('b.tif', 640, 600)})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()['__all__'][0].code, 'raster_dimension_mismatch')
+
+    def test_missing_tifffile_is_reported(self):
+        original, raster.tifffile = raster.tifffile, None
+        try:
+            with self.assertRaisesMessage(Exception, 'tifffile'):
+                RasterReader(self.before)
+        finally:
+            raster.tifffile = original
+
+
+class GoldenOutputTests(SimpleTestCase):
+    """Optimized analysis paths must reproduce the recorded outputs of the regression corpus"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_goldens_cover_the_corpus(self):
+        self.assertEqual(set(load_golden()['cases']), set(CORPUS))
+
+    def test_code_paths_match_goldens(self):
+        failures = [f"{c.case}/{c.path}: {'; '.join(c.failures)}" for c in run_regression(self.tmpdir) if not c.ok]
+        self.assertEqual(failures, [])
+
+    def test_drift_beyond_tolerance_is_reported(self):
+        metrics = path_reference(*write_pair('new_buildings', self.tmpdir))
+        record = load_golden()['cases']['new_buildings']
+        metrics['mask'] = metrics['mask'].copy()
+        metrics['mask'][:16] = 255 - metrics['mask'][:16]
+        metrics['change_percentage'] += 0.1
+        comparison = compare('new_buildings', 'reference', metrics, record)
+        self.assertFalse(comparison.ok)
+        self.assertEqual([failure.split()[0] for failure in comparison.failures], ['change_percentage', 'mask'])
+
+
+class ChangeOverlayTests(SimpleTestCase):
+    """The browser overlay must decode to the same regions as the analysis mask"""
+
+    def test_overlay_runs_match_change_mask(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        img1_path, img2_path = write_pair('new_buildings', tmpdir)
+        output = analyze_heatmap(img1_path, img2_path, 'png')
+        overlay = json.loads(output['overlay'].read())
+
+        labels = np.repeat(overlay['runs'][::2], overlay['runs'][1::2]).reshape(overlay['height'], overlay['width'])
+        _intensity, mask, boxes = detect_change_regions(process_image(img1_path), process_image(img2_path))
+        self.assertEqual(len(overlay['regions']), len(boxes))
+        self.assertEqual(set(np.unique(labels)) - {0}, {region['id'] for region in overlay['regions']})
+        expected = cv2.resize(mask, (overlay['width'], overlay['height']), interpolation=cv2.INTER_NEAREST) > 0
+        self.assertLess(np.mean((labels > 0) != expected), 0.01)
+        self.assertTrue(os.path.exists(img2_path + PREVIEW_SIDECAR_SUFFIX))
+
+    def test_failed_sidecar_write_leaves_no_temp_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        def fail(f):
+            f.write(b'partial')
+            raise OSError("disk full")
+        self.assertFalse(write_sidecar(os.path.join(tmpdir, 'frame.png.gray.npy'), fail))
+        self.assertEqual(os.listdir(tmpdir), [])
+
+
+class HeatmapFormatTests(MediaTestCase):
+    def test_each_format_decodes_to_the_heatmap(self):
+        rng = np.random.default_rng(0)
+        image = cv2.GaussianBlur(rng.integers(0, 255, (48, 64, 3), dtype=np.uint8), (5, 5), 0)
+        for fmt, ext, max_error in (('png', 'png', 0), ('webp-lossless', 'webp', 0), ('webp', 'webp', 12),
+                                    ('jpeg', 'jpg', 12)):
+            with self.subTest(fmt=fmt):
+                data, encoded_ext = encode_heatmap(image, fmt)
+                self.assertEqual(encoded_ext, ext)
+                decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                self.assertLessEqual(np.abs(decoded.astype(int) - image).mean(), max_error)
+
+        mask = np.where(rng.random((48, 64)) > 0.5, 255, 0).astype(np.uint8)
+        data, ext = encode_heatmap(mask, 'mask')
+        # A 1-bit greyscale PNG: bit depth and colour type follow the IHDR size fields
+        self.assertEqual((ext, data[24], data[25]), ('png', 1, 0))
+        np.testing.assert_array_equal(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED), mask)
+        with self.assertRaises(ValueError):
+            encode_heatmap(image, 'gif')
+
+    @override_settings(LANDSNAP_HEATMAP_FORMAT='mask')
+    def test_mask_heatmap_is_rendered_when_viewed(self):
+        before, after = write_pair('new_buildings', tempfile.mkdtemp(dir=self.media_root))
+        with open(before, 'rb') as image1, open(after, 'rb') as image2:
+            result = self.create_result('PROCESSING', before=image1.read(), after=image2.read())
+        analyze_upload(result.upload)
+        result.refresh_from_db()
+        self.assertEqual((result.status, result.metadata['heatmap_format']), ('COMPLETE', 'mask'))
+        self.assertEqual(cv2.imread(result.heatmap.path, cv2.IMREAD_UNCHANGED).ndim, 2)
+
+        result_id = result.upload.result_id
+        response = self.client.get(reverse('landsnap:heatmap_image', kwargs={'result_id': result_id}))
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/png'))
+        self.assertNotIn('Content-Disposition', response)
+        composite = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+        self.assertEqual(composite.shape, (*cv2.imread(after).shape[:2], 3))
+
+        download = reverse('landsnap:download_heatmap', kwargs={'result_id': result_id, 'format': 'png'})
+        self.assertEqual(self.client.get(download).content, response.content)
+        download = reverse('landsnap:download_heatmap', kwargs={'result_id': result_id, 'format': 'jpg'})
+        response = self.client.get(download)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIsNotNone(cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR))
+        download = reverse('landsnap:download_heatmap', kwargs={'result_id': result_id, 'format': 'pdf'})
+        self.assertTrue(self.client.get(download).content.startswith(b'%PDF'))
+
+        preview = AnalysisResultAdmin(AnalysisResult, admin.site).heatmap_preview(result)
+        self.assertIn(reverse('landsnap:heatmap_image', kwargs={'result_id': result_id}), preview)
+
+
+class RegionOfInterestTests(SimpleTestCase):
+    def test_regions_are_clipped_to_the_frame(self):
+        roi = normalize_roi(parse_roi('{"bbox": [-10, 20.4, 100, 500]}'), 80, 200)
+        self.assertEqual(roi['polygon'], [[0, 20], [80, 20], [80, 200], [0, 200]])
+        self.assertEqual((roi['bbox'], roi['frame'], roi['rectangle']), ([0, 20, 80, 180], [80, 200], True))
+
+        triangle = normalize_roi(parse_roi({'polygon': [[0, 0], [100, 0], [0, 100]]}), 200, 200)
+        self.assertFalse(triangle['rectangle'])
+        # Four points covering only three corners are not a rectangle
+        repeated = normalize_roi(parse_roi({'polygon': [[0, 0], [100, 0], [100, 100], [100, 100]]}), 200, 200)
+        self.assertFalse(repeated['rectangle'])
+        bow_tie = normalize_roi(parse_roi({'polygon': [[0, 0], [100, 100], [100, 0], [0, 100]]}), 200, 200)
+        self.assertFalse(bow_tie['rectangle'])
+        clockwise = normalize_roi(parse_roi({'polygon': [[0, 0], [0, 100], [100, 100], [100, 0]]}), 200, 200)
+        self.assertTrue(clockwise['rectangle'])
+
+    def test_invalid_regions_are_rejected(self):
+        for value in ('{"bbox": [0, 0, NaN, 50]}', '{"bbox": [0, 0, 50, Infinity]}',
+                      '{"polygon": [[0, 0], [NaN, 0], [0, 50]]}', '{"bbox": [0, 0, -5, 50]}',
+                      '{"polygon": [[0, 0], [1, 1]]}', '{"circle": [0, 0, 5]}'):
+            with self.subTest(value=value), self.assertRaises(ValidationError) as raised:
+                parse_roi(value)
+            self.assertEqual(raised.exception.code, 'invalid_roi')
+
+        with self.assertRaises(ValidationError) as raised:
+            normalize_roi(parse_roi('{"bbox": [0, 0, 100, 100]}'), 120, 20)
+        self.assertEqual(raised.exception.code, 'roi_too_small')
+
+
+class RollupTests(SimpleTestCase):
+    def test_outcomes_move_between_buckets_without_double_counting(self):
+        rollup = DailyRollup(intensity_counts={}, processing_time_histogram=[])
+        apply_outcome(rollup, Outcome('COMPLETE', AnalysisResult.intensity_for(3.2), 1.5))
+        apply_outcome(rollup, Outcome('FAILED'))
+        # A reanalysis replaces the first result's contribution
+        apply_outcome(rollup, Outcome('COMPLETE', 'MINIMAL', 1.5), -1)
+        apply_outcome(rollup, Outcome('COMPLETE', AnalysisResult.intensity_for(55), 12.0))
+
+        summary = describe(rollup)
+        self.assertEqual((summary['completed'], summary['failed'], summary['failure_percentage']), (1, 1, 50.0))
+        self.assertEqual({item['code']: item['count'] for item in summary['intensities']},
+                         {'MINIMAL': 0, 'MODERATE': 0, 'SIGNIFICANT': 0, 'DRAMATIC': 1})
+        self.assertEqual(summary['mean_processing_time'], 12.0)
+        self.assertTrue(10 < summary['p95_processing_time'] <= 20)
+        self.assertIsNone(histogram_percentile([0] * len(rollup.processing_time_histogram), 0.95))
+
+
+class TracingTests(SimpleTestCase):
+    def test_spans_nest_and_continue_across_processes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'traces.jsonl')
+        with self.settings(LANDSNAP_TRACE_EXPORTER='file', LANDSNAP_TRACE_FILE=path):
+            with tracing.span('request', result_id='r1') as request:
+                with tracing.span('stage'):
+                    pass
+                parent = tracing.traceparent()
+            # What a worker does with the traceparent stored on the result
+            with self.assertRaises(ValueError):
+                with tracing.span('job', parent=parent):
+                    raise ValueError('boom')
+
+        with open(path) as f:
+            batches = [json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans'] for line in f]
+        self.assertEqual([[span['name'] for span in batch] for batch in batches], [['stage', 'request'], ['job']])
+        stage, root = batches[0]
+        job = batches[1][0]
+        self.assertEqual(stage['parentSpanId'], root['spanId'])
+        self.assertNotIn('parentSpanId', root)
+        self.assertEqual({'key': 'landsnap.result_id', 'value': {'stringValue': 'r1'}}, stage['attributes'][0])
+        self.assertEqual((job['traceId'], job['parentSpanId']), (request.trace_id, request.span_id))
+        self.assertEqual(job['status'], {'code': tracing.STATUS_ERROR, 'message': 'boom'})
+
+
+class WebImportTimeTests(SimpleTestCase):
+    """Web workers must boot without loading the imaging and PDF stacks"""
+
+    HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'reportlab', 'tifffile')
+    BOOT = (
+        "import django; django.setup(); "
+        "import core.urls; from django.urls import resolve; resolve('/about/')"
+    )
+
+    def test_url_conf_does_not_import_heavy_modules(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'core.settings'}
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', self.BOOT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr[-2000:])
+        # Lines look like "import time:  self [us] | cumulative | package.module"
+        imported = {
+            line.rsplit('|', 1)[1].strip().split('.')[0]
+            for line in proc.stderr.splitlines() if line.startswith('import time:') and '|' in line
+        }
+        self.assertFalse(imported & set(self.HEAVY_MODULES),
+                         f"Heavy modules loaded at web boot: {sorted(imported & set(self.HEAVY_MODULES))}")
+
+
+@override_settings(LANDSNAP_ANALYSIS_MAX_CONCURRENT=4, LANDSNAP_QUEUE_MAX_BACKLOG=60)
+class AdmissionTests(MediaTestCase):
+    def test_inline_admission_refuses_a_job_over_the_memory_budget(self):
+        cost = JobCost(memory=1024, seconds=10)
+        admit(cost, inline=True)
+        self.create_result('PROCESSING', estimated_memory=memory_budget(), estimated_seconds=20)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admit(cost, inline=True)
+        self.assertEqual(rejected.exception.retry_after, 5)
+
+    def test_queued_admission_refuses_a_job_over_the_backlog(self):
+        self.create_result('PENDING', estimated_memory=1024, estimated_seconds=50)
+        admit(JobCost(memory=1024, seconds=10), inline=False)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admit(JobCost(memory=1024, seconds=11), inline=False)
+        self.assertEqual(rejected.exception.retry_after, 1)
+
+    def test_batch_backlog_does_not_refuse_interactive_uploads(self):
+        self.create_result('PENDING', priority=AnalysisResult.PRIORITY_BATCH, estimated_seconds=600)
+        admit(JobCost(memory=1024, seconds=10), inline=False, priority=AnalysisResult.PRIORITY_INTERACTIVE)
+        with self.assertRaises(AdmissionRejected):
+            admit(JobCost(memory=1024, seconds=10), inline=False, priority=AnalysisResult.PRIORITY_BATCH)
+
+
+    @override_settings(LANDSNAP_INLINE_ANALYSIS=False, LANDSNAP_QUEUE_MAX_BACKLOG=60)
+    def test_originals_are_stored_before_the_lock_and_released_when_refused(self):
+        self.create_result('PENDING', estimated_memory=1024, estimated_seconds=600)
+        stored = set(StoredBlob.objects.values_list('name', flat=True))
+        lock_budget = admission.lock_budget
+        blobs_at_lock = []
+
+        def counting_lock_budget():
+            blobs_at_lock.append(StoredBlob.objects.count())
+            lock_budget()
+
+        before, after = write_pair('new_buildings', tempfile.mkdtemp(dir=self.media_root))
+        with open(before, 'rb') as image1, open(after, 'rb') as image2, \
+                mock.patch.object(admission, 'lock_budget', counting_lock_budget):
+            response = self.client.post(reverse('landsnap:upload'), {'image1': image1, 'image2': image2})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(blobs_at_lock, [len(stored) + 2])
+        self.assertEqual(set(StoredBlob.objects.values_list('name', flat=True)), stored)
+        on_disk = {os.path.relpath(os.path.join(dirpath, name), self.media_root).replace(os.sep, '/')
+                   for dirpath, _dirnames, names in os.walk(os.path.join(self.media_root, 'originals'))
+                   for name in names}
+        self.assertEqual(on_disk, stored)
+
+@override_settings(LANDSNAP_SCHEDULER_MAX_WAIT=900)
+class SchedulerTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        interactive, batch = AnalysisResult.PRIORITY_INTERACTIVE, AnalysisResult.PRIORITY_BATCH
+        jobs = [
+            ('a', '10.0.0.1', interactive, 10, 60),
+            ('a_short', '10.0.0.1', interactive, 5, 30),
+            ('a_batch', '10.0.0.1', batch, 1, 10),
+            ('b', '10.0.0.2', interactive, 20, 20),
+            ('c_overdue', '10.0.0.3', batch, 50, 1000),
+        ]
+        self.names = {}
+        for name, ip_address, priority, seconds, waited in jobs:
+            result = self.create_result('PENDING', ip_address=ip_address, priority=priority, estimated_seconds=seconds,
+                                        queued_at=self.now - timedelta(seconds=waited))
+            self.names[result.pk] = name
+
+    def order(self, jobs, usage):
+        return [self.names[job['pk']] for job in schedule(jobs, usage, self.now)]
+
+    def test_overdue_then_priority_then_fair_share_then_shortest(self):
+        # 10.0.0.1 has used more CPU time recently, so 10.0.0.2 goes first among interactive jobs
+        self.assertEqual(self.order(pending_jobs(), {'10.0.0.1': 100}),
+                         ['c_overdue', 'b', 'a_short', 'a', 'a_batch'])
+
+    def test_bounded_candidates_are_the_head_of_each_client_queue(self):
+        self.assertEqual(sorted(self.names[job['pk']] for job in pending_jobs(depth=1, now=self.now)),
+                         ['a_short', 'b', 'c_overdue'])
+        self.assertEqual(self.order(pending_jobs(depth=2, now=self.now), {'10.0.0.1': 100}),
+                         ['c_overdue', 'b', 'a_short', 'a'])
+
+
+    def test_queue_positions_reuse_a_cached_ranking(self):
+        results = list(AnalysisResult.objects.all())
+        positions = queue_positions(results)
+        self.assertEqual(sorted(positions.values()), [1, 2, 3, 4, 5])
+        with self.assertNumQueries(0):
+            self.assertEqual(queue_positions(results), positions)
+
+        # A job queued after the ranking was cached brings a fresh one
+        late = self.create_result('PENDING', ip_address='10.0.0.4', estimated_seconds=1)
+        results.append(late)
+        positions = queue_positions(results)
+        self.assertEqual(sorted(positions.values()), [1, 2, 3, 4, 5, 6])
+        with self.assertNumQueries(0):
+            self.assertEqual(queue_positions(results), positions)
+
+@override_settings(LANDSNAP_INLINE_ANALYSIS=False, LANDSNAP_MAX_ATTEMPTS=2, LANDSNAP_ANALYSIS_MAX_CONCURRENT=2)
+class JobLifecycleTests(MediaTestCase):
+    def expire(self, result):
+        AnalysisResult.objects.filter(pk=result.pk).update(lease_expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_expired_lease_is_requeued_until_attempts_run_out(self):
+        result = self.create_result('PROCESSING', worker_id='dead-worker', attempts=1)
+        self.expire(result)
+        self.assertEqual(reap_expired(), (1, 0))
+        result.refresh_from_db()
+        self.assertEqual((result.status, result.worker_id, result.lease_expires_at), ('PENDING', '', None))
+
+        claimed = claim_next('second-worker')
+        self.assertEqual((claimed.pk, claimed.attempts), (result.pk, 2))
+        self.expire(claimed)
+        self.assertEqual(reap_expired(), (0, 1))
+        result.refresh_from_db()
+        self.assertEqual(result.status, 'FAILED')
+        self.assertEqual(DailyRollup.objects.get().failed, 1)
+
+    def test_cancel_transitions(self):
+        queued = self.create_result('PENDING')
+        self.assertTrue(request_cancel(queued))
+        self.assertEqual(AnalysisResult.objects.get(pk=queued.pk).status, 'CANCELLED')
+        self.assertFalse(request_cancel(queued))
+
+        running = self.create_result('PROCESSING', worker_id='worker', attempts=1,
+                                     lease_expires_at=timezone.now() + timedelta(minutes=1))
+        self.assertTrue(request_cancel(running))
+        with self.assertRaises(JobCancelled):
+            heartbeat(running, 'worker')
+        self.expire(running)
+        self.assertEqual(reap_expired(), (0, 1))
+        self.assertEqual(AnalysisResult.objects.get(pk=running.pk).status, 'CANCELLED')
+        self.assertEqual(DailyRollup.objects.get().cancelled, 2)
+
+        inline = self.create_result('PROCESSING', worker_id=INLINE_WORKER)
+        self.assertFalse(request_cancel(inline))
+
+
+class ReanalysisTests(MediaTestCase):
+    @override_settings(LANDSNAP_ANALYSIS_MAX_CONCURRENT=2)
+    def test_unchanged_results_are_kept_and_busy_ones_left_alone(self):
+        result = self.create_result(heatmap='results/heatmap.png', change_percentage=12.5,
+                                    change_intensity='MODERATE', processing_time=3.0)
+        result.metadata = {'params_hash': params_hash(),
+                           'input_hash': input_hash(result.upload.image1.path, result.upload.image2.path)}
+        result.save()
+        running = self.create_result('PROCESSING', before=b'other before', after=b'other after')
+        DailyRollup.objects.create(day=timezone.localdate(), completed=1, intensity_counts={'MODERATE': 1})
+
+        stats = queue_reanalysis(AnalysisResult.objects.all())
+        self.assertEqual((stats.queued, stats.busy), (1, 1))
+        result.refresh_from_db()
+        self.assertEqual((result.status, result.priority), ('PENDING', AnalysisResult.PRIORITY_BATCH))
+        self.assertEqual(AnalysisResult.objects.get(pk=running.pk).status, 'PROCESSING')
+
+        # The row is not requeued a second time while it waits
+        self.assertEqual(queue_reanalysis(AnalysisResult.objects.filter(pk=result.pk)).queued, 0)
+
+        claimed = claim_next('test-worker')
+        self.assertEqual(claimed.pk, result.pk)
+        run_job(claimed, 'test-worker')
+        result.refresh_from_db()
+        self.assertEqual((result.status, result.heatmap.name), ('COMPLETE', 'results/heatmap.png'))
+        self.assertNotIn('reanalysis', result.metadata)
+        rollup = DailyRollup.objects.get()
+        self.assertEqual((rollup.completed, rollup.intensity_counts['MODERATE']), (1, 1))
+
+
+    @override_settings(LANDSNAP_HEARTBEAT_INTERVAL=0.1)
+    def test_content_check_runs_while_the_lease_is_renewed(self):
+        result = self.create_result(heatmap='results/heatmap.png', change_percentage=12.5,
+                                    change_intensity='MODERATE', processing_time=3.0)
+        result.metadata = {'params_hash': params_hash(),
+                           'input_hash': input_hash(result.upload.image1.path, result.upload.image2.path)}
+        result.save()
+        queue_reanalysis(AnalysisResult.objects.all())
+
+        def slow_input_hash(*paths):
+            # Hashing large originals can outlast a lease
+            time.sleep(0.5)
+            return input_hash(*paths)
+
+        with mock.patch('landsnap.utils.analysis.input_hash', slow_input_hash), \
+                mock.patch('landsnap.jobs.heartbeat', wraps=heartbeat) as renewed:
+            run_job(claim_next('test-worker'), 'test-worker')
+        self.assertGreaterEqual(renewed.call_count, 3)
+        result.refresh_from_db()
+        self.assertEqual((result.status, result.heatmap.name), ('COMPLETE', 'results/heatmap.png'))
+
+class RetentionTests(MediaTestCase):
+    def test_requeued_results_are_aged_from_when_they_were_queued(self):
+        old = timezone.now() - timedelta(days=10)
+        requeued = self.create_result(heatmap='results/heatmap.png', change_percentage=1.0)
+        stale = self.create_result('PENDING', before=b'stale before', after=b'stale after', queued_at=old)
+        ImageUpload.objects.update(uploaded_at=old)
+        queue_reanalysis(AnalysisResult.objects.filter(pk=requeued.pk))
+
+        report = expire_uploads(RetentionReport())
+        self.assertEqual(report.uploads_deleted, 1)
+        self.assertEqual(list(ImageUpload.objects.values_list('pk', flat=True)), [requeued.upload_id])
+        self.assertFalse(AnalysisResult.objects.filter(pk=stale.pk).exists())
+
+
+    def test_expired_uploads_report_only_the_bytes_they_free(self):
+        old = timezone.now() - timedelta(days=100)
+        expired = self.create_result(heatmap='results/heatmap.png', overlay='results/overlay.bin')
+        # Shares both originals with the expired upload, so they stay
+        kept = self.create_result()
+        failed = self.create_result('FAILED', before=b'failed before', after=b'failed after')
+        for name, data in (('results/heatmap.png', b'heatmap'), ('results/overlay.bin', b'bits')):
+            os.makedirs(os.path.join(self.media_root, 'results'), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(data)
+        with open(failed.upload.image1.path + GRAY_SIDECAR_SUFFIX, 'wb') as f:
+            f.write(b'gray')
+        ImageUpload.objects.filter(pk__in=[expired.upload_id, failed.upload_id]).update(uploaded_at=old)
+
+        freed = len(b'heatmap' b'bits' b'failed before' b'failed after' b'gray')
+        self.assertEqual(expire_uploads(RetentionReport(), dry_run=True).bytes_reclaimed, freed)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = expire_uploads(RetentionReport())
+        self.assertEqual((report.uploads_deleted, report.bytes_reclaimed), (2, freed))
+        self.assertEqual(list(ImageUpload.objects.values_list('pk', flat=True)), [kept.upload_id])
+        self.assertTrue(os.path.exists(kept.upload.image1.path))
+        self.assertFalse(os.path.exists(failed.upload.image1.path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'results/overlay.bin')))
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def test_file_is_deleted_with_its_last_reference(self):
+        storage = content_addressed_storage()
+        name = storage.save('before.png', SimpleUploadedFile('before.png', b'pixels'))
+        self.assertEqual(storage.save('copy.png', SimpleUploadedFile('copy.png', b'pixels')), name)
+        self.assertEqual(storage.refcount(name), 2)
+        open(storage.path(name) + GRAY_SIDECAR_SUFFIX, 'wb').close()
+
+        storage.delete(name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(storage.refcount(name), 1)
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(os.path.exists(storage.path(name) + GRAY_SIDECAR_SUFFIX))
+        self.assertFalse(StoredBlob.objects.exists())
+
+    @override_settings(LANDSNAP_ORPHAN_GRACE_HOURS=1)
+    def test_orphan_sweep_keeps_referenced_files_sidecars_and_recent_files(self):
+        result = self.create_result(heatmap='results/heatmap.png')
+        referenced = [result.upload.image1.path, result.heatmap.path]
+        sidecar = result.upload.image2.path + GRAY_SIDECAR_SUFFIX
+        orphan = os.path.join(self.media_root, 'results', 'orphan.png')
+        recent = os.path.join(self.media_root, 'results', 'recent.png')
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        for path in [*referenced, sidecar, orphan, recent]:
+            with open(path, 'wb') as f:
+                f.write(b'data')
+        hours_ago = timezone.now().timestamp() - 2 * 3600
+        for path in [*referenced, sidecar, orphan]:
+            os.utime(path, (hours_ago, hours_ago))
+
+        report = sweep_orphans(RetentionReport())
+        self.assertEqual((report.orphans_deleted, report.bytes_reclaimed), (1, 4))
+        self.assertEqual([os.path.exists(path) for path in [*referenced, sidecar, orphan, recent]],
+                         [True, True, True, False, True])
+
+    def test_compacted_originals_stay_within_the_upload_extensions(self):
+        self.assertEqual(compact_format(ImageUpload, 'image1', 'webp'), 'png')
+        self.assertEqual(compact_format(AnalysisResult, 'heatmap', 'webp'), 'webp')
+
+
+class ApiTests(MediaTestCase):
+    def test_result_detail_answers_304_for_a_matching_etag(self):
+        result = self.create_result('FAILED', error_message='boom')
+        url = reverse('landsnap:api_v1:result_detail', kwargs={'result_id': result.upload.result_id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['error'], 'boom')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(LANDSNAP_API_RATE_LIMIT=1, LANDSNAP_API_RATE_WINDOW=60)
+    def test_rate_limit_is_keyed_on_the_connection_not_x_forwarded_for(self):
+        self.create_result(ip_address='127.0.0.1')
+        pair = {'image1': SimpleUploadedFile('before.png', b'before'),
+                'image2': SimpleUploadedFile('after.png', b'after')}
+        response = self.client.post(reverse('landsnap:api_v1:pair_submit'), pair,
+                                    HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+
+    @override_settings(LANDSNAP_TRUSTED_PROXIES=['127.0.0.0/8'])
+    def test_x_forwarded_for_is_read_through_trusted_proxies_only(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1',
+                                       HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.9, 127.0.0.2')
+        self.assertEqual(UploadView().get_client_ip(request), '203.0.113.9')
+        request.META['REMOTE_ADDR'] = '192.0.2.7'
+        self.assertEqual(UploadView().get_client_ip(request), '192.0.2.7')
+
+
+class ResumableUploadTests(MediaTestCase):
+    def start_upload(self, length):
+        response = self.client.post(reverse('landsnap:api_v1:upload_create'), HTTP_UPLOAD_LENGTH=str(length),
+                                    HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(b'before.png').decode())
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def patch(self, url, data, offset, **headers):
+        return self.client.patch(url, data, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def test_chunk_at_the_wrong_offset_is_refused(self):
+        url = self.start_upload(1000)
+        self.assertEqual(self.patch(url, b'\x89PNG', 0)['Upload-Offset'], '4')
+        response = self.patch(url, b'more', 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '4')
+
+    def test_chunk_with_a_bad_checksum_is_discarded(self):
+        url = self.start_upload(1000)
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'other bytes').digest()).decode()
+        response = self.patch(url, b'\x89PNG', 0, HTTP_UPLOAD_CHECKSUM=checksum)
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '0')
+        session = UploadSession.objects.get()
+        self.assertEqual(os.path.getsize(partial_path(session)), 0)
+
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'\x89PNG').digest()).decode()
+        self.assertEqual(self.patch(url, b'\x89PNG', 0, HTTP_UPLOAD_CHECKSUM=checksum)['Upload-Offset'], '4')
+
+    def upload_pair(self):
+        """Send the new_buildings pair as two resumable uploads in two chunks each, returning their ids"""
+        ids = []
+        for path in write_pair('new_buildings', tempfile.mkdtemp(dir=self.media_root)):
+            with open(path, 'rb') as f:
+                data = f.read()
+            url = self.start_upload(len(data))
+            half = len(data) // 2
+            self.patch(url, data[:half], 0)
+            self.assertEqual(self.patch(url, data[half:], half)['Upload-Offset'], str(len(data)))
+            ids.append(url.rstrip('/').rsplit('/', 1)[1])
+        return ids
+
+    @override_settings(LANDSNAP_INLINE_ANALYSIS=False)
+    def test_pair_is_submitted_from_resumable_uploads(self):
+        ids = self.upload_pair()
+        submit = reverse('landsnap:api_v1:pair_submit')
+        response = self.client.post(submit, {'image1_upload': ids[0], 'image2_upload': ids[1], 'roi': '{'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(submit, {'image1_upload': ids[0], 'image2_upload': ids[1]})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['results'][0]['status'], 'PENDING')
+        self.assertFalse(UploadSession.objects.exists())
+        with open(write_pair('new_buildings', tempfile.mkdtemp(dir=self.media_root))[0], 'rb') as f:
+            self.assertEqual(ImageUpload.objects.get().image1.read(), f.read())
+
+    @override_settings(LANDSNAP_INLINE_ANALYSIS=False, LANDSNAP_QUEUE_MAX_BACKLOG=60)
+    def test_refused_submission_keeps_the_uploads(self):
+        ids = self.upload_pair()
+        blocker = self.create_result('PENDING', estimated_seconds=600)
+        submit = reverse('landsnap:api_v1:pair_submit')
+        response = self.client.post(submit, {'image1_upload': ids[0], 'image2_upload': ids[1]})
+        self.assertEqual(response.status_code, 429)
+        sessions = UploadSession.objects.all()
+        self.assertEqual(len(sessions), 2)
+        self.assertTrue(all(os.path.exists(partial_path(session)) for session in sessions))
+
+        blocker.upload.delete()
+        # The same upload may be named for both images
+        response = self.client.post(submit, {'image1_upload': ids[0], 'image2_upload': ids[0]})
+        self.assertEqual(response.status_code, 202)
+        upload = ImageUpload.objects.get()
+        self.assertEqual(upload.image1.name, upload.image2.name)
+        self.assertEqual(str(UploadSession.objects.get().pk), ids[1])
+
+    @override_settings(LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS=2, LANDSNAP_UPLOAD_MAX_OPEN_MB=1)
+    def test_open_uploads_are_limited_per_client(self):
+        url = self.start_upload(600 * 1024)
+        response = self.client.post(reverse('landsnap:api_v1:upload_create'), HTTP_UPLOAD_LENGTH=str(600 * 1024),
+                                    HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(b'after.png').decode())
+        self.assertEqual(response.status_code, 429)
+        self.start_upload(1000)
+        response = self.client.post(reverse('landsnap:api_v1:upload_create'), HTTP_UPLOAD_LENGTH='1000',
+                                    HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(b'after.png').decode())
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.start_upload(1000)
+
+    @override_settings(LANDSNAP_API_RATE_LIMIT=1, LANDSNAP_API_RATE_WINDOW=60)
+    def test_rate_limit_covers_resumable_uploads(self):
+        url = self.start_upload(1000)
+        self.create_result(ip_address='127.0.0.1')
+        response = self.client.post(reverse('landsnap:api_v1:upload_create'), HTTP_UPLOAD_LENGTH='1000',
+                                    HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(b'after.png').decode())
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.patch(url, b'\x89PNG', 0).status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+
+    def test_completed_upload_is_only_opened_when_read(self):
+        session = UploadSession.objects.create(filename='before.png', length=4, offset=4, width=100, height=100)
+        os.makedirs(os.path.dirname(partial_path(session)))
+        with open(partial_path(session), 'wb') as f:
+            f.write(b'\x89PNG')
+        uploaded = ChunkedUploadedFile(session)
+        self.assertTrue(uploaded.closed)
+        self.assertEqual(uploaded.read(), b'\x89PNG')
+        close_files({'image1': uploaded})
+        self.assertTrue(uploaded.closed)
@@ -0,0 +1,346 @@
+"""
+Request and job tracing.
+
+Spans follow the OpenTelemetry data model and are exported as OTLP/JSON,
+either appended to a local file (one ExportTraceServiceRequest per line,
+the format the collector's `otlpjsonfile` receiver reads) or posted to an
+OTLP/HTTP collector. A trace crosses processes as a W3C `traceparent`: the
+upload request stores one on its AnalysisResult, the worker continues it
+and hands it to the analysis process.
+
+Spans are buffered in the process until the outermost one ends and are then
+exported in one batch. With tracing off or a trace not sampled, `span()`
+only binds the result id for log records.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'landsnap'
+EXPORTERS = ('', 'file', 'otlp')
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar('landsnap_span', default=None)
+_current_result = contextvars.ContextVar('landsnap_result_id', default=None)
+
+
+class _NoopSpan:
+    """Stands in for a span that isn't recorded, so callers never need to check"""
+    trace_id = span_id = traceparent = None
+
+    def set(self, key, value):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'root', 'attributes', 'events',
+                 'error', 'start_ns', 'end_ns', 'finished')
+
+    def __init__(self, name, trace_id, parent_id=None, root=None, attributes=None, kind=KIND_INTERNAL):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.root = root or self
+        self.attributes = attributes or {}
+        self.events = []
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        # Spans of this process waiting for the outermost one to end
+        self.finished = [] if root is None else None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def fail(self, error):
+        """Mark the span as failed, recording the exception"""
+        self.error = str(error) or type(error).__name__
+        self.events.append({
+            'name': 'exception',
+            'timeUnixNano': str(time.time_ns()),
+            'attributes': otlp_attributes({'exception.type': type(error).__name__, 'exception.message': str(error)}),
+        })
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        self.root.finished.append(self)
+        if self.root is self:
+            exporter = get_exporter()
+            if exporter:
+                exporter.export(self.finished)
+
+    def to_otlp(self):
+        data = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': otlp_attributes(self.attributes),
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        if self.events:
+            data['events'] = self.events
+        if self.error:
+            data['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return data
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{'key': key, 'value': otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def otlp_payload(spans):
+    """An ExportTraceServiceRequest for a batch of finished spans, as OTLP/JSON"""
+    resource = {
+        'service.name': SERVICE_NAME,
+        'host.name': socket.gethostname(),
+        'process.pid': os.getpid(),
+    }
+    return json.dumps({'resourceSpans': [{
+        'resource': {'attributes': otlp_attributes(resource)},
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': [span.to_otlp() for span in spans]}],
+    }]}, separators=(',', ':'))
+
+
+class FileExporter:
+    """Appends each batch as one line; a single O_APPEND write keeps lines from concurrent processes whole"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        line = (otlp_payload(spans) + '\n').encode()
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning("Could not write %s spans to %s: %s", len(spans), self.path, e)
+
+    def flush(self, timeout=None):
+        pass
+
+
+class OTLPHttpExporter:
+    """Posts batches to an OTLP/HTTP collector from a background thread, dropping them if it falls behind"""
+
+    def __init__(self, endpoint, max_queue=1000, timeout=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.queue = queue.Queue(max_queue)
+        self.thread = None
+
+    def export(self, spans):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='landsnap-trace-export', daemon=True)
+            self.thread.start()
+        try:
+            self.queue.put_nowait(otlp_payload(spans).encode())
+        except queue.Full:
+            logger.warning("Trace export queue is full, dropped %s spans", len(spans))
+
+    def run(self):
+        while True:
+            body = self.queue.get()
+            try:
+                request = urllib.request.Request(
+                    self.endpoint, data=body, method='POST', headers={'Content-Type': 'application/json'}
+                )
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except (OSError, ValueError) as e:
+                logger.warning("Could not export spans to %s: %s", self.endpoint, e)
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout=5):
+        """Wait up to `timeout` seconds for queued batches to be sent"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+_exporter = (None, None)
+
+
+def get_exporter():
+    """The configured exporter, or None when tracing is off. Rebuilt after a fork or a settings change."""
+    global _exporter
+    key = (settings.LANDSNAP_TRACE_EXPORTER, settings.LANDSNAP_TRACE_FILE,
+           settings.LANDSNAP_OTLP_ENDPOINT, os.getpid())
+    if _exporter[0] != key:
+        kind = key[0]
+        if kind == 'file':
+            exporter = FileExporter(settings.LANDSNAP_TRACE_FILE)
+        elif kind == 'otlp':
+            exporter = OTLPHttpExporter(settings.LANDSNAP_OTLP_ENDPOINT)
+        else:
+            exporter = None
+        _exporter = (key, exporter)
+    return _exporter[1]
+
+
+def flush(timeout=5):
+    """Send anything still queued; call before a process that traced work exits"""
+    exporter = get_exporter()
+    if exporter:
+        exporter.flush(timeout)
+
+
+def parse_traceparent(value):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent, or None if it is malformed"""
+    parts = (value or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_span(name, attributes=None, parent=None, kind=KIND_INTERNAL):
+    """
+    A new span: a child of `parent` (a traceparent from another process) if
+    given, else of the current span, else the root of a new trace sampled at
+    LANDSNAP_TRACE_SAMPLE_RATE.
+    """
+    if get_exporter() is None:
+        return NOOP_SPAN
+    attributes = dict(attributes or {})
+    result_id = _current_result.get()
+    if result_id:
+        attributes['landsnap.result_id'] = result_id
+
+    context = parse_traceparent(parent) if parent else None
+    if context:
+        trace_id, parent_id, sampled = context
+        return Span(name, trace_id, parent_id, attributes=attributes, kind=kind) if sampled else NOOP_SPAN
+    current = _current_span.get()
+    if current is NOOP_SPAN:
+        return NOOP_SPAN
+    if current is not None:
+        return Span(name, current.trace_id, current.span_id, current.root, attributes, kind)
+    if random.random() >= settings.LANDSNAP_TRACE_SAMPLE_RATE:
+        return NOOP_SPAN
+    return Span(name, os.urandom(16).hex(), attributes=attributes, kind=kind)
+
+
+@contextmanager
+def span(name, attributes=None, parent=None, result_id=None, kind=KIND_INTERNAL):
+    """
+    Time the enclosed block as a span, marked failed if it raises. With
+    `result_id`, the span, its children and log records within are tagged
+    with that result.
+    """
+    result_token = _current_result.set(str(result_id)) if result_id else None
+    current = start_span(name, attributes, parent, kind)
+    span_token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _current_span.reset(span_token)
+        if current is not NOOP_SPAN:
+            current.end()
+        if result_token:
+            _current_result.reset(result_token)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def traceparent():
+    """traceparent of the current span for another process to continue, or None if it isn't recorded"""
+    return current_span().traceparent
+
+
+def traced_view(name):
+    """Decorate a view method to run as a server span for the request"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            attributes = {'http.request.method': request.method, 'url.path': request.path}
+            with span(name, attributes, kind=KIND_SERVER) as current:
+                response = method(view, request, *args, **kwargs)
+                current.set('http.response.status_code', response.status_code)
+                return response
+        return wrapper
+    return decorator
+
+
+class TraceContextFilter(logging.Filter):
+    """Add the current trace, span and result ids to log records"""
+
+    def filter(self, record):
+        current = _current_span.get()
+        record.trace_id = current.trace_id if current else None
+        record.span_id = current.span_id if current else None
+        record.result_id = _current_result.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the ids added by TraceContextFilter"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in ('trace_id', 'span_id', 'result_id'):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
@@ -1,5 +1,5 @@
-from django.urls import path
-from .views import DownloadHeatmapView, ProcessingView, UploadView, AnalysisResultView, AnalysisProgressView, AboutView, ResultsListView
+from django.urls import include, path
+from .views import AfterPreviewView, CancelAnalysisView, DashboardView, DownloadHeatmapView, HeatmapImageView, ProcessingView, UploadView, AnalysisResultView, AnalysisProgressView, AboutView, ResultsListView
 
 app_name = 'landsnap'
 
@@ -9,6 +9,11 @@ urlpatterns = [
     path('results/<uuid:result_id>/', AnalysisResultView.as_view(), name='analysis_result'),
     path('processing/<uuid:result_id>/', ProcessingView.as_view(), name='processing'),
     path('progress/<uuid:result_id>/', AnalysisProgressView.as_view(), name='analysis_progress'),
+    path('cancel/<uuid:result_id>/', CancelAnalysisView.as_view(), name='cancel_analysis'),
     path('download/<uuid:result_id>/<str:format>/', DownloadHeatmapView.as_view(), name='download_heatmap'),
+    path('heatmap/<uuid:result_id>/', HeatmapImageView.as_view(), name='heatmap_image'),
+    path('preview/<uuid:result_id>/', AfterPreviewView.as_view(), name='after_preview'),
+    path('api/v1/', include('landsnap.api.urls')),
+    path('dashboard/', DashboardView.as_view(), name='dashboard'),
     path('about/', AboutView.as_view(), name='about'),
 ]
\ No newline at end of file
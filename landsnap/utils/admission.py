@@ -0,0 +1,152 @@
+import math
+from dataclasses import dataclass
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.transaction import TransactionManagementError
+from django.utils import timezone
+from ..models import AdmissionLock, AnalysisResult
+
+# Measured peak RSS and single-core time of run_pipeline on JPEG/PNG pairs
+# (~110 bytes and ~0.3s per pixel/megapixel from 1500px to 5000px)
+BYTES_PER_PIXEL = 120
+SECONDS_PER_MEGAPIXEL = 0.3
+# Tiled raster analysis holds one tile plus the overview, whatever the scene size
+RASTER_WORKING_SET = 320 * 1024 * 1024
+# Assumed for uploads saved before dimensions were recorded
+DEFAULT_DIMENSIONS = (5000, 5000)
+# Decoding whole JPEG/PNG frames before cropping them to a region of interest
+DECODE_BYTES_PER_PIXEL = 8
+DECODE_SECONDS_PER_MEGAPIXEL = 0.02
+
+
+@dataclass
+class JobCost:
+    memory: int
+    seconds: float
+
+
+@dataclass
+class Load:
+    running: int = 0
+    running_memory: int = 0
+    running_seconds: float = 0
+    queued: int = 0
+    queued_seconds: float = 0
+
+    @property
+    def backlog_seconds(self):
+        return self.running_seconds + self.queued_seconds
+
+
+class AdmissionRejected(Exception):
+    """The analysis budget is exhausted; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after, message="Analysis capacity exhausted"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_cost(width, height, raster=False, roi_pixels=None):
+    """
+    Peak memory (bytes) and CPU time (seconds) of analysing one pair of this
+    size. With a region of interest, only `roi_pixels` go through the
+    analysis, though JPEG/PNG frames are still decoded whole.
+    """
+    if not width or not height:
+        width, height = DEFAULT_DIMENSIONS
+    pixels = min(roi_pixels or width * height, width * height)
+    memory = pixels * BYTES_PER_PIXEL
+    seconds = pixels / 1e6 * SECONDS_PER_MEGAPIXEL
+    if raster:
+        memory = min(memory, RASTER_WORKING_SET)
+    elif roi_pixels:
+        memory += width * height * DECODE_BYTES_PER_PIXEL
+        seconds += width * height / 1e6 * DECODE_SECONDS_PER_MEGAPIXEL
+    return JobCost(memory=memory, seconds=round(seconds, 2))
+
+
+def combined_cost(costs):
+    """Cost of running several pairs one after another"""
+    costs = list(costs)
+    return JobCost(memory=max((c.memory for c in costs), default=0), seconds=sum(c.seconds for c in costs))
+
+
+def memory_budget():
+    return settings.LANDSNAP_ANALYSIS_MEMORY_BUDGET_MB * 1024 * 1024
+
+
+def lock_budget():
+    """
+    Take the admission lock for the rest of the current transaction, so no
+    other admission or job claim can act on the load it reads until this
+    one's rows are committed. The lock is an UPDATE of the AdmissionLock
+    row: a row lock on PostgreSQL, the database write lock on SQLite (where
+    SELECT ... FOR UPDATE does nothing).
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise TransactionManagementError("lock_budget() must be called inside transaction.atomic()")
+    if not AdmissionLock.objects.filter(pk=1).update(updated_at=timezone.now()):
+        AdmissionLock.objects.get_or_create(pk=1)
+        AdmissionLock.objects.filter(pk=1).update(updated_at=timezone.now())
+
+
+def current_load(priority=None):
+    """
+    Running and queued work, from the estimates stored on each result. With
+    `priority`, queued work counts only jobs of that priority class or a
+    more urgent one, which are the jobs a new job of that class waits behind.
+    """
+    load = Load()
+    active = Q(status='PROCESSING') | Q(status='PENDING', **({} if priority is None else {'priority__lte': priority}))
+    rows = (AnalysisResult.objects.filter(active)
+            .values('status')
+            .annotate(jobs=Count('pk'), memory=Sum('estimated_memory'), seconds=Sum('estimated_seconds')))
+    for row in rows:
+        if row['status'] == 'PROCESSING':
+            load.running = row['jobs']
+            load.running_memory = row['memory'] or 0
+            load.running_seconds = row['seconds'] or 0
+        else:
+            load.queued = row['jobs']
+            load.queued_seconds = row['seconds'] or 0
+    return load
+
+
+def fits(cost, load):
+    """
+    Whether a job can start now without exceeding the memory or concurrency
+    budget. A lone job always fits, so one larger than the whole budget still runs.
+    """
+    if load.running == 0:
+        return True
+    return (load.running < settings.LANDSNAP_ANALYSIS_MAX_CONCURRENT
+            and load.running_memory + cost.memory <= memory_budget())
+
+
+def retry_after(load, extra_seconds=0):
+    """Seconds until the current backlog (plus `extra_seconds`) drains across all slots"""
+    seconds = (load.backlog_seconds + extra_seconds) / settings.LANDSNAP_ANALYSIS_MAX_CONCURRENT
+    return max(math.ceil(seconds), 1)
+
+
+def admit(cost, inline=None, priority=None):
+    """
+    Decide whether a new job may be accepted, raising AdmissionRejected if not.
+    Inline analysis must be able to start immediately; queued analysis is
+    refused once the estimated backlog ahead of it (see current_load)
+    exceeds LANDSNAP_QUEUE_MAX_BACKLOG seconds, so a long batch queue
+    doesn't turn interactive uploads away.
+    Call it inside the transaction that creates the job's rows: it holds the
+    admission lock until they are committed.
+    """
+    inline = settings.LANDSNAP_INLINE_ANALYSIS if inline is None else inline
+    lock_budget()
+    load = current_load(priority)
+    if inline:
+        if not fits(cost, load):
+            raise AdmissionRejected(retry_after(load))
+    elif load.queued and load.queued_seconds + cost.seconds > settings.LANDSNAP_QUEUE_MAX_BACKLOG:
+        raise AdmissionRejected(retry_after(load, cost.seconds - settings.LANDSNAP_QUEUE_MAX_BACKLOG))
+    return load
+
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import time
+import logging
+from django.conf import settings
+from django.core.files.base import ContentFile
+from ..tracing import span
+from .image_utils import ANALYSIS_PARAMS, analyze_heatmap, calculate_changes
+from .raster import analyze_tiled, is_raster
+from .reanalysis import METADATA_KEY as REANALYSIS_KEY
+from .rollups import outcome_of, record_result
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PIPELINE_STAGES = ('heatmap', 'changes', 'tiles', 'hash')
+
+
+def heatmap_encoding():
+    """Heatmap encoding options from settings, as keyword arguments for generate_heatmap"""
+    return {
+        'fmt': settings.LANDSNAP_HEATMAP_FORMAT,
+        'png_compression': settings.LANDSNAP_HEATMAP_PNG_COMPRESSION,
+        'webp_quality': settings.LANDSNAP_HEATMAP_WEBP_QUALITY,
+        'jpeg_quality': settings.LANDSNAP_HEATMAP_JPEG_QUALITY,
+    }
+
+
+def current_params():
+    """Everything that determines a stored result, including how the heatmap is encoded"""
+    return {**ANALYSIS_PARAMS, 'heatmap_encoding': heatmap_encoding()}
+
+
+def params_hash(params=None):
+    """Stable hash of the analysis parameter set"""
+    payload = json.dumps(params or current_params(), sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def file_hash(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_hash(img1_path, img2_path):
+    """Hash identifying an ordered before/after pair by content"""
+    return hashlib.sha256(f"{file_hash(img1_path)}:{file_hash(img2_path)}".encode()).hexdigest()
+
+
+def run_pipeline(img1_path, img2_path, cache_gray=(False, False), on_stage=None, roi=None, pair_hash=None):
+    """
+    Run change detection on a pair of image paths, restricted to a normalized
+    region of interest (see utils.roi) if one is given.
+    Pure compute with no database access, so it can run in a worker process.
+    `on_stage` is called with the name of each stage (see PIPELINE_STAGES) as it starts.
+    `pair_hash` is the pair's input_hash when the caller has computed it already.
+    """
+    on_stage = on_stage or (lambda name: None)
+
+    def stage(name):
+        on_stage(name)
+        return span(f'pipeline.{name}')
+
+    for img_path in (img1_path, img2_path):
+        if not os.path.exists(img_path):
+            raise FileNotFoundError(f"Image not found at {img_path}")
+
+    encoding = heatmap_encoding()
+    start_time = time.time()
+    heatmap_format = encoding['fmt']
+    extra_metadata = {}
+    overlay = None
+    try:
+        if is_raster(img1_path) and is_raster(img2_path):
+            with stage('tiles') as current:
+                tiled = analyze_tiled(img1_path, img2_path, roi=roi, **encoding)
+                current.set('landsnap.tiles', len(tiled['raster']['tiles']))
+            heatmap, change_percentage = tiled['heatmap'], tiled['change_percentage']
+            heatmap_format = tiled['heatmap_format']
+            extra_metadata['raster'] = tiled['raster']
+        else:
+            with stage('heatmap'):
+                rendered = analyze_heatmap(img1_path, img2_path, roi=roi, cache_gray=cache_gray, **encoding)
+            heatmap, overlay = rendered['heatmap'], rendered['overlay']
+            with stage('changes'):
+                change_percentage = calculate_changes(img1_path, img2_path, cache_gray=cache_gray, roi=roi)
+    except Exception as e:
+        raise RuntimeError(f"Image processing failed: {str(e)}")
+
+    with stage('hash'):
+        hashes = pair_hash or input_hash(img1_path, img2_path), params_hash()
+    return {
+        'heatmap': heatmap.read(),
+        'heatmap_name': heatmap.name,
+        'heatmap_format': heatmap_format,
+        'overlay': overlay.read() if overlay else None,
+        'overlay_name': overlay.name if overlay else None,
+        'change_percentage': change_percentage,
+        'processing_time': round(time.time() - start_time, 2),
+        'input_hash': hashes[0],
+        'params_hash': hashes[1],
+        'extra_metadata': extra_metadata,
+    }
+
+
+def save_pipeline_output(result, output):
+    """Store the output of `run_pipeline` on an AnalysisResult"""
+    with span('result.write', {'landsnap.heatmap_bytes': len(output['heatmap'])}):
+        previous = outcome_of(result)
+        if result.heatmap:
+            result.heatmap.delete(save=False)
+        result.heatmap.save(output['heatmap_name'], ContentFile(output['heatmap']), save=False)
+        if result.overlay:
+            result.overlay.delete(save=False)
+        if output.get('overlay'):
+            result.overlay.save(output['overlay_name'], ContentFile(output['overlay']), save=False)
+        result.change_percentage = output['change_percentage']
+        result.change_intensity = result.intensity_for(result.change_percentage)
+        result.processing_time = output['processing_time']
+        result.status = 'COMPLETE'
+        # The trace and any reanalysis request end with this write
+        metadata = {key: value for key, value in (result.metadata or {}).items()
+                    if key not in ('traceparent', REANALYSIS_KEY)}
+        result.metadata = {
+            **metadata,
+            'input_hash': output['input_hash'],
+            'params_hash': output['params_hash'],
+            'heatmap_format': output['heatmap_format'],
+            **output.get('extra_metadata', {}),
+        }
+        result.save()
+        record_result(result, previous)
+
+
+def shared_frames(upload):
+    """Which of the pair's originals are reused by other uploads and worth a grayscale sidecar"""
+    return tuple(
+        hasattr(field.storage, 'refcount') and field.storage.refcount(field.name) > 1
+        for field in (upload.image1, upload.image2)
+    )
+
+
+def analyze_upload(upload):
+    """Run the full analysis for an upload and persist the result"""
+    result = upload.analysis_result
+    with span('pipeline'):
+        output = run_pipeline(upload.image1.path, upload.image2.path, cache_gray=shared_frames(upload),
+                              roi=result.roi)
+    save_pipeline_output(result, output)
+    logger.info("Successfully processed upload %s in %ss", upload.id, output['processing_time'])
+    return result
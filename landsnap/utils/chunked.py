@@ -0,0 +1,271 @@
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from ..models import UploadSession
+from .validators import IMAGE_EXTENSIONS, MAX_FILE_SIZE, MAX_RASTER_FILE_SIZE, RASTER_EXTENSIONS, read_image_header
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+READ_SIZE = 64 * 1024
+# Chunks larger than this are spooled to disk while they arrive
+SPOOL_SIZE = 1024 * 1024
+SESSION_FIELDS = ('image1', 'image2')
+
+
+class ChunkError(Exception):
+    """A chunk was refused; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def partial_path(session):
+    return os.path.join(settings.MEDIA_ROOT, session.partial_name)
+
+
+def parse_metadata(header):
+    """Decode a tus `Upload-Metadata` header ("key base64value,key2 base64value")"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in (header or '').split(','))):
+        key, _sep, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise ValidationError(_('Malformed Upload-Metadata header'), code='invalid_metadata')
+    return metadata
+
+
+def parse_checksum(header):
+    """Decode a tus `Upload-Checksum` header ("sha256 base64digest") into (algorithm, digest)"""
+    if not header:
+        return None
+    algorithm, _sep, value = header.strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ChunkError(f"Unsupported checksum algorithm: {algorithm}")
+    try:
+        return algorithm, base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ChunkError("Malformed Upload-Checksum header")
+
+
+def create_session(filename, length, ip_address=None):
+    """Start a resumable upload, refusing bad names and sizes before any data is sent"""
+    filename = os.path.basename(filename or '')
+    ext = os.path.splitext(filename)[1].lstrip('.').lower()
+    if ext not in IMAGE_EXTENSIONS + RASTER_EXTENSIONS:
+        raise ValidationError(
+            _('Unsupported file extension. Only JPG, PNG and TIFF are allowed.'),
+            code='invalid_extension'
+        )
+    max_size = MAX_RASTER_FILE_SIZE if ext in RASTER_EXTENSIONS else MAX_FILE_SIZE
+    if not 0 < length <= max_size:
+        raise ValidationError(
+            _('Image size must be less than %(max_size)sMB.'),
+            params={'max_size': max_size // (1024 * 1024)},
+            code='image_too_large'
+        )
+
+    check_quota(ip_address, length)
+
+    session = UploadSession.objects.create(filename=filename, length=length, ip_address=ip_address)
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    logger.info("Started resumable upload %s (%s, %s bytes)", session.id, filename, length)
+    return session
+
+
+def check_quota(ip_address, length):
+    """
+    Refuse a new upload once the client's unfinished or unsubmitted ones reach
+    LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS, or would declare more than
+    LANDSNAP_UPLOAD_MAX_OPEN_MB between them.
+    """
+    open_sessions = UploadSession.objects.filter(ip_address=ip_address).aggregate(
+        sessions=Count('pk'), length=Sum('length')
+    )
+    if open_sessions['sessions'] >= settings.LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS:
+        raise ValidationError(
+            _('At most %(max)s resumable uploads may be open at once. Submit or delete one first.'),
+            params={'max': settings.LANDSNAP_UPLOAD_MAX_OPEN_SESSIONS},
+            code='upload_quota'
+        )
+    if (open_sessions['length'] or 0) + length > settings.LANDSNAP_UPLOAD_MAX_OPEN_MB * 1024 * 1024:
+        raise ValidationError(
+            _('Open resumable uploads may total at most %(max)sMB. Submit or delete one first.'),
+            params={'max': settings.LANDSNAP_UPLOAD_MAX_OPEN_MB},
+            code='upload_quota'
+        )
+
+
+def append_chunk(session, offset, stream, content_length, checksum=None):
+    """
+    Write `content_length` bytes from `stream` at `offset` and return the new offset.
+
+    Without a checksum, whatever arrived before a dropped connection is kept,
+    so the client resumes from there. With one, the chunk is all or nothing.
+    The image header is validated as soon as enough of it has arrived.
+    """
+    if offset != session.offset:
+        raise ChunkError(f"Upload-Offset {offset} does not match the current offset {session.offset}", 409)
+    if content_length > settings.LANDSNAP_UPLOAD_CHUNK_MAX:
+        raise ChunkError(f"Chunks are limited to {settings.LANDSNAP_UPLOAD_CHUNK_MAX} bytes", 413)
+    if offset + content_length > session.length:
+        raise ChunkError("Chunk extends past the declared Upload-Length", 413)
+
+    # Receive the chunk before locking the session, so a slow client doesn't hold the lock
+    digest = hashlib.new(checksum[0]) if checksum else None
+    received = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as chunk:
+        try:
+            while received < content_length:
+                data = stream.read(min(READ_SIZE, content_length - received))
+                if not data:
+                    break
+                chunk.write(data)
+                received += len(data)
+                if digest:
+                    digest.update(data)
+        except OSError as e:
+            logger.warning("Chunk for upload %s interrupted after %s bytes: %s", session.id, received, e)
+        if digest and (received != content_length or digest.digest() != checksum[1]):
+            raise ChunkError("Checksum mismatch", 460)
+
+        with transaction.atomic():
+            # Claim the offset first: a concurrent PATCH from the same offset waits
+            # on this row until we commit, then finds the offset moved
+            advanced = UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+                offset=offset + received, updated_at=timezone.now()
+            )
+            if not advanced:
+                raise ChunkError("Upload offset changed during the request", 409)
+            with open(partial_path(session), 'r+b') as f:
+                try:
+                    chunk.seek(0)
+                    f.seek(offset)
+                    shutil.copyfileobj(chunk, f, READ_SIZE)
+                    f.truncate(offset + received)
+                except BaseException:
+                    # The offset update rolls back with the transaction
+                    f.truncate(offset)
+                    raise
+    session.offset = offset + received
+
+    if session.width is None:
+        validate_header(session)
+    return session.offset
+
+
+def validate_header(session):
+    """Check format and dimensions from the bytes received so far, discarding the upload if they are bad"""
+    try:
+        dimensions = read_image_header(partial_path(session), session.filename, complete=session.is_complete)
+    except ValidationError:
+        logger.warning("Rejected resumable upload %s (%s) from its header", session.id, session.filename)
+        discard_session(session)
+        raise
+    if dimensions:
+        session.width, session.height = dimensions
+        UploadSession.objects.filter(pk=session.pk).update(width=session.width, height=session.height)
+
+
+def discard_session(session):
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+    UploadSession.objects.filter(pk=session.pk).delete()
+
+
+class ChunkedUploadedFile(UploadedFile):
+    """
+    A completed resumable upload, usable wherever Django expects an uploaded
+    file. Storage copies it rather than moving it into place, so the session
+    keeps its file if the submission is refused or rolled back, or names the
+    same upload twice; it is discarded by `release` once stored.
+    The file is only opened once something reads it; see close_files.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._file = None
+        content_type = mimetypes.guess_type(session.filename)[0] or 'application/octet-stream'
+        super().__init__(None, session.filename, content_type, session.length)
+
+    @property
+    def file(self):
+        if self._file is None or self._file.closed:
+            self._file = open(partial_path(self.session), 'rb')
+        return self._file
+
+    @file.setter
+    def file(self, value):
+        self._file = value
+
+    @property
+    def closed(self):
+        return self._file is None or self._file.closed
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def release(self):
+        """Forget the session once its file has been stored"""
+        self.close()
+        discard_session(self.session)
+
+
+def completed_upload(upload_id):
+    """ChunkedUploadedFile for a finished resumable upload, or ValidationError"""
+    session = UploadSession.objects.filter(pk=upload_id).first()
+    if session is None:
+        raise ValidationError(_('Unknown upload %(id)s'), params={'id': upload_id}, code='upload_missing')
+    if not session.is_complete or session.width is None:
+        raise ValidationError(_('Upload %(id)s is not complete'), params={'id': upload_id}, code='upload_incomplete')
+    return ChunkedUploadedFile(session)
+
+
+def session_files(data, suffix=''):
+    """
+    Files for a pair given as resumable upload ids (`image1_upload`/`image2_upload`
+    plus `suffix`), or an empty dict if `data` doesn't reference any.
+    """
+    files = {}
+    for field in SESSION_FIELDS:
+        upload_id = data.get(f'{field}_upload{suffix}')
+        if upload_id:
+            try:
+                files[field] = completed_upload(upload_id)
+            except (ValueError, ValidationError) as e:
+                raise ValidationError({field: e if isinstance(e, ValidationError) else str(e)})
+    return files
+
+
+def release_files(files):
+    for uploaded in files.values():
+        if isinstance(uploaded, ChunkedUploadedFile):
+            uploaded.release()
+
+
+def close_files(files):
+    """Close resumable uploads that were read but not stored, e.g. when their form was invalid"""
+    for uploaded in files.values():
+        if isinstance(uploaded, ChunkedUploadedFile):
+            uploaded.close()
+
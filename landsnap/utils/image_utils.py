@@ -1,4 +1,5 @@
 import cv2
+import json
 import numpy as np
 from django.core.files.base import ContentFile
 from io import BytesIO
@@ -6,6 +7,10 @@ from django.core.exceptions import SuspiciousOperation
 from PIL import Image
 import os
 import logging
+import tempfile
+from ..storage import GRAY_SIDECAR_SUFFIX, PREVIEW_SIDECAR_SUFFIX
+from ..tracing import span
+from .roi import roi_window
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +19,35 @@ MAX_IMAGE_SIZE = 10 * 1024 * 1024
 MAX_DIMENSION = 5000  
 MIN_DIMENSION = 100 
 CHANGE_THRESHOLD = 25
+HEATMAP_DIFF_THRESHOLD = 30
+MIN_CONTOUR_AREA = 100
+SSIM_WINDOW_SIZE = 7
+MORPH_KERNEL_SIZE = 3
+
+HEATMAP_FORMATS = ('png', 'webp', 'webp-lossless', 'jpeg', 'mask')
+# None keeps OpenCV's default PNG settings (zlib level 1 with the SUB filter
+# and RLE strategy), which encode faster and smaller than any explicit level
+# up to 3; naming a level also switches zlib to its default strategy
+DEFAULT_PNG_COMPRESSION = None
+DEFAULT_WEBP_QUALITY = 90
+DEFAULT_JPEG_QUALITY = 90
+
+# The result page draws the overlay in the browser over a downscaled after image
+PREVIEW_MAX_DIMENSION = 1600
+PREVIEW_JPEG_QUALITY = 85
+OVERLAY_VERSION = 1
+
+# Bump whenever the pipeline changes in a way the constants above don't capture,
+# so stored results get picked up by `manage.py reanalyze`.
+ALGORITHM_VERSION = 1
+
+ANALYSIS_PARAMS = {
+    'algorithm_version': ALGORITHM_VERSION,
+    'heatmap_diff_threshold': HEATMAP_DIFF_THRESHOLD,
+    'min_contour_area': MIN_CONTOUR_AREA,
+    'ssim_window_size': SSIM_WINDOW_SIZE,
+    'morph_kernel_size': MORPH_KERNEL_SIZE,
+}
 
 def validate_image_file(image_path):
     """Validate image file before processing"""
@@ -53,73 +87,314 @@ def process_image(image_path):
             
         return img
     except Exception as e:
-        logger.error(f"Error processing image {image_path}: {str(e)}")
+        logger.error("Error processing image %s: %s", image_path, e)
         raise SuspiciousOperation(f"Image processing error: {str(e)}")
 
-def generate_heatmap(img1_path, img2_path):
-    """Generate heatmap with robust size and type handling"""
+def roi_mask(roi, y0, y1, x0, x1):
+    """
+    Mask of a region of interest over rows y0:y1 and columns x0:x1, or None
+    when the region is a rectangle covering the whole window and no mask is needed.
+    """
+    if roi['rectangle']:
+        ry0, ry1, rx0, rx1 = roi_window(roi)
+        if ry0 <= y0 and y1 <= ry1 and rx0 <= x0 and x1 <= rx1:
+            return None
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.array(roi['polygon'], dtype=np.int32) - (x0, y0)], 255)
+    return mask
+
+def roi_outline(roi):
+    """Polygon of a non-rectangular region relative to its bounding window, for drawing"""
+    if roi is None or roi['rectangle']:
+        return None
+    x0, y0, _width, _height = roi['bbox']
+    return np.array(roi['polygon'], dtype=np.int32) - (x0, y0)
+
+def crop_to_roi(img1, img2, roi):
+    """
+    Cut a pair down to the bounding window of a region of interest, resizing
+    the second frame to the first's size beforehand if they differ. Slicing a
+    memory-mapped grayscale sidecar only reads the rows inside the window.
+    """
+    y0, y1, x0, x1 = roi_window(roi)
+    if img1.shape[:2] != img2.shape[:2]:
+        logger.info("Resizing second image to %sx%s before cropping to the ROI", img1.shape[1], img1.shape[0])
+        img2 = cv2.resize(np.asarray(img2), (img1.shape[1], img1.shape[0]))
+    return np.ascontiguousarray(img1[y0:y1, x0:x1]), np.ascontiguousarray(img2[y0:y1, x0:x1])
+
+def detect_change_regions(img1, img2, region=None):
+    """
+    Find changed regions between two BGR images, ignoring anything outside
+    the `region` mask if one is given.
+    Returns the (possibly resized) second image, the filled change mask and
+    the bounding boxes of the kept regions as (x, y, w, h) tuples.
+    """
+    # Ensure both images have exactly the same dimensions
+    if img1.shape != img2.shape:
+        height, width = img1.shape[:2]
+        img2 = cv2.resize(img2, (width, height))
+        logger.info("Resized second image to match dimensions: %sx%s", width, height)
+
+    # Convert to grayscale for comparison
+    gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+    _diff, mask, boxes = change_regions(gray1, gray2, region)
+    return img2, mask, boxes
+
+def change_regions(gray1, gray2, region=None):
+    """
+    detect_change_regions on a same-sized grayscale pair. Returns the
+    absolute difference, the filled change mask and the region boxes.
+    """
+    # Compute absolute difference
+    diff = cv2.absdiff(gray1, gray2)
+
+    # Apply threshold to find significant changes
+    _, thresh = cv2.threshold(diff, HEATMAP_DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    if region is not None:
+        thresh = cv2.bitwise_and(thresh, region)
+
+    # Find contours of changed regions
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    mask = np.zeros_like(diff)
+    boxes = []
+    for cnt in contours:
+        if cv2.contourArea(cnt) > MIN_CONTOUR_AREA:
+            cv2.drawContours(mask, [cnt], 0, 255, -1)
+            boxes.append(cv2.boundingRect(cnt))
+    return diff, mask, boxes
+
+def mask_regions(mask):
+    """Recover region bounding boxes from a stored change mask"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(cnt) for cnt in contours]
+
+def render_heatmap(img2, mask, boxes, outline=None):
+    """
+    Composite the change mask in red over the after image, with green region
+    boxes and the region of interest's `outline` in blue
+    """
+    # Create colored difference visualization, marking the changes in Red
+    colored_diff = np.zeros_like(img2)
+    colored_diff[mask == 255] = (0, 0, 255)
+
+    # Blend with original image (70% original, 30% difference)
+    result = cv2.addWeighted(img2, 0.7, colored_diff, 0.3, 0)
+
+    # Add the bounding boxes
+    for x, y, w, h in boxes:
+        cv2.rectangle(result, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    if outline is not None:
+        cv2.polylines(result, [outline], True, (255, 0, 0), 2)
+    return result
+
+def encode_heatmap(image, fmt='png', png_compression=DEFAULT_PNG_COMPRESSION,
+                   webp_quality=DEFAULT_WEBP_QUALITY, jpeg_quality=DEFAULT_JPEG_QUALITY):
+    """
+    Encode a heatmap image, returning (bytes, extension).
+    For the 'mask' format `image` is the single-channel change mask, which is
+    stored as a 1-bit PNG.
+    """
+    if fmt not in HEATMAP_FORMATS:
+        raise ValueError(f"Unsupported heatmap format: {fmt}")
+
+    png_params = [] if png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    if fmt == 'mask':
+        ext, params = 'png', [cv2.IMWRITE_PNG_BILEVEL, 1, *png_params]
+    elif fmt == 'png':
+        ext, params = 'png', png_params
+    elif fmt == 'webp':
+        ext, params = 'webp', [cv2.IMWRITE_WEBP_QUALITY, webp_quality]
+    elif fmt == 'webp-lossless':
+        # OpenCV switches WebP to lossless for any quality above 100
+        ext, params = 'webp', [cv2.IMWRITE_WEBP_QUALITY, 101]
+    else:
+        ext, params = 'jpg', [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+    success, buffer = cv2.imencode(f'.{ext}', image, params)
+    if not success:
+        raise Exception("Failed to encode image")
+    return buffer.tobytes(), ext
+
+def run_length_encode(values):
+    """A 2-D array flattened row by row into [value, run length, value, run length, ...]"""
+    flat = np.asarray(values).ravel()
+    if flat.size == 0:
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(flat)) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    return np.column_stack((flat[starts], lengths)).ravel().tolist()
+
+def encode_overlay(mask, gray_diff, frame, window, outline=None):
+    """
+    Compact change overlay for the browser, as JSON bytes.
+
+    Each connected region of the change mask gets an id, its box and area
+    in frame pixels, and its mean intensity change (0-255), which the page
+    thresholds on. The id map is downscaled to at most PREVIEW_MAX_DIMENSION
+    and run-length encoded. `window` is the [x, y, width, height] of `frame`
+    the mask covers, which is less than the whole frame with a region of interest.
+    """
+    count, labels, stats, _centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    sums = np.bincount(labels.ravel(), weights=gray_diff.ravel(), minlength=count)
+    x0, y0 = window[0], window[1]
+    regions = [{
+        'id': label,
+        'box': [int(stats[label, 0]) + x0, int(stats[label, 1]) + y0, int(stats[label, 2]), int(stats[label, 3])],
+        'area': int(stats[label, 4]),
+        'strength': int(round(sums[label] / stats[label, 4])),
+    } for label in range(1, count)]
+
+    height, width = mask.shape
+    scale = min(1.0, PREVIEW_MAX_DIMENSION / max(height, width))
+    if scale < 1:
+        rows = np.minimum((np.arange(max(round(height * scale), 1)) / scale).astype(int), height - 1)
+        cols = np.minimum((np.arange(max(round(width * scale), 1)) / scale).astype(int), width - 1)
+        labels = labels[rows][:, cols]
+
+    overlay = {
+        'version': OVERLAY_VERSION,
+        'frame': [int(v) for v in frame],
+        'window': [int(v) for v in window],
+        'width': int(labels.shape[1]),
+        'height': int(labels.shape[0]),
+        'runs': run_length_encode(labels),
+        'regions': regions,
+        'outline': outline.tolist() if outline is not None else None,
+    }
+    return json.dumps(overlay, separators=(',', ':')).encode()
+
+def write_sidecar(path, write):
+    """
+    Write a file next to an upload through `write(f)`, atomically so a
+    concurrent reader never sees a partial file. Returns whether it was
+    written; on failure nothing is left behind.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    except OSError as e:
+        logger.warning("Could not write %s: %s", path, e)
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException as e:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        if not isinstance(e, OSError):
+            raise
+        logger.warning("Could not write %s: %s", path, e)
+        return False
+    return True
+
+def write_preview(image_path, img):
+    """
+    Save a downscaled JPEG of `img` next to its file, for the browser to
+    draw overlays on. Kept once written, like the grayscale sidecar.
+    """
+    sidecar = image_path + PREVIEW_SIDECAR_SUFFIX
+    if os.path.exists(sidecar):
+        return sidecar
+    height, width = img.shape[:2]
+    scale = min(1.0, PREVIEW_MAX_DIMENSION / max(height, width))
+    if scale < 1:
+        img = cv2.resize(img, (max(round(width * scale), 1), max(round(height * scale), 1)),
+                         interpolation=cv2.INTER_AREA)
+    success, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_JPEG_QUALITY])
+    if not success:
+        raise SuspiciousOperation("Failed to encode preview")
+    return sidecar if write_sidecar(sidecar, lambda f: f.write(buffer.tobytes())) else None
+
+def analyze_heatmap(img1_path, img2_path, fmt='png', roi=None, overlay=True, cache_gray=(False, False),
+                    **encode_options):
+    """
+    Heatmap for a pair, cropped to `roi` if given. With `overlay`, also the
+    compact overlay for the result page, after writing the after image's preview.
+    Changes are found on the grayscale frames (from their sidecars when
+    cached, see load_grayscale); only the after image is decoded in colour,
+    and only if the composite or the preview needs it.
+    Returns {'heatmap': ContentFile, 'overlay': ContentFile or None}.
+    """
     try:
         # Load and validate images
-        img1 = process_image(img1_path)
-        img2 = process_image(img2_path)
+        with span('image.decode') as current:
+            validate_image_file(img1_path)
+            validate_image_file(img2_path)
+            gray1 = load_grayscale(img1_path, cache=cache_gray[0])
+            gray2 = load_grayscale(img2_path, cache=cache_gray[1])
+            if gray1 is None or gray2 is None:
+                raise SuspiciousOperation("Failed to read images for heatmap")
+            img2 = process_image(img2_path) if overlay or fmt != 'mask' else None
+            current.set('image.width', gray1.shape[1])
+            current.set('image.height', gray1.shape[0])
+        if overlay:
+            with span('image.preview'):
+                write_preview(img2_path, img2)
 
-        # Ensure both images have exactly the same dimensions
-        if img1.shape != img2.shape:
-            height, width = img1.shape[:2]
-            img2 = cv2.resize(img2, (width, height))
-            logger.info(f"Resized second image to match dimensions: {width}x{height}")
+        frame = (gray1.shape[1], gray1.shape[0])
+        window = roi['bbox'] if roi else [0, 0, *frame]
+        if img2 is not None and img2.shape[:2] != gray1.shape:
+            img2 = cv2.resize(img2, frame)
+        region = None
+        if roi:
+            gray1, gray2 = crop_to_roi(gray1, gray2, roi)
+            region = roi_mask(roi, *roi_window(roi))
+            if img2 is not None:
+                y0, y1, x0, x1 = roi_window(roi)
+                img2 = img2[y0:y1, x0:x1]
+        elif gray1.shape != gray2.shape:
+            logger.info("Resized second image to match dimensions: %sx%s", frame[0], frame[1])
+            gray2 = cv2.resize(np.asarray(gray2), frame)
 
-        # Convert to grayscale for comparison
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+        with span('image.detect') as current:
+            gray_diff, mask, boxes = change_regions(gray1, gray2, region)
+            current.set('landsnap.regions', len(boxes))
+
+        overlay_file = None
+        if overlay:
+            with span('image.overlay'):
+                overlay_file = ContentFile(encode_overlay(mask, gray_diff, frame, window, roi_outline(roi)),
+                                           name='overlay.json')
+
+        with span('image.encode', {'landsnap.heatmap_format': fmt}):
+            if fmt == 'mask':
+                # The composite is rendered on demand from the mask and image2
+                data, ext = encode_heatmap(mask, fmt, **encode_options)
+                return {'heatmap': ContentFile(data, name=f'heatmap_mask.{ext}'), 'overlay': overlay_file}
+
+            data, ext = encode_heatmap(render_heatmap(img2, mask, boxes, roi_outline(roi)), fmt, **encode_options)
+            return {'heatmap': ContentFile(data, name=f'heatmap.{ext}'), 'overlay': overlay_file}
 
-        # Compute absolute difference
-        diff = cv2.absdiff(gray1, gray2)
-        
-        # Apply threshold to find significant changes
-        _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-        
-        # Find contours of changed regions
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Create empty mask and output image
-        mask = np.zeros_like(gray1)
-        output = img2.copy()
-        
-        # Process each contour
-        for cnt in contours:
-            if cv2.contourArea(cnt) > 100: 
-                # Draw filled contour on mask
-                cv2.drawContours(mask, [cnt], 0, 255, -1)
-                # Draw bounding box
-                x,y,w,h = cv2.boundingRect(cnt)
-                cv2.rectangle(output, (x,y), (x+w,y+h), (0,255,0), 2)
-
-        # Create colored difference visualization, marking the changes in Red
-        colored_diff = np.zeros_like(img1)
-        colored_diff[mask == 255] = (0, 0, 255)
-        
-        # Blend with original image (70% original, 30% difference)
-        result = cv2.addWeighted(img2, 0.7, colored_diff, 0.3, 0)
-        
-        # Add the bounding boxes
-        for cnt in contours:
-            if cv2.contourArea(cnt) > 100:
-                x,y,w,h = cv2.boundingRect(cnt)
-                cv2.rectangle(result, (x,y), (x+w,y+h), (0,255,0), 2)
-
-        # Encode and return result
-        success, buffer = cv2.imencode('.png', result)
-        if not success:
-            raise Exception("Failed to encode image")
-            
-        return ContentFile(buffer.tobytes(), name='heatmap.png')
-        
     except Exception as e:
-        logger.error(f"Heatmap generation error: {str(e)}")
+        logger.error("Heatmap generation error: %s", e)
         raise SuspiciousOperation(f"Heatmap generation failed: {str(e)}")
-    
-def structural_similarity(im1, im2, window_size=7, full=False):
+
+def generate_heatmap(img1_path, img2_path, fmt='png', roi=None, **encode_options):
+    """Generate heatmap with robust size and type handling, cropped to `roi` if given"""
+    return analyze_heatmap(img1_path, img2_path, fmt, roi, overlay=False, **encode_options)['heatmap']
+
+def render_heatmap_from_mask(img2_path, mask_path, roi=None):
+    """Rebuild the heatmap composite from a stored change mask, which covers only `roi` if given"""
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise SuspiciousOperation("Failed to read change mask")
+    img2 = process_image(img2_path)
+    if roi:
+        frame_width, frame_height = roi['frame']
+        if img2.shape[:2] != (frame_height, frame_width):
+            img2 = cv2.resize(img2, (frame_width, frame_height))
+        y0, y1, x0, x1 = roi_window(roi)
+        img2 = img2[y0:y1, x0:x1]
+    height, width = mask.shape
+    if img2.shape[:2] != (height, width):
+        img2 = cv2.resize(img2, (width, height))
+    return render_heatmap(img2, mask, mask_regions(mask), roi_outline(roi))
+
+def structural_similarity(im1, im2, window_size=SSIM_WINDOW_SIZE, full=False):
     """
     Compute the mean structural similarity index between two images.
     This is a simplified version of skimage.metrics.structural_similarity
@@ -164,40 +439,79 @@ def structural_similarity(im1, im2, window_size=7, full=False):
         return ssim_map.mean(), ssim_map
     return ssim_map.mean()
 
-def calculate_changes(img1_path, img2_path):
-    """Calculate percentage of changes with improved accuracy and noise reduction"""
+def load_grayscale(image_path, cache=False):
+    """
+    Decode an image as grayscale, using a memory-mapped `.gray.npy` sidecar
+    when one exists. With `cache`, a missing sidecar is written so the next
+    pair sharing this frame skips the decode; only do that for immutable
+    (content-addressed) files.
+    """
+    sidecar = image_path + GRAY_SIDECAR_SUFFIX
+    if os.path.exists(sidecar):
+        try:
+            return np.load(sidecar, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable grayscale sidecar %s: %s", sidecar, e)
+
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is not None and cache:
+        write_sidecar(sidecar, lambda f: np.save(f, img))
+    return img
+
+def change_mask(gray1, gray2):
+    """
+    Binary mask of structurally changed pixels between two same-sized
+    grayscale images, with the mean SSIM score.
+    """
+    # Calculate structural similarity
+    score, diff = structural_similarity(gray1, gray2, full=True)
+    diff = (diff * 255).astype("uint8")
+
+    # Apply adaptive thresholding
+    thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+
+    # Morphological operations to clean up the thresholded image
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (MORPH_KERNEL_SIZE, MORPH_KERNEL_SIZE))
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
+    return score, thresh
+
+def calculate_changes(img1_path, img2_path, cache_gray=(False, False), roi=None):
+    """
+    Calculate percentage of changes with improved accuracy and noise reduction.
+    With `roi`, only its bounding window is compared and only pixels inside it are scored.
+    """
     try:
         # Read images as grayscale
-        img1 = cv2.imread(img1_path, cv2.IMREAD_GRAYSCALE)
-        img2 = cv2.imread(img2_path, cv2.IMREAD_GRAYSCALE)
+        with span('image.decode', {'landsnap.grayscale': True}):
+            img1 = load_grayscale(img1_path, cache=cache_gray[0])
+            img2 = load_grayscale(img2_path, cache=cache_gray[1])
 
         if img1 is None or img2 is None:
             raise SuspiciousOperation("Failed to read images for change calculation")
 
+        if roi:
+            img1, img2 = crop_to_roi(img1, img2, roi)
         # Resize images to match dimensions if needed
-        if img1.shape != img2.shape:
-            logger.info(f"Resizing images for change calculation: {img1.shape} vs {img2.shape}")
+        elif img1.shape != img2.shape:
+            logger.info("Resizing images for change calculation: %s vs %s", img1.shape, img2.shape)
             img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
 
-        # Calculate structural similarity
-        score, diff = structural_similarity(img1, img2, full=True)
-        diff = (diff * 255).astype("uint8")
-        
-        # Apply adaptive thresholding
-        thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-        
-        # Morphological operations to clean up the thresholded image
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-        
+        with span('image.ssim'):
+            score, thresh = change_mask(img1, img2)
+
         # Calculate changed pixels percentage
-        changed_pixels = np.count_nonzero(thresh)
-        total_pixels = thresh.size
+        region = roi_mask(roi, *roi_window(roi)) if roi else None
+        if region is None:
+            changed_pixels = np.count_nonzero(thresh)
+            total_pixels = thresh.size
+        else:
+            changed_pixels = np.count_nonzero(thresh[region > 0])
+            total_pixels = max(np.count_nonzero(region), 1)
         change_percent = round((changed_pixels / total_pixels) * 100, 2)
 
-        logger.info(f"Change detection completed: {change_percent}% change detected (SSIM: {score:.2f})")
+        logger.info("Change detection completed: %s%% change detected (SSIM: %.2f)", change_percent, score)
         return change_percent
     except Exception as e:
-        logger.error(f"Change calculation failed: {str(e)}")
+        logger.error("Change calculation failed: %s", e)
         raise SuspiciousOperation(f"Change calculation error: {str(e)}")
\ No newline at end of file
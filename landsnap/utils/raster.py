@@ -0,0 +1,210 @@
+import os
+import logging
+import cv2
+import numpy as np
+from django.core.exceptions import SuspiciousOperation
+from django.core.files.base import ContentFile
+from .image_utils import change_mask, change_regions, encode_heatmap, render_heatmap, roi_mask
+from .roi import roi_window
+from .validators import MAX_RASTER_DIMENSION, RASTER_EXTENSIONS
+
+try:
+    import tifffile
+except ImportError:  # Only needed for GeoTIFF/large-raster ingestion
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_SIZE = 1024
+# Context read around each tile so SSIM windows and morphology see the same
+# neighbourhood at tile edges as they would in the full frame
+TILE_HALO = 16
+OVERVIEW_MAX_DIMENSION = 4096
+
+
+def is_raster(path):
+    return os.path.splitext(path)[1].lstrip('.').lower() in RASTER_EXTENSIONS
+
+
+def require_tifffile():
+    if tifffile is None:
+        raise SuspiciousOperation("TIFF support requires the 'tifffile' package")
+
+
+class RasterReader:
+    """
+    Windowed reader for the first image of a tiled, stripped or BigTIFF file.
+
+    Uncompressed contiguous rasters are memory-mapped; otherwise only the
+    strips or tiles that overlap a requested window are read and decoded.
+    """
+
+    def __init__(self, path):
+        require_tifffile()
+        self._tiff = tifffile.TiffFile(path)
+        try:
+            page = self._tiff.pages[0]
+            if page.samplesperpixel not in (1, 3, 4):
+                raise SuspiciousOperation(f"Unsupported number of samples per pixel: {page.samplesperpixel}")
+            if page.samplesperpixel > 1 and page.planarconfig != 1:
+                raise SuspiciousOperation("Planar (band-separate) TIFFs are not supported")
+            if page.dtype not in (np.uint8, np.uint16):
+                raise SuspiciousOperation(f"Unsupported raster sample type: {page.dtype}")
+            self.page = page
+            self.height, self.width = page.imagelength, page.imagewidth
+            self.samples = page.samplesperpixel
+            self._memmap = tifffile.memmap(path, page=0, mode='r') if page.is_memmappable else None
+        except Exception:
+            self._tiff.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._memmap = None
+        self._tiff.close()
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    def read(self, y0, y1, x0, x1):
+        """Raw samples for rows y0:y1 and columns x0:x1 as a (h, w, samples) array"""
+        if self._memmap is not None:
+            window = np.asarray(self._memmap[y0:y1, x0:x1])
+            return window.reshape(y1 - y0, x1 - x0, self.samples)
+
+        page = self.page
+        chunk_h, chunk_w = page.chunks[0], page.chunks[1]
+        grid_cols = page.chunked[1]
+        window = np.zeros((y1 - y0, x1 - x0, self.samples), dtype=page.dtype)
+        fh = self._tiff.filehandle
+        for row in range(y0 // chunk_h, (y1 - 1) // chunk_h + 1):
+            for col in range(x0 // chunk_w, (x1 - 1) // chunk_w + 1):
+                index = row * grid_cols + col
+                data = None
+                if page.databytecounts[index]:
+                    fh.seek(page.dataoffsets[index])
+                    data = fh.read(page.databytecounts[index])
+                segment, indices, _shape = page.decode(data, index, jpegtables=page.jpegtables)
+                if segment is None:
+                    continue
+                segment = segment.reshape(segment.shape[-3], segment.shape[-2], -1)
+                seg_y, seg_x = indices[2], indices[3]
+                # Edge segments are padded to the full chunk size
+                top, bottom = max(y0, seg_y), min(y1, seg_y + segment.shape[0], self.height)
+                left, right = max(x0, seg_x), min(x1, seg_x + segment.shape[1], self.width)
+                if top >= bottom or left >= right:
+                    continue
+                window[top - y0:bottom - y0, left - x0:right - x0] = \
+                    segment[top - seg_y:bottom - seg_y, left - seg_x:right - seg_x]
+        return window
+
+    def read_bgr(self, y0, y1, x0, x1):
+        """Window converted to 8-bit BGR, matching what cv2.imread returns"""
+        window = self.read(y0, y1, x0, x1)
+        if window.dtype == np.uint16:
+            window = (window >> 8).astype(np.uint8)
+        if self.samples == 1:
+            return cv2.cvtColor(window[:, :, 0], cv2.COLOR_GRAY2BGR)
+        if self.samples == 4:
+            return cv2.cvtColor(window, cv2.COLOR_RGBA2BGR)
+        return cv2.cvtColor(window, cv2.COLOR_RGB2BGR)
+
+
+def iter_tiles(y0, y1, x0, x1, tile_size):
+    """Tiles covering rows y0:y1 and columns x0:x1"""
+    for y in range(y0, y1, tile_size):
+        for x in range(x0, x1, tile_size):
+            yield y, min(y + tile_size, y1), x, min(x + tile_size, x1)
+
+
+def analyze_tiled(img1_path, img2_path, tile_size=DEFAULT_TILE_SIZE, halo=TILE_HALO,
+                  overview_max=OVERVIEW_MAX_DIMENSION, fmt='png', roi=None, **encode_options):
+    """
+    Run change detection over two same-sized rasters one tile at a time.
+
+    Memory stays bounded by the tile size: each tile (plus a halo of context)
+    is read, scored and rendered, then written into a downscaled heatmap
+    overview. SSIM thresholds are chosen per tile. Returns the overall and
+    per-tile change percentages with the encoded overview heatmap; the 'mask'
+    format is not supported here and falls back to PNG.
+
+    With `roi`, only tiles within its bounding window are read, tiles lying
+    wholly outside a polygon are skipped, and change is scored inside it only.
+    """
+    with RasterReader(img1_path) as before, RasterReader(img2_path) as after:
+        if before.shape != after.shape:
+            raise SuspiciousOperation(
+                f"Rasters must have the same dimensions ({before.width}x{before.height} vs {after.width}x{after.height})"
+            )
+        height, width = before.shape
+        if max(height, width) > MAX_RASTER_DIMENSION:
+            raise SuspiciousOperation(f"Raster dimensions exceed maximum of {MAX_RASTER_DIMENSION}px")
+
+        wy0, wy1, wx0, wx1 = roi_window(roi) if roi else (0, height, 0, width)
+        wy1, wx1 = min(wy1, height), min(wx1, width)
+        scale = min(1.0, overview_max / max(wy1 - wy0, wx1 - wx0))
+        overview = np.zeros((max(round((wy1 - wy0) * scale), 1), max(round((wx1 - wx0) * scale), 1), 3),
+                            dtype=np.uint8)
+        tiles = []
+        changed_total = scored_total = 0
+
+        for y0, y1, x0, x1 in iter_tiles(wy0, wy1, wx0, wx1, tile_size):
+            hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+            hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+            inner = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+            region = roi_mask(roi, hy0, hy1, hx0, hx1) if roi else None
+            scored = (y1 - y0) * (x1 - x0) if region is None else np.count_nonzero(region[inner])
+            if not scored:
+                continue
+            tile1 = before.read_bgr(hy0, hy1, hx0, hx1)
+            tile2 = after.read_bgr(hy0, hy1, hx0, hx1)
+
+            gray1 = cv2.cvtColor(tile1, cv2.COLOR_BGR2GRAY)
+            gray2 = cv2.cvtColor(tile2, cv2.COLOR_BGR2GRAY)
+            _score, thresh = change_mask(gray1, gray2)
+            thresh = thresh[inner]
+            changed = np.count_nonzero(thresh if region is None else thresh[region[inner] > 0])
+            changed_total += changed
+            scored_total += scored
+
+            _diff, mask, boxes = change_regions(gray1, gray2, region)
+            composite = render_heatmap(tile2, mask, boxes)[inner]
+            # Every tile covers at least one overview pixel
+            oy0 = min(round((y0 - wy0) * scale), overview.shape[0] - 1)
+            ox0 = min(round((x0 - wx0) * scale), overview.shape[1] - 1)
+            oy1 = min(max(round((y1 - wy0) * scale), oy0 + 1), overview.shape[0])
+            ox1 = min(max(round((x1 - wx0) * scale), ox0 + 1), overview.shape[1])
+            overview[oy0:oy1, ox0:ox1] = cv2.resize(composite, (ox1 - ox0, oy1 - oy0), interpolation=cv2.INTER_AREA)
+
+            tiles.append({
+                'x': x0,
+                'y': y0,
+                'width': x1 - x0,
+                'height': y1 - y0,
+                'change_percentage': round(changed / scored * 100, 2),
+            })
+
+    change_percentage = round(changed_total / max(scored_total, 1) * 100, 2)
+    logger.info("Tiled change detection completed over %s tiles: %s%% change detected", len(tiles), change_percentage)
+
+    fmt = 'png' if fmt == 'mask' else fmt
+    data, ext = encode_heatmap(overview, fmt, **encode_options)
+    return {
+        'heatmap': ContentFile(data, name=f'heatmap.{ext}'),
+        'heatmap_format': fmt,
+        'change_percentage': change_percentage,
+        'raster': {
+            'width': width,
+            'height': height,
+            'tile_size': tile_size,
+            'window': [wx0, wy0, wx1 - wx0, wy1 - wy0],
+            'overview_scale': round(scale, 6),
+            'tiles': tiles,
+        },
+    }
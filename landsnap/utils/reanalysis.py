@@ -0,0 +1,84 @@
+"""
+Bulk reanalysis of stored results after the analysis parameters change.
+
+Finished results are put back on the job queue as batch jobs, so `runworker`
+processes them after interactive uploads and within the memory budget, like
+any other job. Results still queued or running are left to the worker that
+has them. The worker keeps a requeued result's output when the pair's content
+and the parameter set both match what it was computed with.
+"""
+import logging
+from dataclasses import dataclass
+from django.utils import timezone
+from ..models import AnalysisResult
+from .rollups import outcome_of, record_transition, rollup_day
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 200
+# Stored on a requeued result until its worker is done with it
+METADATA_KEY = 'reanalysis'
+
+
+@dataclass
+class ReanalysisQueued:
+    queued: int = 0
+    busy: int = 0
+
+    def summary(self):
+        return f"{self.queued} analyses queued for reanalysis, {self.busy} skipped as still queued or running"
+
+
+def queue_reanalysis(results, force=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Requeue the finished results in `results` as batch jobs. Each row is
+    claimed with a conditional update on its status, so a result that a
+    worker picks up meanwhile is counted as busy rather than overwritten.
+    With `force`, workers rerun pairs even when nothing has changed.
+    """
+    stats = ReanalysisQueued()
+    stats.busy = results.exclude(status__in=AnalysisResult.TERMINAL_STATUSES).count()
+    finished = (results.filter(status__in=AnalysisResult.TERMINAL_STATUSES).order_by('pk')
+                .only('pk', 'status', 'created_at', 'change_intensity', 'processing_time', 'metadata'))
+    for result in finished.iterator(chunk_size=chunk_size):
+        metadata = {**(result.metadata or {}), METADATA_KEY: {'force': force, 'previous_status': result.status}}
+        claimed = AnalysisResult.objects.filter(pk=result.pk, status=result.status).update(
+            status='PENDING',
+            priority=AnalysisResult.PRIORITY_BATCH,
+            queued_at=timezone.now(),
+            started_at=None,
+            queue_wait=None,
+            worker_id='',
+            lease_expires_at=None,
+            attempts=0,
+            cancel_requested=False,
+            error_message=None,
+            metadata=metadata,
+        )
+        if not claimed:
+            stats.busy += 1
+            continue
+        # The result stops counting towards its day until the worker is done with it
+        record_transition(rollup_day(result), outcome_of(result), None)
+        stats.queued += 1
+    logger.info("Queued reanalysis: %s", stats.summary())
+    return stats
+
+
+def reusable_hash(result):
+    """
+    The input hash a requeued result's output was computed from, when that
+    output can be kept as long as the pair still hashes to it: it completed
+    before, reanalysis was not forced and the parameter set hasn't changed.
+    Otherwise None. The worker checks the pair's content in its supervised
+    child, since hashing large originals can take longer than a lease.
+    """
+    from .analysis import params_hash
+
+    metadata = result.metadata or {}
+    request = metadata.get(METADATA_KEY)
+    if not request or request.get('force') or request.get('previous_status') != 'COMPLETE':
+        return None
+    if metadata.get('params_hash') != params_hash():
+        return None
+    return metadata.get('input_hash') or None
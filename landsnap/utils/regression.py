@@ -0,0 +1,405 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from dataclasses import dataclass, field
+import cv2
+import numpy as np
+from .image_utils import (
+    ANALYSIS_PARAMS, HEATMAP_DIFF_THRESHOLD, MIN_CONTOUR_AREA, MORPH_KERNEL_SIZE, SSIM_WINDOW_SIZE,
+    analyze_heatmap, calculate_changes, change_mask, detect_change_regions, mask_regions,
+)
+from .raster import analyze_tiled, tifffile
+from .roi import normalize_roi
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'golden')
+CORPUS_SIZE = 512
+# Small enough that the corpus spans several tiles, with partial ones at the edges
+REGRESSION_TILE_SIZE = 200
+
+# How far an optimized path may drift from the golden outputs. Mask
+# tolerances are the fraction of pixels allowed to differ.
+TOLERANCES = {
+    'change_percentage': 0.05,
+    'ssim': 1e-4,
+    'mask': 0.001,
+    'heatmap_mask': 0.001,
+    'regions': 0,
+}
+# Paths that approximate the reference rather than reproduce it. Their
+# own outputs are recorded too, and they are checked against those.
+APPROXIMATE_PATHS = ('tiled', 'heatmap')
+
+
+# Corpus ---------------------------------------------------------------------
+
+def terrain(rng, size):
+    """Landscape-like BGR frame: water, vegetation and bare soil from layered noise, with roads"""
+    height = np.zeros((size, size), dtype=np.float32)
+    for cell, weight in ((128, 0.6), (32, 0.3), (8, 0.1)):
+        coarse = rng.random((size // cell + 2, size // cell + 2)).astype(np.float32)
+        height += weight * cv2.resize(coarse, (size, size), interpolation=cv2.INTER_CUBIC)
+    height = (height - height.min()) / (height.max() - height.min())
+
+    frame = np.empty((size, size, 3), dtype=np.float32)
+    frame[:] = (60, 110, 150)                               # bare soil
+    frame[height < 0.65] = (50, 130, 70)                    # vegetation
+    frame[height < 0.3] = (120, 80, 40)                     # water
+    frame += (height[..., None] - 0.5) * 60
+    frame += rng.normal(0, 6, frame.shape)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    for _ in range(3):
+        x0, y0, x1, y1 = (int(v) for v in rng.integers(0, size, 4))
+        cv2.line(frame, (x0, 0), (x1, size - 1), (150, 150, 150), 4)
+        cv2.line(frame, (0, y0), (size - 1, y1), (150, 150, 150), 3)
+    return frame
+
+
+def add_buildings(rng, frame, count):
+    """Draw rectangular roofs with shadows, as new construction"""
+    frame = frame.copy()
+    size = frame.shape[0]
+    for _ in range(count):
+        w, h = (int(v) for v in rng.integers(12, 40, 2))
+        x, y = (int(v) for v in rng.integers(0, size - 45, 2))
+        cv2.rectangle(frame, (x + 3, y + 3), (x + w + 3, y + h + 3), (30, 30, 35), -1)
+        color = tuple(int(c) for c in rng.integers(150, 230, 3))
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+    return frame
+
+
+def case_identical(rng, size):
+    before = terrain(rng, size)
+    return before, before.copy()
+
+
+def case_sensor_noise(rng, size):
+    before = terrain(rng, size)
+    after = np.clip(before + rng.normal(0, 4, before.shape), 0, 255).astype(np.uint8)
+    return before, after
+
+
+def case_new_buildings(rng, size):
+    before = terrain(rng, size)
+    return before, add_buildings(rng, before, 10)
+
+
+def case_deforestation(rng, size):
+    before = terrain(rng, size)
+    after = before.copy()
+    points = np.array([[size * 0.2, size * 0.3], [size * 0.6, size * 0.2], [size * 0.7, size * 0.6],
+                       [size * 0.3, size * 0.7]], dtype=np.int32)
+    cleared = np.zeros(before.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(cleared, [points], 255)
+    soil = np.clip(np.array((60, 110, 150)) + rng.normal(0, 10, before.shape), 0, 255).astype(np.uint8)
+    after[cleared > 0] = soil[cleared > 0]
+    return before, after
+
+
+def case_illumination(rng, size):
+    before = terrain(rng, size)
+    after = add_buildings(rng, before, 4)
+    return before, np.clip(after.astype(np.float32) * 1.15 + 10, 0, 255).astype(np.uint8)
+
+
+def case_jpeg_artifacts(rng, size):
+    before = terrain(rng, size)
+    after = add_buildings(rng, before, 6)
+
+    def recompress(frame):
+        _ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        return cv2.imdecode(data, cv2.IMREAD_COLOR)
+    return recompress(before), recompress(after)
+
+
+def case_resized(rng, size):
+    before = terrain(rng, size)
+    after = before.copy()
+    cv2.circle(after, (size // 3, size // 2), size // 6, (120, 80, 40), -1)  # flooding
+    return before, cv2.resize(after, (size * 15 // 16, size * 15 // 16), interpolation=cv2.INTER_AREA)
+
+
+def case_blocks(rng, size):
+    before = np.full((size, size, 3), 128, dtype=np.uint8)
+    after = before.copy()
+    for _ in range(8):
+        x, y = (int(v) for v in rng.integers(0, size - 64, 2))
+        after[y:y + 48, x:x + 64] = 0 if rng.random() < 0.5 else 255
+    return before, after
+
+
+CORPUS = {
+    'identical': case_identical,
+    'sensor_noise': case_sensor_noise,
+    'new_buildings': case_new_buildings,
+    'deforestation': case_deforestation,
+    'illumination': case_illumination,
+    'jpeg_artifacts': case_jpeg_artifacts,
+    'resized': case_resized,
+    'blocks': case_blocks,
+}
+
+
+def build_pair(case, size=CORPUS_SIZE):
+    """Deterministic before/after BGR frames for a corpus case"""
+    return CORPUS[case](np.random.default_rng(zlib.crc32(case.encode())), size)
+
+
+def write_pair(case, directory, size=CORPUS_SIZE):
+    """Write a case as lossless PNGs, which every path then reads from disk"""
+    paths = []
+    for label, frame in zip(('before', 'after'), build_pair(case, size)):
+        path = os.path.join(directory, f'{case}_{label}.png')
+        cv2.imwrite(path, frame)
+        paths.append(path)
+    return tuple(paths)
+
+
+# Reference implementation ----------------------------------------------------
+# A frozen copy of the analysis as the golden outputs were recorded. Keep it
+# as it is when optimizing image_utils: that's what the optimized code is checked against.
+
+def reference_ssim_map(gray1, gray2, window_size=SSIM_WINDOW_SIZE):
+    window_size = min(window_size, *gray1.shape)
+    if window_size % 2 == 0:
+        window_size -= 1
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    im1, im2 = gray1.astype(np.float64), gray2.astype(np.float64)
+    kernel = cv2.getGaussianKernel(window_size, 1.5)
+    kernel = np.outer(kernel, kernel.transpose())
+    mu1, mu2 = cv2.filter2D(im1, -1, kernel), cv2.filter2D(im2, -1, kernel)
+    sigma1_sq = cv2.filter2D(im1 ** 2, -1, kernel) - mu1 ** 2
+    sigma2_sq = cv2.filter2D(im2 ** 2, -1, kernel) - mu2 ** 2
+    sigma12 = cv2.filter2D(im1 * im2, -1, kernel) - mu1 * mu2
+    return ((2 * mu1 * mu2 + c1) * (2 * sigma12 + c2)) / ((mu1 ** 2 + mu2 ** 2 + c1) * (sigma1_sq + sigma2_sq + c2))
+
+
+def reference_change_mask(gray1, gray2):
+    ssim_map = reference_ssim_map(gray1, gray2)
+    diff = (ssim_map * 255).astype(np.uint8)
+    mask = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (MORPH_KERNEL_SIZE, MORPH_KERNEL_SIZE))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    return ssim_map.mean(), mask
+
+
+def reference_heatmap_mask(bgr1, bgr2):
+    if bgr1.shape != bgr2.shape:
+        bgr2 = cv2.resize(bgr2, (bgr1.shape[1], bgr1.shape[0]))
+    diff = cv2.absdiff(cv2.cvtColor(bgr1, cv2.COLOR_BGR2GRAY), cv2.cvtColor(bgr2, cv2.COLOR_BGR2GRAY))
+    thresh = cv2.threshold(diff, HEATMAP_DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)[1]
+    contours = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    kept = [cnt for cnt in contours if cv2.contourArea(cnt) > MIN_CONTOUR_AREA]
+    mask = np.zeros(thresh.shape, dtype=np.uint8)
+    for cnt in kept:
+        cv2.drawContours(mask, [cnt], 0, 255, -1)
+    return mask, len(kept)
+
+
+# Code paths ------------------------------------------------------------------
+# Each takes the pair's paths and returns whichever metrics it can observe.
+
+def read_gray_pair(img1_path, img2_path):
+    gray1 = cv2.imread(img1_path, cv2.IMREAD_GRAYSCALE)
+    gray2 = cv2.imread(img2_path, cv2.IMREAD_GRAYSCALE)
+    if gray1.shape != gray2.shape:
+        gray2 = cv2.resize(gray2, (gray1.shape[1], gray1.shape[0]))
+    return gray1, gray2
+
+
+def mask_percentage(mask):
+    return round(np.count_nonzero(mask) / mask.size * 100, 2)
+
+
+def path_reference(img1_path, img2_path):
+    score, mask = reference_change_mask(*read_gray_pair(img1_path, img2_path))
+    heatmap_mask, regions = reference_heatmap_mask(cv2.imread(img1_path), cv2.imread(img2_path))
+    return {'change_percentage': mask_percentage(mask), 'ssim': float(score), 'mask': mask,
+            'heatmap_mask': heatmap_mask, 'regions': regions}
+
+
+def path_image_utils(img1_path, img2_path):
+    """The building blocks the pipeline is made of: change_mask and detect_change_regions"""
+    score, mask = change_mask(*read_gray_pair(img1_path, img2_path))
+    _img2, heatmap_mask, boxes = detect_change_regions(cv2.imread(img1_path), cv2.imread(img2_path))
+    return {'change_percentage': mask_percentage(mask), 'ssim': float(score), 'mask': mask,
+            'heatmap_mask': heatmap_mask, 'regions': len(boxes)}
+
+
+def path_calculate_changes(img1_path, img2_path):
+    return {'change_percentage': calculate_changes(img1_path, img2_path)}
+
+
+def path_sidecar(img1_path, img2_path):
+    """calculate_changes reading memory-mapped grayscale sidecars (the first call writes them)"""
+    return {'change_percentage': calculate_changes(img1_path, img2_path, cache_gray=(True, True))}
+
+
+def path_roi(img1_path, img2_path):
+    """A polygon region covering the whole frame, which must not change the score"""
+    height, width = cv2.imread(img1_path, cv2.IMREAD_GRAYSCALE).shape
+    frame = [[0, 0], [width // 2, 0], [width, 0], [width, height], [0, height]]
+    return {'change_percentage': calculate_changes(img1_path, img2_path, roi=normalize_roi(frame, width, height))}
+
+
+def path_heatmap(img1_path, img2_path):
+    """
+    analyze_heatmap's stored change mask, as its changed percentage and
+    region count. It works on the grayscale decode (as calculate_changes
+    does) rather than converting the colour one, so a few pixels near the
+    threshold differ from detect_change_regions.
+    """
+    output = analyze_heatmap(img1_path, img2_path, 'mask', overlay=False)
+    mask = cv2.imdecode(np.frombuffer(output['heatmap'].read(), np.uint8), cv2.IMREAD_GRAYSCALE)
+    return {'change_percentage': mask_percentage(mask), 'regions': len(mask_regions(mask))}
+
+
+def path_tiled(img1_path, img2_path):
+    """analyze_tiled over TIFF copies of the pair, or None where it doesn't apply"""
+    tiffs = [os.path.splitext(path)[0] + '.tif' for path in (img1_path, img2_path)]
+    if not all(os.path.exists(path) for path in tiffs):
+        frames = [cv2.imread(path) for path in (img1_path, img2_path)]
+        if frames[0].shape != frames[1].shape:
+            return None
+        for tiff_path, frame in zip(tiffs, frames):
+            tifffile.imwrite(tiff_path, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), tile=(64, 64), photometric='rgb')
+    output = analyze_tiled(*tiffs, tile_size=REGRESSION_TILE_SIZE)
+    return {'change_percentage': output['change_percentage']}
+
+
+PATHS = {
+    'reference': path_reference,
+    'image_utils': path_image_utils,
+    'calculate_changes': path_calculate_changes,
+    'sidecar': path_sidecar,
+    'roi': path_roi,
+    'heatmap': path_heatmap,
+}
+if tifffile is not None:
+    PATHS['tiled'] = path_tiled
+
+
+# Goldens ---------------------------------------------------------------------
+
+def mask_digest(mask):
+    return hashlib.sha256(f"{mask.shape}".encode() + np.packbits(mask > 0).tobytes()).hexdigest()
+
+
+def mask_path(case, metric, directory=GOLDEN_DIR):
+    return os.path.join(directory, 'masks', f'{case}.{metric}.png')
+
+
+def load_golden(directory=GOLDEN_DIR):
+    """Recorded outputs by case, or {} if none have been recorded"""
+    try:
+        with open(os.path.join(directory, 'outputs.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_golden(outputs, approximations=None, directory=GOLDEN_DIR):
+    """
+    Record reference outputs (by case) with their masks as 1-bit PNGs, and
+    the outputs of APPROXIMATE_PATHS (by case, then path)
+    """
+    os.makedirs(os.path.join(directory, 'masks'), exist_ok=True)
+    golden = {'params': ANALYSIS_PARAMS, 'size': CORPUS_SIZE, 'cases': {}}
+    for case, metrics in sorted(outputs.items()):
+        record = {'change_percentage': metrics['change_percentage'], 'ssim': round(metrics['ssim'], 8),
+                  'regions': metrics['regions'], 'approximations': (approximations or {}).get(case, {})}
+        for metric in ('mask', 'heatmap_mask'):
+            record[f'{metric}_sha256'] = mask_digest(metrics[metric])
+            cv2.imwrite(mask_path(case, metric, directory), metrics[metric],
+                        [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])
+        golden['cases'][case] = record
+    with open(os.path.join(directory, 'outputs.json'), 'w') as f:
+        json.dump(golden, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return golden
+
+
+def mask_mismatch(case, metric, mask, record, directory=GOLDEN_DIR):
+    """Fraction of pixels where `mask` differs from the recorded one"""
+    if mask_digest(mask) == record[f'{metric}_sha256']:
+        return 0.0
+    golden = cv2.imread(mask_path(case, metric, directory), cv2.IMREAD_GRAYSCALE)
+    if golden is None or golden.shape != mask.shape:
+        return 1.0
+    return np.count_nonzero((golden > 0) != (mask > 0)) / mask.size
+
+
+@dataclass
+class Comparison:
+    case: str
+    path: str
+    seconds: float
+    deltas: dict = field(default_factory=dict)
+    failures: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.failures
+
+
+def compare(case, path, metrics, record, seconds=0.0, directory=GOLDEN_DIR):
+    """Check one path's metrics against a golden record within TOLERANCES"""
+    if path in APPROXIMATE_PATHS:
+        if path not in record.get('approximations', {}):
+            raise KeyError(f"No golden outputs recorded for path '{path}' on case '{case}'")
+        record = {**record, **record['approximations'][path]}
+    comparison = Comparison(case, path, seconds)
+    for metric, value in metrics.items():
+        if metric in ('mask', 'heatmap_mask'):
+            delta = mask_mismatch(case, metric, value, record, directory)
+        else:
+            delta = abs(value - record[metric])
+        comparison.deltas[metric] = delta
+        if delta > TOLERANCES[metric]:
+            comparison.failures.append(f"{metric} off by {delta:.6g} (tolerance {TOLERANCES[metric]:g})")
+    return comparison
+
+
+def timed(function, *args, repeat=1):
+    """Result of the last call and the best wall time over `repeat` calls"""
+    best = None
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run_regression(workdir, cases=None, paths=None, repeat=1, directory=GOLDEN_DIR):
+    """
+    Run each code path over each corpus case and compare it with the golden
+    outputs. Returns Comparisons in case, then path order; paths that don't
+    apply to a case are left out.
+    """
+    golden = load_golden(directory)
+    comparisons = []
+    for case in cases or CORPUS:
+        if case not in golden.get('cases', {}):
+            raise KeyError(f"No golden outputs recorded for case '{case}'")
+        pair = write_pair(case, workdir, golden.get('size', CORPUS_SIZE))
+        for name in paths or PATHS:
+            metrics, seconds = timed(PATHS[name], *pair, repeat=repeat)
+            if metrics is not None:
+                comparisons.append(compare(case, name, metrics, golden['cases'][case], seconds, directory))
+    return comparisons
+
+
+def record_golden(workdir, directory=GOLDEN_DIR):
+    """Recompute every case with the reference and approximate paths and store them as the new goldens"""
+    outputs, approximations = {}, {}
+    for case in CORPUS:
+        pair = write_pair(case, workdir)
+        outputs[case] = path_reference(*pair)
+        for name in APPROXIMATE_PATHS:
+            metrics = PATHS[name](*pair) if name in PATHS else None
+            if metrics is not None:
+                approximations.setdefault(case, {})[name] = metrics
+    return save_golden(outputs, approximations, directory)
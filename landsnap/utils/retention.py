@@ -0,0 +1,268 @@
+import os
+import re
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.validators import FileExtensionValidator
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from PIL import Image
+from ..models import ImageUpload, AnalysisResult, StoredBlob, UploadSession
+from ..storage import CONTENT_ROOT, SIDECAR_SUFFIXES
+from .analysis import input_hash
+from .chunked import discard_session, partial_path
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PREFIXES = (CONTENT_ROOT, 'before_after', 'results', UploadSession.PARTIAL_ROOT)
+COMPACT_FORMATS = ('png', 'webp')
+BATCH_SIZE = 500
+UPLOAD_PREFIX_RE = re.compile(r'^[0-9a-f]{8}_')
+
+
+@dataclass
+class RetentionReport:
+    uploads_deleted: int = 0
+    sessions_deleted: int = 0
+    orphans_deleted: int = 0
+    files_compacted: int = 0
+    bytes_reclaimed: int = 0
+
+    def summary(self):
+        return (
+            f"{self.uploads_deleted} expired uploads, {self.sessions_deleted} abandoned resumable uploads, "
+            f"{self.orphans_deleted} orphaned files, "
+            f"{self.files_compacted} files recompressed; {format_bytes(self.bytes_reclaimed)} reclaimed"
+        )
+
+
+def format_bytes(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TB"
+
+
+def _file_size(field_file):
+    try:
+        return field_file.size if field_file else 0
+    except (OSError, ValueError):
+        return 0
+
+
+def expired_uploads(now=None, retention=None):
+    """
+    Queryset of uploads past the TTL configured for their result status.
+    Queued and running results are aged from when they were (re)queued, so
+    an old result put back on the queue for reanalysis isn't purged mid-job.
+    """
+    now = now or timezone.now()
+    retention = retention if retention is not None else settings.LANDSNAP_RETENTION_DAYS
+    expired = Q(pk__in=[])
+    for status, days in retention.items():
+        if days is None:
+            continue
+        cutoff = now - timedelta(days=days)
+        if status in ('PENDING', 'PROCESSING'):
+            expired |= Q(waiting_since__lt=cutoff, analysis_result__status=status)
+        else:
+            expired |= Q(uploaded_at__lt=cutoff, analysis_result__status=status)
+        if status == 'PENDING':
+            expired |= Q(uploaded_at__lt=cutoff, analysis_result__isnull=True)
+    return (ImageUpload.objects
+            .annotate(waiting_since=Coalesce('analysis_result__queued_at', 'uploaded_at'))
+            .filter(expired))
+
+
+def _released_size(field_file, released):
+    """
+    Bytes freed by dropping one reference to a stored original, counting
+    references already dropped in `released`: nothing until the last one
+    goes, then the file and its sidecars.
+    """
+    if not field_file:
+        return 0
+    name = field_file.name
+    released[name] += 1
+    # Names from before content addressing have no StoredBlob and are deleted outright
+    if released[name] != max(field_file.storage.refcount(name), 1):
+        return 0
+    path = field_file.path
+    size = _file_size(field_file)
+    for suffix in SIDECAR_SUFFIXES:
+        try:
+            size += os.path.getsize(path + suffix)
+        except OSError:
+            pass
+    return size
+
+
+def expire_uploads(report, dry_run=False, now=None):
+    """Delete expired uploads; their files are removed by the post_delete handlers"""
+    queryset = expired_uploads(now=now).select_related('analysis_result')
+    batch = []
+    released = Counter()
+    for upload in queryset.iterator(chunk_size=BATCH_SIZE):
+        report.bytes_reclaimed += _released_size(upload.image1, released) + _released_size(upload.image2, released)
+        if hasattr(upload, 'analysis_result'):
+            result = upload.analysis_result
+            report.bytes_reclaimed += _file_size(result.heatmap) + _file_size(result.overlay)
+        report.uploads_deleted += 1
+        batch.append(upload.pk)
+        if len(batch) >= BATCH_SIZE and not dry_run:
+            _delete_batch(batch)
+            # The deleted references are gone from the refcounts now
+            batch, released = [], Counter()
+    if batch and not dry_run:
+        _delete_batch(batch)
+    return report
+
+
+def _delete_batch(pks):
+    with transaction.atomic():
+        ImageUpload.objects.filter(pk__in=pks).delete()
+
+
+def expire_upload_sessions(report, dry_run=False, now=None):
+    """Delete resumable uploads left unfinished (or unsubmitted) for LANDSNAP_UPLOAD_SESSION_HOURS"""
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.LANDSNAP_UPLOAD_SESSION_HOURS)
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator(chunk_size=BATCH_SIZE):
+        try:
+            report.bytes_reclaimed += os.path.getsize(partial_path(session))
+        except OSError:
+            pass
+        report.sessions_deleted += 1
+        if not dry_run:
+            discard_session(session)
+    return report
+
+
+def referenced_names():
+    """Every media name the database points at, loaded in bulk"""
+    names = set()
+    for image1, image2 in ImageUpload.objects.values_list('image1', 'image2').iterator(chunk_size=BATCH_SIZE):
+        names.update((image1, image2))
+    for heatmap, overlay in AnalysisResult.objects.values_list('heatmap', 'overlay').iterator(chunk_size=BATCH_SIZE):
+        names.update((heatmap, overlay))
+    names.update(session.partial_name for session in UploadSession.objects.only('id').iterator(chunk_size=BATCH_SIZE))
+    names.discard('')
+    return names
+
+
+def sweep_orphans(report, dry_run=False, now=None):
+    """Delete files under MEDIA_ROOT that no row references"""
+    grace = timedelta(hours=settings.LANDSNAP_ORPHAN_GRACE_HOURS)
+    cutoff = ((now or timezone.now()) - grace).timestamp()
+    names = referenced_names()
+    for prefix in MEDIA_PREFIXES:
+        root = os.path.join(settings.MEDIA_ROOT, prefix)
+        for dirpath, _dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                if name in names:
+                    continue
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for suffix in SIDECAR_SUFFIXES):
+                    continue
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                report.orphans_deleted += 1
+                report.bytes_reclaimed += stat.st_size
+                if not dry_run:
+                    os.remove(path)
+                    StoredBlob.objects.filter(name=name).delete()
+    return report
+
+
+def recompress(data, fmt):
+    """Losslessly re-encode PNG bytes, returning None when it would not help"""
+    with Image.open(BytesIO(data)) as img:
+        if img.format != 'PNG':
+            return None
+        out = BytesIO()
+        if fmt == 'webp':
+            img.save(out, format='WEBP', lossless=True, method=6)
+        else:
+            img.save(out, format='PNG', optimize=True)
+    encoded = out.getvalue()
+    return encoded if len(encoded) < len(data) else None
+
+
+def compact_format(model, field_name, fmt):
+    """
+    `fmt`, or PNG when the field's extension whitelist doesn't allow it, so
+    a compacted file still passes validation when its row is edited.
+    """
+    for validator in model._meta.get_field(field_name).validators:
+        if isinstance(validator, FileExtensionValidator) and fmt not in validator.allowed_extensions:
+            return 'png'
+    return fmt
+
+
+def _compact_field(instance, field_name, fmt, report, dry_run):
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return False
+    fmt = compact_format(type(instance), field_name, fmt)
+    try:
+        with field_file.open('rb') as f:
+            data = f.read()
+        encoded = recompress(data, fmt)
+    except (OSError, ValueError) as e:
+        logger.warning("Skipping recompression of %s: %s", field_file.name, e)
+        return False
+    if encoded is None:
+        return False
+    report.files_compacted += 1
+    report.bytes_reclaimed += len(data) - len(encoded)
+    if dry_run:
+        return False
+    old_name = field_file.name
+    # Drop the random prefix `upload_to` added last time so names don't keep growing
+    base = UPLOAD_PREFIX_RE.sub('', os.path.splitext(os.path.basename(old_name))[0])
+    field_file.save(f"{base}.{fmt}", ContentFile(encoded), save=False)
+    field_file.storage.delete(old_name)
+    return True
+
+
+def compact_media(report, fmt='png', older_than_days=30, dry_run=False, now=None):
+    """
+    Recompress old PNG originals and heatmaps without changing their pixels.
+    Originals stay PNG whatever `fmt` is, since uploads don't accept WebP.
+    """
+    if fmt not in COMPACT_FORMATS:
+        raise ValueError(f"Unsupported compaction format: {fmt}")
+    cutoff = (now or timezone.now()) - timedelta(days=older_than_days)
+
+    uploads = ImageUpload.objects.filter(uploaded_at__lt=cutoff).select_related('analysis_result')
+    for upload in uploads.iterator(chunk_size=BATCH_SIZE):
+        result = getattr(upload, 'analysis_result', None)
+        metadata = (result.metadata or {}) if result else {}
+        stored_hash_current = False
+        if metadata.get('input_hash') and not dry_run:
+            try:
+                stored_hash_current = metadata['input_hash'] == input_hash(upload.image1.path, upload.image2.path)
+            except OSError:
+                pass
+
+        changed = [name for name in ('image1', 'image2') if _compact_field(upload, name, fmt, report, dry_run)]
+        if changed:
+            upload.save(update_fields=changed)
+            # Pixels are unchanged, so keep `reanalyze` from treating the pair as new
+            if stored_hash_current:
+                result.metadata = {**metadata, 'input_hash': input_hash(upload.image1.path, upload.image2.path)}
+                result.save(update_fields=['metadata'])
+
+    results = AnalysisResult.objects.filter(created_at__lt=cutoff).exclude(heatmap='')
+    for result in results.iterator(chunk_size=BATCH_SIZE):
+        if _compact_field(result, 'heatmap', fmt, report, dry_run):
+            result.save(update_fields=['heatmap'])
+    return report
@@ -0,0 +1,90 @@
+import json
+import math
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+
+# Smaller regions leave too little context for the SSIM window and morphology
+MIN_ROI_SIDE = 32
+MAX_POLYGON_POINTS = 1000
+
+
+def parse_roi(value):
+    """
+    Parse a region of interest given as JSON: `{"bbox": [x, y, width, height]}`
+    or `{"polygon": [[x, y], [x, y], ...]}` in pixels of the before image.
+    Returns the polygon as a list of [x, y] points, or None for an empty value.
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValidationError(_('Region of interest must be valid JSON.'), code='invalid_roi')
+
+    try:
+        if isinstance(value, dict) and 'bbox' in value:
+            x, y, width, height = (float(v) for v in value['bbox'])
+            if width <= 0 or height <= 0:
+                raise ValueError
+            points = [[x, y], [x + width, y], [x + width, y + height], [x, y + height]]
+        elif isinstance(value, dict) and 'polygon' in value:
+            points = [[float(x), float(y)] for x, y in value['polygon']]
+            if not 3 <= len(points) <= MAX_POLYGON_POINTS:
+                raise ValueError
+        else:
+            raise ValueError
+        # NaN and infinities parse as floats but can't be rounded to pixels
+        if not all(math.isfinite(v) for point in points for v in point):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValidationError(
+            _('Region of interest must be {"bbox": [x, y, width, height]} or {"polygon": [[x, y], ...]} '
+              'with 3 to %(max)s points.'),
+            params={'max': MAX_POLYGON_POINTS},
+            code='invalid_roi'
+        )
+    return points
+
+
+def normalize_roi(points, width, height):
+    """
+    Clip a parsed region to a width x height frame. Returns the stored form:
+    the integer polygon, its bounding window [x, y, width, height] and the
+    frame size. A region that is an axis-aligned rectangle is flagged so the
+    analysis can skip building a mask for it.
+    """
+    clipped = [[min(max(round(x), 0), width), min(max(round(y), 0), height)] for x, y in points]
+    xs = [x for x, _y in clipped]
+    ys = [y for _x, y in clipped]
+    x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+    if x1 - x0 < MIN_ROI_SIDE or y1 - y0 < MIN_ROI_SIDE:
+        raise ValidationError(
+            _('Region of interest must cover at least %(min)sx%(min)s pixels inside the %(width)sx%(height)s image.'),
+            params={'min': MIN_ROI_SIDE, 'width': width, 'height': height},
+            code='roi_too_small'
+        )
+    # Four distinct corners joined by axis-aligned edges, so not a bow-tie
+    is_rectangle = (
+        len({tuple(p) for p in clipped}) == 4
+        and all(x in (x0, x1) and y in (y0, y1) for x, y in clipped)
+        and all(a[0] == b[0] or a[1] == b[1] for a, b in zip(clipped, clipped[1:] + clipped[:1]))
+    )
+    return {
+        'polygon': clipped,
+        'bbox': [x0, y0, x1 - x0, y1 - y0],
+        'frame': [width, height],
+        'rectangle': is_rectangle,
+    }
+
+
+def roi_window(roi):
+    """Bounding window of a stored region as (y0, y1, x0, x1)"""
+    x, y, width, height = roi['bbox']
+    return y, y + height, x, x + width
+
+
+def roi_area(roi):
+    """Pixels in the region's bounding window, which is what the analysis processes"""
+    _x, _y, width, height = roi['bbox']
+    return width * height
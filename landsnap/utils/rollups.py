@@ -0,0 +1,162 @@
+"""
+Daily aggregates of finished analyses for the dashboard and admin filters,
+which read them instead of scanning AnalysisResult.
+
+A result counts towards the day it was created. Each change to its outcome
+(completing, failing, being cancelled or reanalysed) calls `record_transition`
+with the outcome before and after, so a result is moved between buckets
+rather than counted twice.
+"""
+import bisect
+import logging
+from collections import namedtuple
+from django.db import transaction
+from django.utils import timezone
+from ..models import AnalysisResult, DailyRollup
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the processing time histogram; one more bucket takes the rest
+PROCESSING_TIME_BOUNDS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+Outcome = namedtuple('Outcome', 'status intensity processing_time', defaults=(None, None))
+
+
+def outcome_of(result):
+    """What `result` contributes to its day's rollup, or None while it is unfinished"""
+    if result.status == 'COMPLETE':
+        return Outcome('COMPLETE', result.change_intensity, result.processing_time)
+    if result.status in AnalysisResult.TERMINAL_STATUSES:
+        return Outcome(result.status)
+    return None
+
+
+def rollup_day(result):
+    return timezone.localdate(result.created_at)
+
+
+def apply_outcome(rollup, outcome, sign=1):
+    """
+    Add (or with `sign` -1, remove) one outcome to a DailyRollup in memory.
+    Counts stop at zero, so a rollup that has drifted can't fail a job's save.
+    """
+    if outcome.status == 'FAILED':
+        rollup.failed = max(rollup.failed + sign, 0)
+    elif outcome.status == 'CANCELLED':
+        rollup.cancelled = max(rollup.cancelled + sign, 0)
+    else:
+        rollup.completed = max(rollup.completed + sign, 0)
+        if outcome.intensity:
+            counts = rollup.intensity_counts
+            counts[outcome.intensity] = max(counts.get(outcome.intensity, 0) + sign, 0)
+        if outcome.processing_time is not None:
+            rollup.processing_time_total = max(rollup.processing_time_total + sign * outcome.processing_time, 0)
+            histogram = rollup.processing_time_histogram
+            histogram.extend([0] * (len(PROCESSING_TIME_BOUNDS) + 1 - len(histogram)))
+            bucket = bisect.bisect_left(PROCESSING_TIME_BOUNDS, outcome.processing_time)
+            histogram[bucket] = max(histogram[bucket] + sign, 0)
+
+
+def record_transition(day, previous, current):
+    """Move one result's contribution to `day`'s rollup from the `previous` outcome to `current`"""
+    if previous == current:
+        return
+    with transaction.atomic():
+        DailyRollup.objects.get_or_create(day=day)
+        rollup = DailyRollup.objects.select_for_update().get(day=day)
+        if previous:
+            apply_outcome(rollup, previous, -1)
+        if current:
+            apply_outcome(rollup, current)
+        rollup.save()
+
+
+def record_result(result, previous=None):
+    """Bring the rollup up to date after `result` was saved; `previous` is its outcome_of before the change"""
+    record_transition(rollup_day(result), previous, outcome_of(result))
+
+
+def histogram_percentile(histogram, fraction):
+    """Processing time below which `fraction` of the histogram falls, interpolated within its bucket"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = PROCESSING_TIME_BOUNDS[index - 1] if index else 0
+            if index == len(PROCESSING_TIME_BOUNDS):
+                return lower
+            return lower + (PROCESSING_TIME_BOUNDS[index] - lower) * (rank - seen) / count
+        seen += count
+    return PROCESSING_TIME_BOUNDS[-1]
+
+
+def summarize(rollups):
+    """Combine DailyRollups into totals, rates and processing time percentiles"""
+    totals = DailyRollup(intensity_counts={}, processing_time_histogram=[0] * (len(PROCESSING_TIME_BOUNDS) + 1))
+    for rollup in rollups:
+        totals.completed += rollup.completed
+        totals.failed += rollup.failed
+        totals.cancelled += rollup.cancelled
+        totals.processing_time_total += rollup.processing_time_total
+        for intensity, count in rollup.intensity_counts.items():
+            totals.intensity_counts[intensity] = totals.intensity_counts.get(intensity, 0) + count
+        for index, count in enumerate(rollup.processing_time_histogram):
+            totals.processing_time_histogram[index] += count
+    return describe(totals)
+
+
+def describe(rollup):
+    """Display values for one DailyRollup (or combined totals)"""
+    labels = dict(AnalysisResult.INTENSITY_CHOICES)
+    intensities = [
+        {'code': code, 'label': labels[code], 'count': rollup.intensity_counts.get(code, 0),
+         'percentage': 100 * rollup.intensity_counts.get(code, 0) / rollup.completed if rollup.completed else 0}
+        for code, _label in AnalysisResult.INTENSITY_CHOICES
+    ]
+    return {
+        'day': rollup.day,
+        'completed': rollup.completed,
+        'failed': rollup.failed,
+        'cancelled': rollup.cancelled,
+        'failure_percentage': 100 * rollup.failure_rate if rollup.finished else None,
+        'mean_processing_time': rollup.mean_processing_time,
+        'p95_processing_time': histogram_percentile(rollup.processing_time_histogram, 0.95),
+        'intensities': intensities,
+    }
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute rollups from the stored results, for days from `since` on (all
+    days by default). Days with no results left keep their rollup, but results
+    already removed by retention drop out of any day that is rebuilt, so only
+    use it to backfill or to repair recent days. Returns the number of days written.
+    """
+    results = AnalysisResult.objects.filter(status__in=AnalysisResult.TERMINAL_STATUSES)
+    if since:
+        results = results.filter(created_at__date__gte=since)
+    rollups = {}
+    fields = ('created_at', 'status', 'change_intensity', 'processing_time')
+    for created_at, status, intensity, processing_time in results.values_list(*fields).iterator():
+        day = timezone.localdate(created_at)
+        rollup = rollups.setdefault(day, DailyRollup(day=day, intensity_counts={}, processing_time_histogram=[]))
+        if status == 'COMPLETE':
+            apply_outcome(rollup, Outcome(status, intensity, processing_time))
+        else:
+            apply_outcome(rollup, Outcome(status))
+
+    with transaction.atomic():
+        for day, rollup in rollups.items():
+            DailyRollup.objects.update_or_create(day=day, defaults={
+                'completed': rollup.completed,
+                'failed': rollup.failed,
+                'cancelled': rollup.cancelled,
+                'intensity_counts': rollup.intensity_counts,
+                'processing_time_total': rollup.processing_time_total,
+                'processing_time_histogram': rollup.processing_time_histogram,
+            })
+    logger.info("Rebuilt rollups for %s days", len(rollups))
+    return len(rollups)
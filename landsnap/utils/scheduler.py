@@ -0,0 +1,127 @@
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, F, FloatField, IntegerField, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+from ..models import AnalysisResult
+
+ANONYMOUS_CLIENT = ''
+POSITIONS_CACHE_KEY = 'landsnap:queue_positions'
+PENDING_FIELDS = ('pk', 'priority', 'upload__ip_address', 'estimated_memory', 'estimated_seconds', 'queued_at')
+
+
+def pending_jobs(depth=None, now=None):
+    """
+    PENDING results as dicts of the fields the scheduler looks at. With
+    `depth`, only the first `depth` jobs of each client's queue in job_key
+    order, which are all `schedule` can reach before any client's queue runs
+    out; ranked by a window function, so the database does the cutting.
+    """
+    pending = AnalysisResult.objects.filter(status='PENDING')
+    if depth is None:
+        return list(pending.values(*PENDING_FIELDS))
+
+    now = now or timezone.now()
+    overdue = Q(queued_at__lt=now - timedelta(seconds=settings.LANDSNAP_SCHEDULER_MAX_WAIT))
+    # job_key in SQL: overdue jobs first by arrival, then priority class and shortest first
+    key = [
+        Case(When(overdue, then=Value(-1)), default=F('priority'), output_field=IntegerField()).asc(),
+        Case(When(overdue, then=Value(0.0)), default=Coalesce('estimated_seconds', Value(0.0)),
+             output_field=FloatField()).asc(),
+        Coalesce('queued_at', Value(now), output_field=DateTimeField()).asc(),
+    ]
+    ranked = pending.annotate(rank=Window(RowNumber(), partition_by=[F('upload__ip_address')], order_by=key))
+    return list(ranked.filter(rank__lte=depth).values(*PENDING_FIELDS))
+
+
+def recent_usage(now=None):
+    """Estimated CPU seconds started per client within LANDSNAP_FAIR_SHARE_WINDOW"""
+    since = (now or timezone.now()) - timedelta(seconds=settings.LANDSNAP_FAIR_SHARE_WINDOW)
+    rows = (AnalysisResult.objects.filter(started_at__gte=since)
+            .values('upload__ip_address').annotate(seconds=Sum('estimated_seconds')))
+    return {row['upload__ip_address'] or ANONYMOUS_CLIENT: row['seconds'] or 0 for row in rows}
+
+
+def job_key(job, now):
+    """
+    Order of jobs within one client's queue. Jobs waiting longer than
+    LANDSNAP_SCHEDULER_MAX_WAIT jump ahead in arrival order so large and
+    batch jobs cannot starve; the rest go by priority class, then shortest first.
+    """
+    queued_at = job['queued_at'] or now
+    if (now - queued_at).total_seconds() > settings.LANDSNAP_SCHEDULER_MAX_WAIT:
+        return (-1, 0, queued_at)
+    return (job['priority'], job['estimated_seconds'] or 0, queued_at)
+
+
+def schedule(jobs, usage, now=None):
+    """
+    Order pending jobs the way workers will take them.
+
+    The next job comes from whichever client's best job has the highest
+    priority, breaking ties by the client that used the least estimated CPU
+    time in the fair-share window, then by arrival. Each pick charges its
+    estimate to the client, so a bulk submitter is interleaved with everyone else.
+    """
+    now = now or timezone.now()
+    usage = defaultdict(float, usage)
+    queues = defaultdict(list)
+    for job in jobs:
+        queues[job['upload__ip_address'] or ANONYMOUS_CLIENT].append(job)
+    for queue in queues.values():
+        queue.sort(key=lambda job: job_key(job, now), reverse=True)
+
+    heap = [(job_key(queue[-1], now)[0], usage[client], job_key(queue[-1], now)[2], client)
+            for client, queue in queues.items()]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        _cls, _usage, _queued_at, client = heapq.heappop(heap)
+        job = queues[client].pop()
+        order.append(job)
+        usage[client] += job['estimated_seconds'] or 0
+        if queues[client]:
+            head = job_key(queues[client][-1], now)
+            heapq.heappush(heap, (head[0], usage[client], head[2], client))
+    return order
+
+
+def pending_order(now=None, depth=None):
+    """
+    Pending jobs in the order workers will take them. With `depth`, only as
+    far as each client's first `depth` jobs, which is what claiming a job needs.
+    """
+    now = now or timezone.now()
+    return schedule(pending_jobs(depth, now), recent_usage(now), now)
+
+
+def ranked_positions(refresh=False):
+    """
+    1-based scheduling position of every PENDING result, keyed by pk. Ranking
+    the whole queue is too slow to repeat for every progress poll, so the
+    ranking is cached for LANDSNAP_QUEUE_POSITION_TTL seconds.
+    """
+    positions = None if refresh else cache.get(POSITIONS_CACHE_KEY)
+    if positions is None:
+        positions = {job['pk']: index for index, job in enumerate(pending_order(), 1)}
+        cache.set(POSITIONS_CACHE_KEY, positions, settings.LANDSNAP_QUEUE_POSITION_TTL)
+    return positions
+
+
+def queue_positions(results):
+    """Scheduling position of each PENDING result, keyed by pk"""
+    pending = {result.pk for result in results if result.status == 'PENDING'}
+    if not pending:
+        return {}
+    positions = ranked_positions()
+    if not pending <= positions.keys():
+        # Queued since the ranking was cached
+        positions = ranked_positions(refresh=True)
+    return {pk: positions[pk] for pk in pending if pk in positions}
+
+
+def queue_position(result):
+    return queue_positions([result]).get(result.pk)
@@ -1,37 +1,135 @@
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from PIL import Image
 import os
 
 MAX_FILE_SIZE = 10 * 1024 * 1024
 MIN_DIMENSION = 500
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png']
+# GeoTIFF/BigTIFF scenes are read window by window, so they get far larger limits
+RASTER_EXTENSIONS = ['tif', 'tiff']
+MAX_RASTER_FILE_SIZE = 4 * 1024 * 1024 * 1024
+MAX_RASTER_DIMENSION = 40000
+FORMAT_SIGNATURES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'tiff': (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'),
+}
+EXTENSION_FORMATS = {'jpg': ('jpeg',), 'jpeg': ('jpeg',), 'png': ('png',), 'tif': ('tiff',), 'tiff': ('tiff',)}
+
+
+def is_raster_file(image):
+    return os.path.splitext(image.name)[1].lstrip('.').lower() in RASTER_EXTENSIONS
+
+
+def raster_dimensions(image):
+    """Read (width, height) from a TIFF header without decoding any pixels"""
+    import tifffile
+    image.seek(0)
+    try:
+        with tifffile.TiffFile(image) as tif:
+            page = tif.pages[0]
+            return page.imagewidth, page.imagelength
+    finally:
+        image.seek(0)
 
 def validate_image_size(image):
     """Validate that image size is within acceptable limits"""
-    if image.size > MAX_FILE_SIZE:
+    max_size = MAX_RASTER_FILE_SIZE if is_raster_file(image) else MAX_FILE_SIZE
+    if image.size > max_size:
         raise ValidationError(
             _('Image size must be less than %(max_size)sMB.'),
-            params={'max_size': MAX_FILE_SIZE // (1024 * 1024)},
+            params={'max_size': max_size // (1024 * 1024)},
+            code='image_too_large'
+        )
+
+def check_dimensions(width, height, raster=False):
+    """Raise ValidationError unless width x height is within the limits for its type"""
+    if raster and (width > MAX_RASTER_DIMENSION or height > MAX_RASTER_DIMENSION):
+        raise ValidationError(
+            _('Raster too large (%(width)sx%(height)s). Maximum dimensions: %(max_dim)sx%(max_dim)s pixels.'),
+            params={'width': width, 'height': height, 'max_dim': MAX_RASTER_DIMENSION},
             code='image_too_large'
         )
+    if width < MIN_DIMENSION or height < MIN_DIMENSION:
+        raise ValidationError(
+            _('Image too small (%(width)sx%(height)s). Minimum dimensions: %(min_dim)sx%(min_dim)s pixels.'),
+            params={
+                'width': width,
+                'height': height,
+                'min_dim': MIN_DIMENSION
+            },
+            code='image_too_small'
+        )
+
+
+def sniff_format(head):
+    """Image format from a file's leading bytes ('png', 'jpeg', 'tiff'), or None if unrecognised"""
+    for fmt, signatures in FORMAT_SIGNATURES.items():
+        if any(head.startswith(signature) for signature in signatures):
+            return fmt
+    return None
+
+
+def read_image_header(path, name, complete):
+    """
+    Check a possibly partial upload from its header alone: the format must
+    match the extension and the dimensions must be within limits.
+
+    Returns (width, height) once the header has arrived, or None if more
+    bytes are needed. Raises ValidationError as soon as the file is known to
+    be unacceptable; with `complete`, an unreadable header is an error too.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if len(head) < 8:
+        if complete:
+            raise ValidationError(_('Invalid image: file is truncated'), code='image_invalid')
+        return None
+    ext = os.path.splitext(name)[1].lstrip('.').lower()
+    fmt = sniff_format(head)
+    if fmt is None or fmt not in EXTENSION_FORMATS.get(ext, ()):
+        raise ValidationError(
+            _('File content does not match its extension. Only JPG, PNG and TIFF are allowed.'),
+            code='invalid_extension'
+        )
+
+    try:
+        if fmt == 'tiff':
+            import tifffile
+            with tifffile.TiffFile(path) as tif:
+                page = tif.pages[0]
+                width, height = page.imagewidth, page.imagelength
+        else:
+            from PIL import Image
+            with Image.open(path) as img:
+                width, height = img.size
+    except Exception as e:
+        # The header (or the TIFF's first IFD) may simply not have arrived yet
+        if not complete:
+            return None
+        raise ValidationError(
+            _('Invalid image: %(error)s'),
+            params={'error': str(e)},
+            code='image_invalid'
+        )
+    check_dimensions(width, height, raster=(fmt == 'tiff'))
+    return width, height
+
 
 def validate_image_dimensions(image):
-    """Validate that image meets minimum dimension requirements"""
+    """Validate that image meets minimum dimension requirements and return its (width, height)"""
     try:
+        if is_raster_file(image):
+            width, height = raster_dimensions(image)
+        else:
+            from PIL import Image
+
+            image.seek(0)
+            with Image.open(image) as img:
+                width, height = img.size
+        check_dimensions(width, height, raster=is_raster_file(image))
         image.seek(0)
-        with Image.open(image) as img:
-            width, height = img.size
-            if width < MIN_DIMENSION or height < MIN_DIMENSION:
-                raise ValidationError(
-                    _('Image too small (%(width)sx%(height)s). Minimum dimensions: %(min_dim)sx%(min_dim)s pixels.'),
-                    params={
-                        'width': width,
-                        'height': height,
-                        'min_dim': MIN_DIMENSION
-                    },
-                    code='image_too_small'
-                )
-        image.seek(0)
+        return width, height
     except Exception as e:
         image.seek(0) 
         raise ValidationError(
@@ -41,10 +139,9 @@ def validate_image_dimensions(image):
         )
 def validate_image_extension(image):
     """Validate file extension (though accept attribute in form should handle this)"""
-    ext = os.path.splitext(image.name)[1].lower()
-    valid_extensions = ['.jpg', '.jpeg', '.png']
-    if ext not in valid_extensions:
+    ext = os.path.splitext(image.name)[1].lstrip('.').lower()
+    if ext not in IMAGE_EXTENSIONS + RASTER_EXTENSIONS:
         raise ValidationError(
-            _('Unsupported file extension. Only JPG and PNG are allowed.'),
+            _('Unsupported file extension. Only JPG, PNG and TIFF are allowed.'),
             code='invalid_extension'
         )
\ No newline at end of file
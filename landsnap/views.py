@@ -1,91 +1,117 @@
-import time
 import uuid
+import ipaddress
 import os
-from venv import logger
+import logging
+from io import BytesIO
+from datetime import timedelta
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import View, DetailView, ListView, TemplateView
 from django.core.exceptions import ValidationError
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.urls import reverse
 from django.db import transaction
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from .forms import UploadForm
-from .models import ImageUpload, AnalysisResult
-from .utils.image_utils import generate_heatmap, calculate_changes
-import logging
-from django.views import View
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from io import BytesIO
-from PIL import Image
+from .jobs import INLINE_WORKER, inline_lease, request_cancel
+from .models import ImageUpload, AnalysisResult, DailyRollup
+from .storage import PREVIEW_SIDECAR_SUFFIX
+from .tracing import current_span, span, traced_view
+from .utils.admission import AdmissionRejected, admit, combined_cost, current_load, estimate_cost
+from .utils.chunked import close_files, release_files, session_files
+from .utils.roi import roi_area
+from .utils.rollups import describe, outcome_of, record_result, summarize
+from .utils.scheduler import queue_position
+from .utils.validators import is_raster_file
+
+# Imaging and PDF libraries (cv2, numpy, reportlab, Pillow) are imported inside
+# the views that need them, so web workers serving pages and progress polls
+# don't pay for them. Analysis itself runs in `manage.py runworker` unless
+# LANDSNAP_INLINE_ANALYSIS is on.
 
 logger = logging.getLogger(__name__)
 
-class UploadView(View):
-    logger = logging.getLogger(__name__)
+
+def is_trusted_proxy(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in settings.LANDSNAP_TRUSTED_PROXIES)
+
 
 class UploadView(View):
     template_name = 'landsnap/upload.html'
 
     def get_client_ip(self, request):
         """
-        Get the client's IP address from the request object
+        Get the client's IP address from the request object. X-Forwarded-For
+        is only believed when the connection comes from one of
+        LANDSNAP_TRUSTED_PROXIES, and then only up to the first address that
+        isn't a trusted proxy, since anything further left is client-supplied.
         """
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
+        ip = request.META.get('REMOTE_ADDR')
+        forwarded = [addr.strip() for addr in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if addr.strip()]
+        while forwarded and is_trusted_proxy(ip):
+            ip = forwarded.pop()
         return ip
 
     def get(self, request, *args, **kwargs):
         form = UploadForm()
         return render(request, self.template_name, {'form': form})
 
+    @traced_view('UploadView.post')
     def post(self, request, *args, **kwargs):
-        form = UploadForm(request.POST, request.FILES)
-        
-        if not form.is_valid():
+        # Files arrive either in this request or beforehand as resumable uploads
+        try:
+            files = request.FILES or session_files(request.POST)
+        except ValidationError as e:
+            errors = {field: error[0] for field, error in e.message_dict.items()}
+            return JsonResponse({'error': 'Form validation failed', 'errors': errors}, status=400)
+        try:
+            return self.submit(request, files)
+        finally:
+            # Stored uploads were released already; this closes any left unread or refused
+            close_files(files)
+
+    def submit(self, request, files):
+        form = UploadForm(request.POST, files)
+
+        with span('form.validate'):
+            valid = form.is_valid()
+        if not valid:
             errors = {field: error[0] for field, error in form.errors.items()}
-            logger.warning(f"Form validation failed: {errors}")
+            logger.warning("Form validation failed: %s", errors)
             return JsonResponse({
                 'error': 'Form validation failed',
                 'errors': errors
             }, status=400)
 
         try:
-            with transaction.atomic():
-                
-                # Save upload with IP address
-                upload = form.save(commit=False)
-                upload.ip_address = self.get_client_ip(request)
-                upload.result_id = uuid.uuid4()
-                upload.save()
-                logger.info(f"Created upload instance: {upload.id}")
-
-                result = AnalysisResult.objects.create(
-                    upload=upload,
-                    status='PROCESSING'
-                )
-                logger.info(f"Created analysis result: {result.id}")
-
-                try:
-                    self.process_images_async(upload.id)
-                    logger.info(f"Started processing for upload {upload.id}")
-                except Exception as e:
-                    logger.error(f"Failed to start processing: {str(e)}")
-                    raise
+            upload = self.create_upload(form, self.get_client_ip(request))
+            current_span().set('landsnap.result_id', str(upload.result_id))
 
-                return JsonResponse({
-                    'redirect_url': reverse(
-                        'landsnap:processing', 
-                        kwargs={'result_id': str(upload.result_id)}
-                    )
-                })
+            return JsonResponse({
+                'redirect_url': reverse(
+                    'landsnap:processing', 
+                    kwargs={'result_id': str(upload.result_id)}
+                )
+            })
 
+        except AdmissionRejected as e:
+            logger.warning("Upload rejected, analysis capacity exhausted (retry after %ss)", e.retry_after)
+            response = JsonResponse({
+                'error': 'The server is busy. Please try again shortly.',
+                'type': 'busy',
+                'retry_after': e.retry_after
+            }, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         except ValidationError as e:
-            logger.warning(f"Validation error: {str(e)}")
+            logger.warning("Validation error: %s", e)
             return JsonResponse({
                 'error': str(e),
                 'type': 'validation_error'
@@ -97,46 +123,123 @@ class UploadView(View):
                 'type': 'server_error'
             }, status=500)
 
+    def job_cost(self, form):
+        """Estimated memory and CPU cost of analysing a validated UploadForm"""
+        instance = form.instance
+        roi = form.cleaned_data.get('roi')
+        return estimate_cost(instance.width, instance.height, is_raster_file(form.cleaned_data['image1']),
+                             roi_pixels=roi_area(roi) if roi else None)
+
+    def create_upload(self, form, ip_address, priority=AnalysisResult.PRIORITY_INTERACTIVE):
+        """
+        Save a validated UploadForm with its pending result and start processing.
+        Raises AdmissionRejected when there is no capacity to accept the job.
+        """
+        upload, = self.save_uploads([form], ip_address, priority)
+        if not settings.LANDSNAP_INLINE_ANALYSIS:
+            logger.info("Queued upload %s for an analysis worker", upload.id)
+            return upload
+
+        self.process_inline(upload)
+        return upload
+
+    def process_inline(self, upload):
+        with span('upload.process', result_id=upload.result_id):
+            try:
+                self.process_images_async(upload.id)
+                logger.info("Started processing for upload %s", upload.id)
+            except Exception as e:
+                logger.error("Failed to start processing: %s", e)
+                raise
+
+    def save_uploads(self, forms, ip_address, priority=AnalysisResult.PRIORITY_INTERACTIVE):
+        """
+        Admit validated UploadForms as one job and save them with their results
+        in one transaction, so a batch is accepted or refused as a whole.
+        With inline analysis the results are saved as running, for the caller
+        to analyse; otherwise they are queued for the workers.
+        Raises AdmissionRejected when there is no capacity to accept them.
+        """
+        costs = [self.job_cost(form) for form in forms]
+        inline = settings.LANDSNAP_INLINE_ANALYSIS
+        stored = []
+        try:
+            # Hash and store the originals first: admission holds a lock that
+            # every other upload and job claim waits on, so it only covers the rows
+            with span('file.save'):
+                for form in forms:
+                    stored += self.store_files(form.instance)
+            # Commit before analysing so concurrent admission checks see these jobs running
+            with span('db.transaction'), transaction.atomic():
+                with span('admission', {'landsnap.pairs': len(forms)}):
+                    admit(combined_cost(costs), priority=priority)
+                uploads = [self.save_upload(form, cost, ip_address, priority, inline)
+                           for form, cost in zip(forms, costs)]
+        except BaseException:
+            # Drop the references taken for a batch that was refused or failed
+            for field_file in stored:
+                field_file.storage.delete(field_file.name)
+            raise
+        for form in forms:
+            release_files(form.files)
+        return uploads
+
+    def store_files(self, upload):
+        """Save an unsaved upload's originals to storage, returning the files stored"""
+        stored = []
+        for field_file in (upload.image1, upload.image2):
+            if field_file and not field_file._committed:
+                field_file.save(field_file.name, field_file.file, save=False)
+                stored.append(field_file)
+        return stored
+
+    def save_upload(self, form, cost, ip_address, priority, inline):
+        result_id = uuid.uuid4()
+        with span('upload.create', {'landsnap.priority': priority}, result_id=result_id) as created:
+            upload = form.save(commit=False)
+            upload.ip_address = ip_address
+            upload.result_id = result_id
+            upload.save()
+            logger.info("Created upload instance: %s", upload.id)
+
+            now = timezone.now()
+            result = AnalysisResult.objects.create(
+                upload=upload,
+                status='PROCESSING' if inline else 'PENDING',
+                priority=priority,
+                queued_at=now,
+                started_at=now if inline else None,
+                queue_wait=0 if inline else None,
+                worker_id=INLINE_WORKER if inline else '',
+                lease_expires_at=inline_lease(cost.seconds, now) if inline else None,
+                attempts=1 if inline else 0,
+                estimated_memory=cost.memory,
+                estimated_seconds=cost.seconds,
+                roi=form.cleaned_data.get('roi'),
+                # Lets the worker continue this request's trace
+                metadata={'traceparent': created.traceparent} if created.traceparent else None
+            )
+            logger.info("Created analysis result: %s", result.id)
+        return upload
+
     def process_images_async(self, upload_id):
         """Process images with comprehensive error handling"""
+        from .utils.analysis import analyze_upload
+
         try:
             upload = ImageUpload.objects.get(id=upload_id)
             result = upload.analysis_result
-            result.change_percentage = calculate_changes(upload.image1.path, upload.image2.path) or 0.0
-            result.save()
-            
-            logger.info(f"Starting image processing for upload {upload_id}")
-            
-            for img_field in ['image1', 'image2']:
-                img_path = getattr(upload, img_field).path
-                if not os.path.exists(img_path):
-                    raise FileNotFoundError(f"{img_field} not found at {img_path}")
-                logger.debug(f"{img_field} exists at {img_path}")
-
-            start_time = time.time()
-            
-            try:
-                heatmap = generate_heatmap(upload.image1.path, upload.image2.path)
-                change_percentage = calculate_changes(upload.image1.path, upload.image2.path)
-            except Exception as e:
-                raise RuntimeError(f"Image processing failed: {str(e)}")
-
-            processing_time = round(time.time() - start_time, 2)
-            
-            result.heatmap = heatmap
-            result.change_percentage = change_percentage
-            result.processing_time = processing_time
-            result.status = 'COMPLETE'
-            result.save()
-            
-            logger.info(f"Successfully processed upload {upload_id} in {processing_time}s")
+            logger.info("Starting image processing for upload %s", upload_id)
+            analyze_upload(upload)
 
         except Exception as e:
-            logger.exception(f"Image processing failed for upload {upload_id}")
+            logger.exception("Image processing failed for upload %s", upload_id)
             if 'result' in locals():
+                previous = outcome_of(result)
                 result.status = 'FAILED'
                 result.error_message = str(e)
                 result.save()
+                record_result(result, previous)
             raise 
 class ProcessingView(TemplateView):
     template_name = 'landsnap/processing.html'
@@ -146,8 +249,6 @@ class ProcessingView(TemplateView):
         context['result_id'] = self.kwargs.get('result_id')
         return context
 
-logger = logging.getLogger(__name__)
-
 class AnalysisProgressView(View):
     def get(self, request, result_id):
         """
@@ -166,7 +267,9 @@ class AnalysisProgressView(View):
                 'progress': self.calculate_progress(result.status),
             }
             
-            if result.status == 'COMPLETE':
+            if result.status == 'PENDING':
+                response_data.update(self.queue_info(result))
+            elif result.status == 'COMPLETE':
                 response_data.update({
                     'redirect_url': reverse(
                         'landsnap:analysis_result',
@@ -175,18 +278,29 @@ class AnalysisProgressView(View):
                     'change_percentage': result.change_percentage,
                     'processing_time': result.processing_time
                 })
-            elif result.status == 'FAILED':
+            elif result.status in ('FAILED', 'CANCELLED'):
                 response_data['error'] = result.error_message
+            if result.status == 'PROCESSING':
+                response_data['cancel_requested'] = result.cancel_requested
             
             return JsonResponse(response_data)
             
         except Exception as e:
-            logger.error(f"Progress check failed for {result_id}: {str(e)}")
+            logger.error("Progress check failed for %s: %s", result_id, e)
             return JsonResponse({
                 'error': str(e) if settings.DEBUG else 'Analysis status unavailable',
                 'status': 'ERROR'
             }, status=500)
 
+    def queue_info(self, result):
+        """Queue position and current load for a result still waiting for a worker"""
+        load = current_load()
+        return {
+            'queue_position': queue_position(result),
+            'queue_length': load.queued,
+            'running': load.running,
+        }
+
     def calculate_progress(self, status):
         """Calculate progress percentage based on analysis status"""
         PROGRESS_MAP = {
@@ -194,9 +308,26 @@ class AnalysisProgressView(View):
             'PROCESSING': 50,
             'COMPLETE': 100,
             'FAILED': 100,
+            'CANCELLED': 100,
             'ERROR': 0
         }
         return PROGRESS_MAP.get(status, 0)
+class CancelAnalysisView(View):
+    def post(self, request, result_id):
+        """
+        Cancel a queued or running analysis
+        POST /cancel/<uuid:result_id>/
+        """
+        result = get_object_or_404(AnalysisResult, upload__result_id=result_id)
+        if not request_cancel(result):
+            return JsonResponse({
+                'error': 'This analysis can no longer be cancelled',
+                'status': result.status
+            }, status=409)
+        result.refresh_from_db()
+        logger.info("Cancellation requested for result %s", result_id)
+        return JsonResponse({'status': result.status, 'cancel_requested': result.cancel_requested})
+
 class ResultsListView(ListView):
     model = AnalysisResult
     template_name = 'landsnap/result.html'
@@ -209,6 +340,28 @@ class ResultsListView(ListView):
 class AboutView(TemplateView):
     template_name = 'landsnap/about.html'
 
+@method_decorator(staff_member_required, name='dispatch')
+class DashboardView(TemplateView):
+    """Volume, outcomes and speed of analyses per day, read from the daily rollups"""
+    template_name = 'landsnap/dashboard.html'
+    PERIODS = (7, 30, 90, 365)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            days = int(self.request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        days = min(max(days, 1), self.PERIODS[-1])
+        rollups = list(DailyRollup.objects.filter(day__gt=timezone.localdate() - timedelta(days=days)))
+        context.update({
+            'days': days,
+            'periods': self.PERIODS,
+            'totals': summarize(rollups),
+            'daily': [describe(rollup) for rollup in rollups],
+        })
+        return context
+
 class AnalysisResultView(DetailView):
     template_name = 'landsnap/result.html'
     context_object_name = 'result'
@@ -224,21 +377,11 @@ class AnalysisResultView(DetailView):
         result = context['result']
         
         context.update({
-            'change_intensity': self.get_change_intensity(result.change_percentage),
+            'change_intensity': result.get_change_intensity_display(),
             'processing_efficiency': self.get_processing_efficiency(result.processing_time),
         })
         return context
 
-    def get_change_intensity(self, percentage):
-        """Categorize change percentage for display"""
-        if percentage < 5:
-            return 'Minimal'
-        elif percentage < 20:
-            return 'Moderate'
-        elif percentage < 50:
-            return 'Significant'
-        return 'Dramatic'
-
     def get_processing_efficiency(self, seconds):
         """Categorize processing time"""
         if seconds < 5:
@@ -248,6 +391,14 @@ class AnalysisResultView(DetailView):
         return 'Slow'
 
 class DownloadHeatmapView(View):
+    CONTENT_TYPES = {
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'webp': 'image/webp',
+    }
+    ENCODINGS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'webp': 'webp'}
+
     def get(self, request, result_id, format):
         result = get_object_or_404(AnalysisResult, upload__result_id=result_id)
         
@@ -256,22 +407,44 @@ class DownloadHeatmapView(View):
 
         if format == 'pdf':
             return self.generate_pdf(result)
-        else:
+        elif format in self.CONTENT_TYPES:
             return self.generate_image(result, format)
+        return HttpResponse("Unsupported format", status=404)
+
+    def heatmap_bytes(self, result, format):
+        """Heatmap encoded as `format`, served straight from storage when it already matches"""
+        stored_ext = os.path.splitext(result.heatmap.name)[1].lstrip('.').lower()
+        if not result.heatmap_is_mask and self.ENCODINGS.get(stored_ext) == self.ENCODINGS[format]:
+            with result.heatmap.open('rb') as f:
+                return f.read()
+
+        import cv2
+        from .utils.image_utils import encode_heatmap, render_heatmap_from_mask
+
+        if result.heatmap_is_mask:
+            composite = render_heatmap_from_mask(result.upload.image2.path, result.heatmap.path, result.roi)
+        else:
+            composite = cv2.imread(result.heatmap.path)
+        data, _ = encode_heatmap(composite, self.ENCODINGS[format])
+        return data
 
     def generate_pdf(self, result):
+        from PIL import Image
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+
         buffer = BytesIO()
         p = canvas.Canvas(buffer, pagesize=letter)
         
         # Add heatmap image
-        img_path = result.heatmap.path
-        img = Image.open(img_path)
+        img = Image.open(BytesIO(self.heatmap_bytes(result, 'png')))
         img_width, img_height = img.size
         aspect = img_height / float(img_width)
         width = 500
         height = width * aspect
         
-        p.drawImage(img_path, 50, 700 - height, width=width, height=height)
+        p.drawImage(ImageReader(img), 50, 700 - height, width=width, height=height)
         
         # Add metadata
         p.setFont("Helvetica", 12)
@@ -286,9 +459,42 @@ class DownloadHeatmapView(View):
         response['Content-Disposition'] = f'attachment; filename="heatmap_{result.upload.result_id}.pdf"'
         return response
 
-    def generate_image(self, result, format):
-        img_path = result.heatmap.path
-        with open(img_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type=f'image/{format}')
+    def generate_image(self, result, format, attachment=True):
+        response = HttpResponse(self.heatmap_bytes(result, format), content_type=self.CONTENT_TYPES[format])
+        if attachment:
             response['Content-Disposition'] = f'attachment; filename="heatmap_{result.upload.result_id}.{format}"'
-            return response
\ No newline at end of file
+        return response
+
+
+class HeatmapImageView(DownloadHeatmapView):
+    """Inline heatmap for the result page, rendered from the mask when needed"""
+
+    def get(self, request, result_id):
+        result = get_object_or_404(AnalysisResult, upload__result_id=result_id)
+        if not result.heatmap:
+            return HttpResponse("No heatmap available", status=404)
+        return self.generate_image(result, 'png', attachment=False)
+
+
+class AfterPreviewView(View):
+    """
+    Downscaled after image that the result page draws the change overlay on.
+    Workers write it during analysis; it is only rendered here for results
+    from before overlays existed or whose original was recompressed.
+    """
+    # Originals are content-addressed and their pixels never change
+    CACHE_SECONDS = 7 * 24 * 3600
+
+    def get(self, request, result_id):
+        result = get_object_or_404(AnalysisResult.objects.select_related('upload'), upload__result_id=result_id)
+        image_path = result.upload.image2.path
+        path = image_path + PREVIEW_SIDECAR_SUFFIX
+        if not os.path.exists(path):
+            from .utils.image_utils import process_image, write_preview
+
+            path = write_preview(image_path, process_image(image_path))
+            if path is None:
+                raise Http404("Preview unavailable")
+        response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+        response['Cache-Control'] = f'public, max-age={self.CACHE_SECONDS}'
+        return response